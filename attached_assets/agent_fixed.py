@@ -1,28 +1,417 @@
 import os
+import re
+import copy
 import json
+import time
+import uuid
+import queue
+import atexit
+import hashlib
+import functools
 import logging
+import threading
+import weakref
 import requests
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+try:
+    import orjson
+except ImportError:  # orjson is an optional accelerator; fall back to the standard library
+    orjson = None
+try:
+    import tiktoken
+except ImportError:  # without tiktoken, prompt sizes are estimated from character counts
+    tiktoken = None
+try:
+    from utils.mermaid_validator import validate_mermaid_syntax
+except ImportError:  # without the validator, documentation keeps its diagrams as generated
+    validate_mermaid_syntax = None
+try:
+    from utils.mermaid_viewer import enhance_markdown_with_tabs
+except ImportError:  # the tabbed diagram viewer is optional; documentation keeps plain Mermaid blocks
+    enhance_markdown_with_tabs = None
 from utils.observability import agent_monitor, observability_tracker
 from utils.mcp_client import mcp_client
 from utils.llm_selector import llm_selector
-from utils.groq_client import mk_groq_client, get_groq_models, analyze_cobol_with_groq
+from utils.groq_client import mk_groq_client, get_groq_models, analyze_cobol_with_groq, generate_with_groq
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+def _json_loads(text):
+    """Parse JSON text, using orjson when available"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def _json_dumps_compact(obj):
+    """Serialize to compact JSON for prompts, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"))
+
+# Patterns compiled once at import; these run for every program analyzed
+_PROGRAM_ID_RE = re.compile(r'PROGRAM-ID\s*\.\s*([\w-]+)', re.IGNORECASE)
+_DIVISION_RE = re.compile(r'([\w-]+)\s+DIVISION', re.IGNORECASE)
+# Single-pass scanner for both PROGRAM-ID and division headers
+_PROGRAM_OUTLINE_RE = re.compile(
+    r'PROGRAM-ID\s*\.\s*(?P<program_id>[\w-]+)|(?P<division>[\w-]+)\s+DIVISION',
+    re.IGNORECASE
+)
+_JSON_BLOCK_RE = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
+_MERMAID_BLOCK_RE = re.compile(r'```mermaid\s*([\s\S]*?)\s*```')
+_DOC_TITLE_RE = re.compile(r'(^|\n)#\s+(.*?Documentation|Documentation for.*?)(\n|$)', re.IGNORECASE)
+_FIRST_HEADING_RE = re.compile(r'(^|\n)#\s+')
+_PERFORM_TARGET_RE = re.compile(r'\bPERFORM\s+([\w-]+)(?:\s+(?:THRU|THROUGH)\s+([\w-]+))?', re.IGNORECASE)
+_PARAGRAPH_END_RE = re.compile(r'\b(?:STOP\s+RUN|GOBACK|EXIT\s+PROGRAM)\b', re.IGNORECASE)
+_FLOW_DIAGRAM_RE = re.compile(r'```mermaid\s*(?:flowchart|graph)\b', re.IGNORECASE)
+
+# Largest paragraph count rendered in a generated program flowchart
+_FLOWCHART_MAX_PARAGRAPHS = 50
+
+_JSON_WHITESPACE_RE = re.compile(r'\s*')
+
+class _StreamingObjectParser:
+    """Incrementally parse a streamed JSON object, reporting each top-level member once it is complete
+    
+    Text before the opening brace (such as a Markdown code fence) is ignored. On malformed
+    input the parser stops reporting members; callers still parse the full text at the end.
+    """
+    
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._key = None
+    
+    def feed(self, chunk):
+        """Add a chunk of streamed text
+        
+        Args:
+            chunk (str): The next piece of the response
+            
+        Returns:
+            list: (key, value) pairs for members completed by this chunk
+        """
+        self._buffer += chunk
+        members = []
+        
+        # A member value can only be complete once a separator or closing brace follows it
+        if self._state == "value" and "," not in chunk and "}" not in chunk:
+            return members
+        
+        while self._state != "done":
+            pos = _JSON_WHITESPACE_RE.match(self._buffer, self._pos).end()
+            if pos >= len(self._buffer):
+                break
+            char = self._buffer[pos]
+            
+            if self._state == "start":
+                start = self._buffer.find("{", pos)
+                if start < 0:
+                    self._pos = len(self._buffer)
+                    break
+                self._pos = start + 1
+                self._state = "key"
+            elif self._state == "key":
+                if char != '"':
+                    self._state = "done"
+                    break
+                try:
+                    self._key, self._pos = self._decoder.raw_decode(self._buffer, pos)
+                except ValueError:
+                    break
+                self._state = "colon"
+            elif self._state == "colon":
+                if char != ":":
+                    self._state = "done"
+                    break
+                self._pos = pos + 1
+                self._state = "value"
+            elif self._state == "value":
+                try:
+                    value, end = self._decoder.raw_decode(self._buffer, pos)
+                except ValueError:
+                    break
+                # A number may still be growing until a separator or closing brace follows it
+                next_pos = _JSON_WHITESPACE_RE.match(self._buffer, end).end()
+                if next_pos >= len(self._buffer) or self._buffer[next_pos] not in ",}":
+                    break
+                members.append((self._key, value))
+                self._pos = end
+                self._state = "separator"
+            elif self._state == "separator":
+                if char == ",":
+                    self._pos = pos + 1
+                    self._state = "key"
+                else:
+                    self._state = "done"
+        
+        # Drop consumed text so the buffer only holds the member being streamed
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        return members
+
+# Shared pool for network-bound work that can overlap with the main pipeline
+_background_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cobol-agent")
+
+# Agent monitor calls are delivered in order by a single background worker so that
+# decision logging (and payload construction) stays off the request path
+_monitor_queue = queue.Queue()
+_monitor_worker = None
+_monitor_worker_lock = threading.Lock()
+# Put on the queue at exit to stop the worker once everything queued before it is delivered
+_MONITOR_STOP = object()
+# Longest the interpreter waits at exit for pending monitor calls
+_MONITOR_DRAIN_TIMEOUT_SECONDS = 5
+
+# Decision payloads keep at most this many characters of any string and items of any list;
+# the rest is replaced by a note of the full size
+_MONITOR_FIELD_MAX_CHARS = 2048
+_MONITOR_LIST_MAX_ITEMS = 50
+
+def _cap_monitor_payload(value):
+    """Truncate long strings and lists anywhere in a monitor payload to a prefix, keeping the rest as-is"""
+    if isinstance(value, str):
+        if len(value) <= _MONITOR_FIELD_MAX_CHARS:
+            return value
+        return f"{value[:_MONITOR_FIELD_MAX_CHARS]}... [truncated, {len(value)} chars]"
+    if isinstance(value, dict):
+        return {key: _cap_monitor_payload(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        capped = [_cap_monitor_payload(item) for item in value[:_MONITOR_LIST_MAX_ITEMS]]
+        if len(value) > _MONITOR_LIST_MAX_ITEMS:
+            capped.append(f"... [truncated, {len(value)} items]")
+        return capped
+    return value
+
+def _run_monitor_worker():
+    """Deliver queued monitor calls in order, evaluating lazy payloads on this thread"""
+    while True:
+        item = _monitor_queue.get()
+        if item is _MONITOR_STOP:
+            _monitor_queue.task_done()
+            return
+        func, args, kwargs = item
+        try:
+            kwargs = {key: _cap_monitor_payload(value() if callable(value) else value) for key, value in kwargs.items()}
+            func(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"Agent monitor call failed: {str(e)}")
+        finally:
+            _monitor_queue.task_done()
+
+def _queue_monitor_call(func, *args, **kwargs):
+    """Queue a call to the agent monitor, starting the worker on first use"""
+    global _monitor_worker
+    if _monitor_worker is None:
+        with _monitor_worker_lock:
+            if _monitor_worker is None:
+                _monitor_worker = threading.Thread(target=_run_monitor_worker, name="agent-monitor", daemon=True)
+                _monitor_worker.start()
+    _monitor_queue.put_nowait((func, args, kwargs))
+
+def _log_decision(session_id, decision_type, **fields):
+    """Record an agent decision asynchronously; callable field values are only evaluated by the worker"""
+    if not getattr(agent_monitor, "enabled", True):
+        return
+    _queue_monitor_call(agent_monitor.log_decision, decision_type, session_id=session_id, **fields)
+
+def _drain_monitor_queue():
+    """Deliver pending monitor calls before the interpreter exits, giving up after a deadline"""
+    worker = _monitor_worker
+    if worker is None or not worker.is_alive():
+        return
+    _monitor_queue.put_nowait(_MONITOR_STOP)
+    worker.join(_MONITOR_DRAIN_TIMEOUT_SECONDS)
+    if worker.is_alive():
+        logger.warning("Agent monitor calls still pending after %s seconds were dropped at exit",
+                       _MONITOR_DRAIN_TIMEOUT_SECONDS)
+
+atexit.register(_drain_monitor_queue)
+
+# Description given to the basic structure used when the model's analysis cannot be parsed
+ANALYSIS_FALLBACK_DESCRIPTION = "Could not automatically extract program description."
+
+# In-process cache of analysis results keyed by normalized source and prompt settings
+_ANALYSIS_CACHE_MAX_ITEMS = 128
+_ANALYSIS_CACHE_TTL_SECONDS = 3600
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=256)
+def _validate_mermaid_cached(mermaid_code):
+    """Validate and correct a Mermaid diagram, memoized since documentation often repeats diagrams"""
+    return validate_mermaid_syntax(mermaid_code)
+
+# Source embedded in the analysis prompt is kept under this many tokens; larger programs
+# are reduced to their division headers, record definitions and paragraph skeletons
+_PROMPT_CODE_TOKEN_BUDGET = 6000
+# Characters per token assumed when tiktoken is unavailable
+_CHARS_PER_TOKEN = 4
+_SKELETON_LINES_PER_PARAGRAPH = 5
+# Paragraph and section headers start in Area A (columns 8-11) of fixed-format source
+_PARAGRAPH_HEADER_RE = re.compile(r'^(?:.{6} {1,4}| {0,3})[A-Za-z0-9][\w-]*(?:\s+SECTION)?\s*\.\s*$')
+_RECORD_ENTRY_RE = re.compile(r'^.{0,11}?\b(?:01|77|FD|SD)\s+[\w-]+', re.IGNORECASE)
+
+@functools.lru_cache(maxsize=1)
+def _token_encoding():
+    """Load the tokenizer used for prompt budgeting, or None when tiktoken is unavailable"""
+    if tiktoken is None:
+        return None
+    try:
+        # Approximates the Llama tokenizer closely enough for budgeting
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding, estimating tokens from characters: {str(e)}")
+        return None
+
+def _count_tokens(text):
+    """Count prompt tokens with tiktoken, or estimate them from the character count"""
+    encoding = _token_encoding()
+    if encoding is None:
+        return len(text) // _CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+def _cobol_skeleton(cobol_code, lines_per_paragraph):
+    """Reduce COBOL source to division and section headers, record definitions, and the
+    first lines of each paragraph, marking where lines were omitted"""
+    skeleton = []
+    in_procedure = False
+    paragraph_lines = 0
+    omitted = 0
+    for line in cobol_code.splitlines():
+        # Columns 73-80 of fixed-format source are an identification area, not code
+        code_area = line[:72]
+        division_match = _DIVISION_RE.search(code_area)
+        if division_match:
+            in_procedure = division_match.group(1).upper() == "PROCEDURE"
+        
+        if division_match or _PROGRAM_ID_RE.search(code_area) or _PARAGRAPH_HEADER_RE.match(code_area):
+            keep = True
+            paragraph_lines = 0
+        elif in_procedure:
+            paragraph_lines += 1
+            keep = paragraph_lines <= lines_per_paragraph
+        else:
+            keep = bool(_RECORD_ENTRY_RE.match(code_area))
+        
+        if keep:
+            if omitted:
+                skeleton.append(f"      * ... {omitted} lines omitted")
+                omitted = 0
+            skeleton.append(line)
+        else:
+            omitted += 1
+    if omitted:
+        skeleton.append(f"      * ... {omitted} lines omitted")
+    return "\n".join(skeleton)
+
+def _fit_cobol_to_budget(cobol_code, budget=_PROMPT_CODE_TOKEN_BUDGET):
+    """Reduce COBOL source to fit a token budget
+    
+    Args:
+        cobol_code (str): The COBOL source code
+        budget (int): Maximum number of tokens the returned source may use
+        
+    Returns:
+        str: The source unchanged when it fits, otherwise the most detailed skeleton that
+            fits, truncated as a last resort
+    """
+    if _count_tokens(cobol_code) <= budget:
+        return cobol_code
+    
+    for lines_per_paragraph in (_SKELETON_LINES_PER_PARAGRAPH, 1, 0):
+        fitted = _cobol_skeleton(cobol_code, lines_per_paragraph)
+        if _count_tokens(fitted) <= budget:
+            break
+    else:
+        fitted = fitted[:budget * _CHARS_PER_TOKEN]
+    logger.info("Reduced COBOL source from %s to %s characters to fit the prompt budget", len(cobol_code), len(fitted))
+    return fitted
+
+# Fields of the analysis that the documentation prompt actually uses; anything else
+# (MCP enrichment, bookkeeping) is left out of the prompt to save input tokens
+_DOC_FIELDS = ("program_id", "description", "divisions", "variables", "flow_diagram")
+
+# Output budgets start from a floor that fits the full analysis schema or a documentation
+# outline, and grow with the size of the input the response describes
+_OUTPUT_TOKEN_FLOOR = 1500
+
+# Model routing: small, simple programs go to the fast model, everything else to the large one
+_LARGE_ANALYSIS_MODEL = "llama-3.3-70b-versatile"
+_SMALL_ANALYSIS_MODEL = "llama-3.1-8b-instant"
+# Roughly 200 lines of source and a handful of paragraphs; nearly every program has the
+# same four divisions, so their count says nothing about size
+_SMALL_PROGRAM_MAX_TOKENS = 3000
+_SMALL_PROGRAM_MAX_PARAGRAPHS = 10
+# Model settings that mean "the provider default"; any other model is an explicit choice
+# and is used as-is
+_ROUTABLE_MODEL_SETTINGS = (None, "", "default", _LARGE_ANALYSIS_MODEL)
+
+def _count_procedure_paragraphs(cobol_code):
+    """Count the paragraph and section headers in the PROCEDURE DIVISION"""
+    count = 0
+    in_procedure = False
+    for line in cobol_code.splitlines():
+        # Columns 73-80 of fixed-format source are an identification area, not code
+        code_area = line[:72]
+        division_match = _DIVISION_RE.search(code_area)
+        if division_match:
+            in_procedure = division_match.group(1).upper() == "PROCEDURE"
+        elif in_procedure and _PARAGRAPH_HEADER_RE.match(code_area):
+            count += 1
+    return count
+
+def _analysis_digest(structured_data):
+    """Digest of an analysis's content, used to match it to a prefetched MCP enrichment"""
+    return hashlib.blake2b(_json_dumps_compact(structured_data).encode("utf-8"), digest_size=16).hexdigest()
+
+def _analysis_cache_get(key):
+    """Return a copy of a cached analysis result, or None on miss/expiry"""
+    with _analysis_cache_lock:
+        entry = _analysis_cache.get(key)
+        if entry is None:
+            return None
+        stored_at, structured_data = entry
+        if time.monotonic() - stored_at > _ANALYSIS_CACHE_TTL_SECONDS:
+            del _analysis_cache[key]
+            return None
+        _analysis_cache.move_to_end(key)
+    return copy.deepcopy(structured_data)
+
+def _analysis_cache_put(key, structured_data):
+    """Store a copy of an analysis result, evicting the least recently used entry"""
+    with _analysis_cache_lock:
+        _analysis_cache[key] = (time.monotonic(), copy.deepcopy(structured_data))
+        _analysis_cache.move_to_end(key)
+        while len(_analysis_cache) > _ANALYSIS_CACHE_MAX_ITEMS:
+            _analysis_cache.popitem(last=False)
+
 class COBOLDocumentationAgent:
     """Autonomous agent for generating and managing COBOL documentation"""
     
     def __init__(self, session_id=None, user_id=None):
-        self.session_id = agent_monitor.start_session(
-            session_id=session_id,
+        # The session is started, logged to, and ended on the monitor worker, and every
+        # queued call names it so decisions from concurrent agents cannot cross sessions
+        self.session_id = session_id or str(uuid.uuid4())
+        _queue_monitor_call(
+            agent_monitor.start_session,
+            session_id=self.session_id,
             user_id=user_id,
             context={"agent_type": "cobol_documentation"}
         )
-        self.memory = []
-        self.user_preferences = {}
+        # End the session when the agent is closed or garbage collected
+        self._finalizer = weakref.finalize(
+            self, _queue_monitor_call, agent_monitor.end_session, session_id=self.session_id
+        )
         self.max_memory_items = 10
+        # Bounded memory: appending past max_memory_items drops the oldest item
+        self.memory = deque(maxlen=self.max_memory_items)
+        self.user_preferences = {}
+        self._mcp_prefetch = None
         
         # Set up LLM provider preference
         self.llm_provider = self.get_user_preference("llm_provider", "groq")
@@ -37,20 +426,27 @@ class COBOLDocumentationAgent:
             if self.llm_model:
                 llm_selector.set_model(self.llm_model)
                 
-        logger.info(f"Initialized COBOL Documentation Agent with session {self.session_id} using LLM provider: {self.llm_provider}")
+        logger.info("Initialized COBOL Documentation Agent with session %s using LLM provider: %s", self.session_id, self.llm_provider)
     
-    def __del__(self):
-        """Cleanup when object is destroyed"""
-        try:
-            if hasattr(self, 'session_id'):
-                agent_monitor.end_session()
-        except:
-            pass
+    def close(self):
+        """End this agent's monitoring session; safe to call more than once"""
+        self._finalizer()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+    
+    def _log_decision(self, decision_type, **fields):
+        """Record an agent decision in this agent's monitoring session"""
+        _log_decision(self.session_id, decision_type, **fields)
     
     def set_user_preference(self, key, value):
         """Set a user preference"""
         self.user_preferences[key] = value
-        logger.debug(f"Set user preference: {key} = {value}")
+        logger.debug("Set user preference: %s = %s", key, value)
     
     def get_user_preference(self, key, default=None):
         """Get a user preference"""
@@ -66,41 +462,210 @@ class COBOLDocumentationAgent:
         
         self.memory.append(memory_item)
         
-        # Limit memory size
-        if len(self.memory) > self.max_memory_items:
-            self.memory.pop(0)
-            
-        logger.debug(f"Added memory item: {item_type}")
+        logger.debug("Added memory item: %s", item_type)
         return memory_item
     
-    def analyze_cobol_structure(self, cobol_code, parsed_structure=None):
-        """Analyze COBOL code structure autonomously"""
+    def _analysis_cache_key(self, cobol_code, provider, model):
+        """Build the analysis cache key from the source and the settings that shape the prompt"""
+        # Only trailing whitespace and line endings are normalized; COBOL is column-sensitive
+        normalized_code = "\n".join(line.rstrip() for line in cobol_code.splitlines()).rstrip()
+        key_source = "\x00".join([
+            normalized_code,
+            str(provider),
+            str(model),
+            str(self.get_user_preference("detail_level")),
+            str(self.get_user_preference("audience"))
+        ])
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+    
+    def _select_model(self, cobol_code):
+        """Pick the analysis model and output budget from program size and complexity
+        
+        Args:
+            cobol_code (str): The COBOL source code
+            
+        Returns:
+            tuple: (model name, max output tokens)
+        """
+        code_tokens = _count_tokens(cobol_code)
+        paragraph_count = _count_procedure_paragraphs(cobol_code)
+        if code_tokens <= _SMALL_PROGRAM_MAX_TOKENS and paragraph_count <= _SMALL_PROGRAM_MAX_PARAGRAPHS:
+            model, max_tokens = _SMALL_ANALYSIS_MODEL, 2000
+        else:
+            model, max_tokens = _LARGE_ANALYSIS_MODEL, 4000
+        
+        self._log_decision(
+            "model_routing",
+            inputs={"code_tokens": code_tokens, "paragraph_count": paragraph_count},
+            reasoning="Routing small, simple programs to a faster model",
+            output={"model": model, "max_tokens": max_tokens}
+        )
+        return model, max_tokens
+    
+    def _output_token_budget(self, input_text, ceiling=4000):
+        """Size max_tokens from the size of the prompt input and the requested detail level
+        
+        Args:
+            input_text (str): The source or analysis the response describes
+            ceiling (int, optional): Upper bound for the budget. Defaults to 4000.
+            
+        Returns:
+            int: Maximum number of output tokens to request
+        """
+        detail_level = self.get_user_preference("detail_level")
+        if detail_level == "high":
+            return ceiling
+        
+        scale = 0.5 if detail_level == "low" else 1.0
+        return min(ceiling, _OUTPUT_TOKEN_FLOOR + int(_count_tokens(input_text) * scale))
+    
+    def _reanalyze_with_large_model(self, prompt, provider, structured_data):
+        """Re-run a low-quality small-model analysis on the large model, keeping the original on failure"""
+        self._log_decision(
+            "model_routing",
+            reasoning="Small-model analysis quality was low, retrying once with the larger model",
+            output={"model": _LARGE_ANALYSIS_MODEL}
+        )
+        
+        try:
+            result = llm_selector.generate_text(
+                prompt=prompt,
+                provider=provider,
+                model=_LARGE_ANALYSIS_MODEL,
+                temperature=0.2,
+                max_tokens=4000
+            )
+            return self._parse_llm_json(result)
+        except Exception as retry_error:
+            logger.warning(f"Large-model re-analysis failed, keeping small-model result: {str(retry_error)}")
+            return structured_data
+    
+    def _parse_llm_json(self, result):
+        """Parse JSON from an LLM response, unwrapping a Markdown code block if present"""
+        # Try to find JSON content within triple backticks if present
+        json_match = _JSON_BLOCK_RE.search(result)
+        if json_match:
+            result = json_match.group(1).strip()
+        else:
+            # If not in code blocks, just try to parse it directly
+            result = result.strip()
+        
+        return _json_loads(result)
+    
+    def _prefetch_mcp_enrichment(self, structured_data):
+        """Start MCP enrichment in the background so it overlaps with the rest of the pipeline"""
+        audience_type = self.get_user_preference("audience", "technical")
+        future = _background_executor.submit(
+            mcp_client.enrich_cobol_documentation, dict(structured_data), audience_type
+        )
+        self._mcp_prefetch = (_analysis_digest(structured_data), audience_type, future)
+    
+    def _take_mcp_enrichment(self, structured_data, audience_type):
+        """Return the prefetched MCP enrichment for this data, or enrich synchronously"""
+        prefetch, self._mcp_prefetch = self._mcp_prefetch, None
+        if (prefetch and prefetch[1] == audience_type
+                and prefetch[0] == _analysis_digest(structured_data)):
+            return prefetch[2].result()
+        return mcp_client.enrich_cobol_documentation(structured_data, audience_type)
+    
+    def _field_reporting_callback(self, on_chunk, on_field):
+        """Wrap a chunk callback so completed top-level JSON fields are also reported to on_field"""
+        if on_field is None:
+            return on_chunk
+        
+        field_parser = _StreamingObjectParser()
+        
+        def report_chunk(chunk):
+            if on_chunk:
+                on_chunk(chunk)
+            for key, value in field_parser.feed(chunk):
+                on_field(key, value)
+        
+        return report_chunk
+    
+    def _generate_text(self, prompt, provider, model, temperature, max_tokens, on_chunk=None):
+        """Generate text with the LLM selector, streaming chunks when the selector supports it
+        
+        Args:
+            prompt (str): The prompt to send
+            provider (str): LLM provider name
+            model (str): Model name
+            temperature (float): Sampling temperature
+            max_tokens (int): Maximum number of output tokens
+            on_chunk (callable, optional): Called with each text chunk as it arrives
+            
+        Returns:
+            str: The complete generated text
+        """
+        generate_stream = getattr(llm_selector, "generate_text_stream", None)
+        if on_chunk is None or generate_stream is None:
+            result = llm_selector.generate_text(
+                prompt=prompt,
+                provider=provider,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            if on_chunk and result:
+                on_chunk(result)
+            return result
+        
+        # Accumulate streamed chunks so post-processing can run on the full text
+        buffer = []
+        for chunk in generate_stream(
+            prompt=prompt,
+            provider=provider,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens
+        ):
+            if not chunk:
+                continue
+            buffer.append(chunk)
+            on_chunk(chunk)
+        return "".join(buffer)
+    
+    def analyze_cobol_structure(self, cobol_code, parsed_structure=None, prefetch_enrichment=False,
+                                on_chunk=None, on_field=None):
+        """Analyze COBOL code structure autonomously
+        
+        Args:
+            cobol_code (str): The COBOL source code
+            parsed_structure (dict, optional): Structure from the static parser
+            prefetch_enrichment (bool, optional): Start MCP enrichment in the background, for
+                callers that generate documentation from the analysis next. Defaults to False.
+            on_chunk (callable, optional): Called with each raw LLM chunk as it streams in
+            on_field (callable, optional): Called with (key, value) for each top-level field of
+                the analysis as soon as it has fully streamed in; the returned analysis remains
+                the result of record
+            
+        Returns:
+            dict: Structured analysis of the program
+        """
+        code_digest = hashlib.blake2b(cobol_code.encode("utf-8"), digest_size=8).hexdigest()
         operation_span = observability_tracker.start_span(
             "analyze_cobol_structure", 
-            metadata={"code_length": len(cobol_code)}
+            metadata={"code_length": len(cobol_code), "code_digest": code_digest}
         )
         
         try:
             # Agent decision: determine what parsing approach to use
-            parsing_decision = agent_monitor.log_decision(
+            self._log_decision(
                 "parsing_approach_selection",
-                inputs={"code_sample": cobol_code[:200] + "..."},
+                inputs={"code_digest": code_digest, "code_length": len(cobol_code)},
                 reasoning="Determining the optimal parsing strategy based on code complexity and structure"
             )
             
             # If no parsed structure provided, use a simplified one
             if not parsed_structure:
-                parsed_structure = {
-                    "program_id": self._extract_program_id(cobol_code),
-                    "divisions": self._identify_divisions(cobol_code)
-                }
+                parsed_structure = self._scan_program_outline(cobol_code)
                 
             # Agent decision: identify key code aspects to focus on
-            focus_decision = agent_monitor.log_decision(
+            self._log_decision(
                 "code_focus_identification",
                 inputs={"parsed_structure": parsed_structure},
                 reasoning="Identifying the most important aspects of the code to focus documentation on",
-                output={"focus_areas": self._identify_focus_areas(parsed_structure)}
+                output=lambda structure=parsed_structure: {"focus_areas": self._identify_focus_areas(structure)}
             )
             
             # Prepare custom instructions based on user preferences
@@ -109,6 +674,7 @@ class COBOLDocumentationAgent:
                 custom_instructions += "Provide highly detailed analysis with comprehensive breakdown of all code elements. "
             elif self.get_user_preference("detail_level") == "low":
                 custom_instructions += "Provide a simplified overview focusing only on key program elements. "
+                custom_instructions += "Respond with at most 400 words and omit examples. "
                 
             if self.get_user_preference("audience") == "technical":
                 custom_instructions += "Target audience is technical developers with COBOL expertise. "
@@ -118,6 +684,17 @@ class COBOLDocumentationAgent:
             # Determine which LLM provider to use based on user preference
             current_provider = self.get_user_preference("llm_provider", "groq")
             current_model = self.get_user_preference("llm_model", "llama-3.3-70b-versatile")
+            max_tokens = 4000
+            
+            # Route by program size unless the user explicitly picked a non-default model
+            routed_to_small_model = False
+            if current_provider == "groq" and self.get_user_preference("llm_model") in _ROUTABLE_MODEL_SETTINGS:
+                current_model, max_tokens = self._select_model(cobol_code)
+                routed_to_small_model = current_model == _SMALL_ANALYSIS_MODEL
+            
+            # Keep very large programs within the prompt budget
+            prompt_code = _fit_cobol_to_budget(cobol_code)
+            max_tokens = self._output_token_budget(prompt_code, max_tokens)
             
             # Prepare the prompt/messages for the LLM
             prompt = f"""
@@ -134,11 +711,11 @@ class COBOLDocumentationAgent:
             4. variables: Key variables and their purpose
             5. flow_diagram: A simple Mermaid flowchart diagram of the program flow
             
-            Use this initial parsed structure as reference: {json.dumps(parsed_structure, indent=2)}
+            Use this initial parsed structure as reference: {_json_dumps_compact(parsed_structure)}
             
             COBOL CODE:
             ```cobol
-            {cobol_code}
+            {prompt_code}
             ```
             
             {custom_instructions}
@@ -146,71 +723,89 @@ class COBOLDocumentationAgent:
             Respond with only valid JSON that represents the structured analysis of this code.
             """
             
-            # Try using the LLM selector first
-            if current_provider in llm_selector.get_providers():
-                logger.info(f"Using LLM selector with provider {current_provider}")
-                result = llm_selector.generate_text(
+            # Reuse a previous analysis of the same source with the same settings
+            cache_key = self._analysis_cache_key(cobol_code, current_provider, current_model)
+            cached_data = _analysis_cache_get(cache_key)
+            if cached_data is not None:
+                logger.info("Using cached analysis for program %s", cached_data.get('program_id', 'Unknown'))
+                if prefetch_enrichment:
+                    self._prefetch_mcp_enrichment(cached_data)
+                observability_tracker.end_span(operation_span, result={"ref": code_digest, "program_id": cached_data.get("program_id"), "cached": True})
+                return cached_data
+            
+            def analyze_with_selector():
+                result = self._generate_text(
                     prompt=prompt,
                     provider=current_provider,
                     model=current_model,
                     temperature=0.2,
-                    max_tokens=4000
+                    max_tokens=max_tokens,
+                    on_chunk=self._field_reporting_callback(on_chunk, on_field)
                 )
-            # Fallback to using Groq directly if it's requested but not in selector
-            elif current_provider == "groq" and os.environ.get("GROQ_API_KEY"):
-                logger.info("Using Groq client directly")
-                structured_data = analyze_cobol_with_groq(cobol_code, current_model)
-                # Skip the JSON parsing since Groq already returns parsed JSON
-                observability_tracker.end_span(operation_span, result=structured_data)
+                try:
+                    # Remove any non-JSON content like markdown formatting
+                    data = self._parse_llm_json(result)
+                except ValueError:
+                    logger.debug("Response content: %s...", result[:500])
+                    raise
+                
+                # Give weak small-model analyses one more chance on the large model
+                if routed_to_small_model and self._evaluate_analysis_quality(data)["quality_level"] == "low":
+                    data = self._reanalyze_with_large_model(prompt, current_provider, data)
+                return data
+            
+            # Analysis strategies in order of preference; the first one that succeeds is used.
+            # The API key is read per call since it can be saved while the app is running.
+            strategies = []
+            if current_provider in llm_selector.get_providers():
+                strategies.append((f"LLM selector with provider {current_provider}", analyze_with_selector))
+            if os.environ.get("GROQ_API_KEY"):
+                groq_model = current_model if current_provider == "groq" else _LARGE_ANALYSIS_MODEL
+                # Groq already returns parsed JSON
+                strategies.append(("direct Groq client", lambda: analyze_cobol_with_groq(prompt_code, groq_model)))
+            
+            if not strategies:
+                logger.error("No GROQ API key available for documentation generation")
+                program_outline = self._scan_program_outline(cobol_code)
+                structured_data = {
+                    "program_id": program_outline["program_id"],
+                    "description": "Error: No API keys available for any LLM provider",
+                    "divisions": program_outline["divisions"],
+                    "variables": {},
+                    "flow_diagram": "flowchart TD\n    Error[Error: No API Keys] --> Action[Please configure API keys]"
+                }
+                observability_tracker.end_span(operation_span, result={"ref": code_digest, "program_id": structured_data.get("program_id")})
                 return structured_data
-            # Use Groq as only fallback option
-            else:
-                # Try direct GROQ access if API key exists
-                if os.environ.get("GROQ_API_KEY"):
-                    logger.info("GROQ API key exists, using direct Groq client")
-                    structured_data = analyze_cobol_with_groq(cobol_code, "llama-3.3-70b-versatile")
-                    # Skip the JSON parsing since Groq already returns parsed JSON
-                    observability_tracker.end_span(operation_span, result=structured_data)
-                    return structured_data
-                else:
-                    # No API keys available
-                    logger.error("No GROQ API key available for documentation generation")
-                    structured_data = {
-                        "program_id": self._extract_program_id(cobol_code),
-                        "description": "Error: No API keys available for any LLM provider",
-                        "divisions": self._identify_divisions(cobol_code),
-                        "variables": {},
-                        "flow_diagram": "flowchart TD\n    Error[Error: No API Keys] --> Action[Please configure API keys]"
-                    }
-                    observability_tracker.end_span(operation_span, result=structured_data)
-                    return structured_data
             
-            # Clean up the result to make sure it's valid JSON
-            # Remove any non-JSON content like markdown formatting
-            try:
-                # Try to find JSON content within triple backticks if present
-                import re
-                json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', result)
-                if json_match:
-                    result = json_match.group(1).strip()
-                else:
-                    # If not in code blocks, just try to parse it directly
-                    result = result.strip()
-                    
-                # Parse the JSON
-                structured_data = json.loads(result)
-                
-                logger.debug(f"Successfully parsed structured data from LLM API response")
-            except Exception as json_error:
-                logger.error(f"Error parsing JSON from LLM response: {json_error}")
-                logger.debug(f"Response content: {result[:500]}...")
-                
-                # Fallback to basic structure
+            structured_data = None
+            last_error = None
+            for strategy_name, strategy in strategies:
+                try:
+                    logger.info("Analyzing COBOL structure using %s", strategy_name)
+                    structured_data = strategy()
+                    break
+                except Exception as strategy_error:
+                    logger.warning(f"Analysis using {strategy_name} failed: {str(strategy_error)}")
+                    last_error = strategy_error
+            
+            if structured_data is not None:
+                _analysis_cache_put(cache_key, structured_data)
+                logger.debug("Successfully parsed structured data from LLM API response")
+            elif isinstance(last_error, ValueError):
+                # The model answered, but not with parseable JSON: fall back to basic structure
+                logger.error(f"Error parsing JSON from LLM response: {last_error}")
+                program_outline = self._scan_program_outline(cobol_code)
                 structured_data = {
-                    "program_id": self._extract_program_id(cobol_code),
-                    "description": "Could not automatically extract program description.",
-                    "divisions": self._identify_divisions(cobol_code)
+                    "program_id": program_outline["program_id"],
+                    "description": ANALYSIS_FALLBACK_DESCRIPTION,
+                    "divisions": program_outline["divisions"]
                 }
+            else:
+                raise last_error
+            
+            # Kick off MCP enrichment now so it runs while we evaluate and the caller prepares
+            if prefetch_enrichment:
+                self._prefetch_mcp_enrichment(structured_data)
             
             # Store analysis in memory
             self.remember("cobol_analysis", {
@@ -220,13 +815,13 @@ class COBOLDocumentationAgent:
             })
             
             # Agent decision: evaluate analysis quality
-            quality_decision = agent_monitor.log_decision(
+            self._log_decision(
                 "analysis_quality_evaluation",
                 reasoning="Evaluating the completeness and accuracy of the code analysis",
-                output=self._evaluate_analysis_quality(structured_data)
+                output=functools.partial(self._evaluate_analysis_quality, structured_data)
             )
             
-            observability_tracker.end_span(operation_span, result=structured_data)
+            observability_tracker.end_span(operation_span, result={"ref": code_digest, "program_id": structured_data.get("program_id")})
             return structured_data
             
         except Exception as e:
@@ -234,8 +829,17 @@ class COBOLDocumentationAgent:
             observability_tracker.end_span(operation_span, error=e)
             raise
     
-    def generate_documentation(self, structured_data):
-        """Generate documentation from structured COBOL data"""
+    def generate_documentation(self, structured_data, on_chunk=None):
+        """Generate documentation from structured COBOL data
+        
+        Args:
+            structured_data (dict): Structured analysis from analyze_cobol_structure
+            on_chunk (callable, optional): Called with each Markdown chunk as the LLM streams it;
+                the returned documentation adds diagrams and other post-processing
+            
+        Returns:
+            str: Generated Markdown documentation
+        """
         operation_span = observability_tracker.start_span(
             "generate_documentation", 
             metadata={"program_id": structured_data.get("program_id", "Unknown")}
@@ -243,11 +847,11 @@ class COBOLDocumentationAgent:
         
         try:
             # Agent decision: determine documentation structure
-            doc_structure_decision = agent_monitor.log_decision(
+            self._log_decision(
                 "documentation_structure_planning",
                 inputs={"structured_data_keys": list(structured_data.keys())},
                 reasoning="Planning the optimal documentation structure based on available information",
-                output={"planned_sections": self._plan_documentation_sections(structured_data)}
+                output=lambda data=structured_data: {"planned_sections": self._plan_documentation_sections(data)}
             )
             
             # Prepare custom instructions based on user preferences
@@ -265,18 +869,21 @@ class COBOLDocumentationAgent:
             if self.get_user_preference("diagrams") == "detailed":
                 custom_instructions += "Create detailed diagrams explaining program flow and structure. "
             
+            if self.get_user_preference("detail_level") == "low":
+                custom_instructions += "Be concise: respond with at most 400 words and omit examples. "
+            
             # Enrich structured data with MCP
-            agent_monitor.log_decision(
+            self._log_decision(
                 "mcp_enrichment",
                 reasoning="Enriching COBOL documentation with external knowledge and explanations using Model Context Protocol",
                 output={"audience_type": audience_type}
             )
             
             try:
-                enriched_data = mcp_client.enrich_cobol_documentation(structured_data, audience_type)
+                enriched_data = self._take_mcp_enrichment(structured_data, audience_type)
                 
                 # Log what was enriched
-                agent_monitor.log_decision(
+                self._log_decision(
                     "mcp_enrichment_analysis",
                     reasoning="Analyzing MCP enrichment results",
                     output={
@@ -299,6 +906,11 @@ class COBOLDocumentationAgent:
             if "mcp_explanation" in structured_data:
                 mcp_context = f"\n\nExternal knowledge about this COBOL program:\n{structured_data['mcp_explanation'].get('explanation', '')}\n"
             
+            # Serialize only the fields the prompt needs, once
+            doc_input = {key: structured_data[key] for key in _DOC_FIELDS if key in structured_data}
+            doc_input_json = _json_dumps_compact(doc_input)
+            max_tokens = self._output_token_budget(doc_input_json)
+            
             # Prepare the documentation prompt
             doc_prompt = f"""
             You are a technical documentation expert specializing in legacy COBOL systems. 
@@ -316,31 +928,31 @@ class COBOLDocumentationAgent:
             
             {custom_instructions}
             
-            Use this structured data: {json.dumps(structured_data, indent=2)}{mcp_context}
+            Use this structured data: {doc_input_json}{mcp_context}
             
             Your documentation should be comprehensive, clear, and professional, suitable for both developers and non-technical stakeholders.
             """
             
             # Try using the LLM selector first
             if current_provider in llm_selector.get_providers():
-                logger.info(f"Using LLM selector with provider {current_provider} for documentation generation")
-                documentation = llm_selector.generate_text(
+                logger.info("Using LLM selector with provider %s for documentation generation", current_provider)
+                documentation = self._generate_text(
                     prompt=doc_prompt,
                     provider=current_provider,
                     model=current_model,
                     temperature=0.3,
-                    max_tokens=4000
+                    max_tokens=max_tokens,
+                    on_chunk=on_chunk
                 )
             # Fallback to using Groq directly if it's requested but not in selector
             elif current_provider == "groq" and os.environ.get("GROQ_API_KEY"):
                 logger.info("Using Groq client directly for documentation generation")
                 try:
-                    from utils.groq_client import generate_with_groq
                     documentation = generate_with_groq(
                         prompt=doc_prompt,
                         model=current_model or "llama-3.1-8b-versatile",
                         temperature=0.3,
-                        max_tokens=4000
+                        max_tokens=max_tokens
                     )
                 except Exception as groq_error:
                     logger.error(f"Error using Groq directly: {str(groq_error)}")
@@ -353,10 +965,10 @@ class COBOLDocumentationAgent:
                 documentation = self._fallback_to_groq_for_documentation(doc_prompt, custom_instructions)
             
             # Agent decision: evaluate documentation quality
-            quality_decision = agent_monitor.log_decision(
+            self._log_decision(
                 "documentation_quality_evaluation",
                 reasoning="Evaluating the quality, completeness, and clarity of the generated documentation",
-                output=self._evaluate_documentation_quality(documentation)
+                output=functools.partial(self._evaluate_documentation_quality, documentation)
             )
             
             # Generate diagrams if needed
@@ -375,12 +987,12 @@ class COBOLDocumentationAgent:
                 logger.warning(f"Could not separate thinking process: {str(e)}")
                 
             # Enhance documentation with tabbed diagram views
-            try:
-                from utils.mermaid_viewer import enhance_markdown_with_tabs
-                documentation = enhance_markdown_with_tabs(documentation)
-                logger.debug("Enhanced documentation with tabbed diagram views")
-            except Exception as e:
-                logger.warning(f"Could not enhance documentation with tabbed diagram views: {str(e)}")
+            if enhance_markdown_with_tabs is not None:
+                try:
+                    documentation = enhance_markdown_with_tabs(documentation)
+                    logger.debug("Enhanced documentation with tabbed diagram views")
+                except Exception as e:
+                    logger.warning(f"Could not enhance documentation with tabbed diagram views: {str(e)}")
             
             # Store in memory
             self.remember("documentation", {
@@ -398,23 +1010,41 @@ class COBOLDocumentationAgent:
     
     def _extract_program_id(self, cobol_code):
         """Extract program ID from COBOL code"""
-        import re
-        program_id_match = re.search(r'PROGRAM-ID\s*\.\s*([\w-]+)', cobol_code, re.IGNORECASE)
+        program_id_match = _PROGRAM_ID_RE.search(cobol_code)
         if program_id_match:
             return program_id_match.group(1).strip()
         return "Unknown"
     
     def _identify_divisions(self, cobol_code):
         """Identify divisions in COBOL code"""
-        import re
         divisions = []
-        division_matches = re.finditer(r'([\w-]+)\s+DIVISION', cobol_code, re.IGNORECASE)
+        division_matches = _DIVISION_RE.finditer(cobol_code)
         
         for match in division_matches:
             divisions.append(match.group(1).strip())
             
         return divisions
     
+    def _scan_program_outline(self, cobol_code):
+        """Extract program ID and division names in a single pass over the source
+        
+        Args:
+            cobol_code (str): The COBOL source code
+            
+        Returns:
+            dict: program_id (str, "Unknown" if absent) and divisions (list of names)
+        """
+        program_id = None
+        divisions = []
+        
+        for match in _PROGRAM_OUTLINE_RE.finditer(cobol_code):
+            if match.lastgroup == "division":
+                divisions.append(match.group("division"))
+            elif program_id is None:
+                program_id = match.group("program_id")
+        
+        return {"program_id": program_id or "Unknown", "divisions": divisions}
+    
     def _identify_focus_areas(self, parsed_structure):
         """Identify key areas to focus on in the code"""
         focus_areas = []
@@ -538,17 +1168,19 @@ class COBOLDocumentationAgent:
         """Enhance documentation with additional diagrams"""
         operation_span = observability_tracker.start_span("enhance_with_diagrams")
         
+        # Diagrams are only validated and enhanced when the validator is available
+        if validate_mermaid_syntax is None:
+            logger.warning("Mermaid validator is not available; keeping diagrams as generated")
+            observability_tracker.end_span(operation_span)
+            return documentation
+        
         try:
-            # Import validator from mermaid_validator
-            from utils.mermaid_validator import validate_mermaid_syntax
-            import re
-            
             # Make sure we have at least one valid diagram
             has_valid_diagrams = False
             
             # First, validate any existing diagrams
             if "```mermaid" in documentation:
-                logger.info(f"Found existing Mermaid diagrams in documentation. Validating and fixing if needed.")
+                logger.info("Found existing Mermaid diagrams in documentation. Validating and fixing if needed.")
                 
                 def validate_diagram(match):
                     nonlocal has_valid_diagrams
@@ -561,11 +1193,11 @@ class COBOLDocumentationAgent:
                         return f"```mermaid\n{default_diagram}\n```"
                     
                     # Validate and correct the diagram syntax
-                    is_valid, corrected_code, message = validate_mermaid_syntax(mermaid_code)
+                    is_valid, corrected_code, message = _validate_mermaid_cached(mermaid_code)
                     
                     # Always consider it corrected, even if only validation happened
-                    logger.debug(f"Mermaid diagram validation: {message}")
-                    agent_monitor.log_decision(
+                    logger.debug("Mermaid diagram validation: %s", message)
+                    self._log_decision(
                         "mermaid_syntax_correction",
                         reasoning=f"Validating/fixing Mermaid diagram syntax: {message}",
                         output={"original": mermaid_code, "corrected": corrected_code}
@@ -576,16 +1208,26 @@ class COBOLDocumentationAgent:
                     return f"```mermaid\n{corrected_code}\n```"
                 
                 # Extract and validate each mermaid diagram
-                pattern = r'```mermaid\s*([\s\S]*?)\s*```'
-                documentation = re.sub(pattern, validate_diagram, documentation)
+                documentation = _MERMAID_BLOCK_RE.sub(validate_diagram, documentation)
+            
+            # Build the program flow from the analyzed paragraphs when they are available
+            program_flowchart = self._build_flowchart_from_structure(structured_data)
+            added_program_flowchart = False
             
             # Add fallback diagram if none exist or all were invalid
-            if not has_valid_diagrams and "```mermaid" not in documentation:
-                logger.info("No valid Mermaid diagrams found, adding a basic program flow diagram")
+            if not has_valid_diagrams and "```mermaid" not in documentation and program_flowchart:
+                logger.info("No valid Mermaid diagrams found, adding the program flow diagram from the analysis")
+                documentation += f"\n\n## Program Flow Diagram\n\n```mermaid\n{program_flowchart}\n```\n"
+                has_valid_diagrams = True
+                added_program_flowchart = True
                 
-                # Create a basic diagram based on structured data
-                program_id = structured_data.get("program_id", "Program")
-                description = structured_data.get("description", "COBOL Program")
+                self._log_decision(
+                    "added_program_flow_diagram",
+                    reasoning="Added a program flow diagram generated from the analyzed paragraphs",
+                    output={"diagram_type": "flowchart"}
+                )
+            elif not has_valid_diagrams and "```mermaid" not in documentation:
+                logger.info("No valid Mermaid diagrams found, adding a basic program flow diagram")
                 
                 # Generate a simple flowchart based on available data
                 basic_flowchart = """```mermaid
@@ -603,16 +1245,21 @@ flowchart TD
                 documentation += f"\n\n## Program Flow Diagram\n\n{basic_flowchart}\n"
                 has_valid_diagrams = True
                 
-                agent_monitor.log_decision(
+                self._log_decision(
                     "added_basic_diagram",
                     reasoning="Added a basic flow diagram as none were present",
                     output={"diagram_type": "flowchart"}
                 )
             
-            # Only try to generate enhanced diagrams if requested and we have an LLM provider
+            # Enhanced diagrams come from the analyzed structure; the LLM rewrite only runs on explicit request
+            enhanced_diagrams = self.get_user_preference("enhanced_diagrams", True)
             provider_preference = self.get_user_preference("llm_provider", "groq")
-            if self.get_user_preference("enhanced_diagrams", True) and provider_preference:
-                logger.info(f"Attempting to generate enhanced diagrams using {provider_preference}")
+            if enhanced_diagrams and enhanced_diagrams != "llm" and program_flowchart:
+                # Only add the program flow when the documentation has no flow diagram yet
+                if not added_program_flowchart and not _FLOW_DIAGRAM_RE.search(documentation):
+                    documentation += f"\n\n## Program Flow Diagram\n\n```mermaid\n{program_flowchart}\n```\n"
+            elif enhanced_diagrams == "llm" and provider_preference:
+                logger.info("Attempting to generate enhanced diagrams using %s", provider_preference)
                 
                 # Prepare detailed instructions for diagram generation
                 diagram_instructions = """
@@ -656,8 +1303,6 @@ flowchart
                     
                     # Use Groq exclusively
                     # Use Groq API to generate diagrams
-                    from utils.groq_client import generate_with_groq
-                    
                     # Use more concise prompt for Groq
                     enhanced_documentation = generate_with_groq(
                         prompt=f"""
@@ -698,17 +1343,16 @@ Return the complete enhanced documentation.
                                     return f"```mermaid\n{default_diagram}\n```"
                                 
                                 # Always validate and correct
-                                is_valid, corrected_code, message = validate_mermaid_syntax(mermaid_code)
+                                is_valid, corrected_code, message = _validate_mermaid_cached(mermaid_code)
                                 
                                 if corrected_code != mermaid_code:
                                     has_issues = True
-                                    logger.debug(f"Fixed Mermaid syntax: {message}")
+                                    logger.debug("Fixed Mermaid syntax: %s", message)
                                 
                                 return f"```mermaid\n{corrected_code}\n```"
                             
                             # Find and fix all diagrams
-                            pattern = r'```mermaid\s*([\s\S]*?)\s*```'
-                            enhanced_documentation = re.sub(pattern, check_and_fix_diagram, enhanced_documentation)
+                            enhanced_documentation = _MERMAID_BLOCK_RE.sub(check_and_fix_diagram, enhanced_documentation)
                             attempts += 1
                         
                         # Count diagrams in original and enhanced documentation
@@ -717,7 +1361,7 @@ Return the complete enhanced documentation.
                         
                         # Only use enhanced documentation if it actually contains diagrams
                         if enhanced_count > 0:
-                            logger.info(f"Successfully enhanced documentation with {enhanced_count} diagrams (had {original_count} originally)")
+                            logger.info("Successfully enhanced documentation with %s diagrams (had %s originally)", enhanced_count, original_count)
                             documentation = enhanced_documentation
                         else:
                             logger.warning("Enhanced documentation didn't contain valid diagrams, keeping original")
@@ -727,7 +1371,7 @@ Return the complete enhanced documentation.
                     # Continue with the current documentation if enhancement fails
             
             # Log the completion of diagram enhancement
-            agent_monitor.log_decision(
+            self._log_decision(
                 "documentation_diagram_enhancement",
                 reasoning="Enhanced documentation with validated Mermaid diagrams",
                 output={"diagram_count": documentation.count("```mermaid")}
@@ -742,6 +1386,71 @@ Return the complete enhanced documentation.
             # Make sure we don't lose the original documentation if something goes wrong
             return documentation
 
+    def _build_flowchart_from_structure(self, structured_data):
+        """Build a Mermaid flowchart of the PROCEDURE DIVISION paragraphs without calling an LLM
+        
+        Paragraphs are connected in source order (fall-through) unless a paragraph ends the
+        program, and PERFORM statements in each paragraph's code add labeled edges.
+        
+        Args:
+            structured_data (dict): Structured analysis from analyze_cobol_structure
+            
+        Returns:
+            str: Mermaid flowchart code, or None if the analysis has no paragraphs
+        """
+        divisions = structured_data.get("divisions")
+        if not isinstance(divisions, dict):
+            return None
+        
+        procedure = next(
+            (division for name, division in divisions.items() if "PROCEDURE" in str(name).upper()),
+            None
+        )
+        if not isinstance(procedure, dict):
+            return None
+        
+        # Collect paragraphs in order, whether or not they are grouped into sections
+        paragraph_groups = [procedure.get("paragraphs")]
+        sections = procedure.get("sections")
+        if isinstance(sections, dict):
+            paragraph_groups.extend(
+                section.get("paragraphs") for section in sections.values() if isinstance(section, dict)
+            )
+        
+        paragraphs = []
+        for group in paragraph_groups:
+            if isinstance(group, dict):
+                for name, details in group.items():
+                    code = details.get("code", "") if isinstance(details, dict) else ""
+                    paragraphs.append((str(name).upper(), code if isinstance(code, str) else ""))
+        
+        if not paragraphs:
+            return None
+        paragraphs = paragraphs[:_FLOWCHART_MAX_PARAGRAPHS]
+        
+        # A paragraph name repeated across sections is drawn as a single node
+        node_ids = {}
+        lines = ["flowchart TD"]
+        for index, (name, _) in enumerate(paragraphs, start=1):
+            if name not in node_ids:
+                node_ids[name] = f"P{index}"
+                lines.append(f'    {node_ids[name]}["{name.replace(chr(34), chr(39))}"]')
+        
+        lines.append(f"    Start([Start]) --> {node_ids[paragraphs[0][0]]}")
+        for index, (name, code) in enumerate(paragraphs):
+            for match in _PERFORM_TARGET_RE.finditer(code):
+                for target in match.groups():
+                    if target and target.upper() in node_ids:
+                        lines.append(f"    {node_ids[name]} -->|PERFORM| {node_ids[target.upper()]}")
+            
+            if _PARAGRAPH_END_RE.search(code):
+                lines.append(f"    {node_ids[name]} --> End([End])")
+            elif index + 1 < len(paragraphs) and paragraphs[index + 1][0] != name:
+                lines.append(f"    {node_ids[name]} --> {node_ids[paragraphs[index + 1][0]]}")
+        
+        # Repeated paragraphs would otherwise draw the same edge more than once
+        return "\n".join(dict.fromkeys(lines))
+    
     def _separate_thinking_process(self, documentation):
         """Separate AI thinking process from the main documentation and put it in its own section
         
@@ -751,12 +1460,9 @@ Return the complete enhanced documentation.
         Returns:
             str: Documentation with thinking process in a separate section
         """
-        import re
-        
         # First, identify the main documentation title using patterns like "# PROGRAM_NAME Documentation"
         # or "# Documentation for PROGRAM_NAME"
-        doc_title_pattern = r'(^|\n)#\s+(.*?Documentation|Documentation for.*?)(\n|$)'
-        title_match = re.search(doc_title_pattern, documentation, re.IGNORECASE)
+        title_match = _DOC_TITLE_RE.search(documentation)
         
         if title_match:
             # Title exists, extract content before it as thinking process
@@ -771,8 +1477,7 @@ Return the complete enhanced documentation.
                 return main_documentation
         
         # Check if there's any text before the first heading 
-        first_heading_pattern = r'(^|\n)#\s+'
-        first_heading_match = re.search(first_heading_pattern, documentation)
+        first_heading_match = _FIRST_HEADING_RE.search(documentation)
         
         if first_heading_match:
             # Extract content before first heading as thinking process
@@ -819,7 +1524,6 @@ flowchart TD
         
         logger.info("Using Groq API for documentation generation")
         try:
-            from utils.groq_client import generate_with_groq
             documentation = generate_with_groq(
                 prompt=f"You are a technical documentation expert who creates comprehensive, clear documentation for legacy COBOL systems. {custom_instructions}\n\n{doc_prompt}",
                 model="llama-3.3-70b-versatile",
@@ -879,7 +1583,7 @@ Please check your GROQ_API_KEY and try again.
             enhanced_documentation = documentation + mcp_section
             
             # Log the enhancement
-            agent_monitor.log_decision(
+            self._log_decision(
                 "mcp_explanation_addition",
                 reasoning="Adding simplified explanations from MCP for non-technical users",
                 output={"mcp_section_length": len(mcp_section)}
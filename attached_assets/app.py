@@ -1,21 +1,65 @@
+import io
 import os
+import gzip
 import uuid
 import re
 import time
 import json
+import hashlib
+import queue
+import functools
+import threading
 import traceback
+import urllib.parse
+import markdown
+from collections import OrderedDict
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for, flash, make_response, Response
 import logging
 from utils.cobol_parser import parse_cobol
 from utils.documentation_generator import generate_documentation
-from utils.perplexity_client import extract_structure, generate_diagrams, translate_documentation
+from utils.perplexity_client import extract_structure, generate_diagrams, translate_documentation, validate_mermaid_syntax
 from utils.llm_selector import llm_selector
 from utils.groq_client import get_groq_models
+from utils.prompt_manager import (get_default_prompts, get_prompt_list, save_custom_prompt, set_active_prompt_key,
+                                  get_active_prompt_key, reset_prompt as reset_prompt_func,
+                                  reset_all_prompts as reset_all_prompts_func)
+from utils.ledger_sql import LedgerSQL
+from utils.ledger_manager import LedgerManager
+from utils.agent import COBOLDocumentationAgent as LedgerDocumentationAgent
+from utils.batch_llm import submit_batch, get_batch_status, collect_batch_results
+from utils import llm_cache
+from utils.redis_client import get_redis
+from utils.doc_store import save_documentation, load_documentation, open_documentation
+from utils.doc_store import DEFAULT_TTL_SECONDS as DOC_TTL_SECONDS
+from utils.job_store import update_job, get_job
 from models import db, User, Project, CobolFile, Documentation, SourceCodeQueue, SourceCodeContent, DocGenerated
-from datetime import datetime
+from datetime import datetime, date, timedelta, time as time_of_day
+from utils.passwords import hash_password, verify_password, needs_rehash
+from agent_fixed import COBOLDocumentationAgent, ANALYSIS_FALLBACK_DESCRIPTION
 from dotenv import load_dotenv
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload, make_transient_to_detached
+from sqlalchemy.engine.row import Row
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_wtf.csrf import CSRFProtect
+from flask.json.provider import DefaultJSONProvider
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+try:
+    from flask_session import Session
+except ImportError:  # Flask-Session is optional; sessions stay in signed cookies without it
+    Session = None
+try:
+    import orjson
+except ImportError:  # orjson is an optional accelerator; fall back to the standard library
+    orjson = None
+try:
+    from utils.mermaid_viewer import enhance_markdown_with_tabs
+except ImportError:  # the tabbed diagram viewer is optional; documentation keeps plain Mermaid blocks
+    enhance_markdown_with_tabs = None
 
 # Load environment variables
 load_dotenv()
@@ -24,53 +68,98 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key_for_development")
 
-# Initialize CSRF protection but exempt API routes used by JavaScript
-csrf = CSRFProtect(app)
+# Keep session data in Redis when available so the cookie only carries a session ID
+# and large values such as uploaded COBOL code are not sent and re-signed on every request
+if Session is not None and get_redis() is not None:
+    app.config.update(
+        SESSION_TYPE='redis',
+        SESSION_REDIS=get_redis(),
+        SESSION_PERMANENT=False
+    )
+    Session(app)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson, writing response bodies as bytes directly"""
+    # Datetimes, UUIDs, and other types orjson would format itself go through Flask's
+    # default handler so responses keep the same format as with the standard library
+    OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.OPTIONS).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+def json_body(obj, iso_datetimes=False):
+    """Serialize a JSON response body, as bytes when orjson is available
+    
+    Args:
+        obj: Data to serialize
+        iso_datetimes (bool): Let orjson write datetimes, dates, and times in ISO format
+            itself; without orjson they must already be converted to strings
+        
+    Returns:
+        bytes or str: The JSON body
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS if iso_datetimes else OrjsonProvider.OPTIONS
+        return orjson.dumps(obj, default=app.json.default, option=option)
+    return json.dumps(obj, default=app.json.default)
 
-# List of API routes to exempt from CSRF protection
-exempt_routes = [
-    '/api/execute-sql',
-    '/api/ledger/get-source-queue',
-    '/api/ledger/get-doc-queue',
-    '/api/upload',
-    '/api/process',
-    '/api/agent/process',
-    '/api/translate',
-    '/api/download',
-    '/api/validate-mermaid',
-    '/api/llm-settings',
-    '/api/prompts/save', 
-    '/api/prompts/reset',
-    '/api/prompts/reset-all',
-    '/api/prompts/set-active',
-    '/api/prompts/status',
-    '/api/check-api-keys',
-    '/api/save-api-keys',
-    '/api/get-models',
-    '/api/ledger/source-queue',
-    '/api/documentation',
-    '/api/ledger/doc-queue',
-    '/api/ledger/add-source',
-    '/api/ledger/update-source-status',
-    '/api/ledger/delete-source',
-    '/api/ledger/get-source',
-    '/api/ledger/process-source',
-    '/api/ledger/get-doc',
-    '/api/ledger/update-doc-status',
-    '/api/ledger/download-doc',
-]
-
-# Apply exemptions
-for route in exempt_routes:
-    csrf.exempt(route)
+def json_response(payload, status=200, headers=None, iso_datetimes=False):
+    """Build a JSON response with an explicit UTF-8 content type
+    
+    Args:
+        payload (dict): Data to serialize with json_body()
+        status (int): HTTP status code
+        headers (dict): Extra response headers
+        iso_datetimes (bool): Passed to json_body()
+        
+    Returns:
+        Response: The JSON response
+    """
+    return Response(
+        json_body(payload, iso_datetimes),
+        status=status,
+        content_type="application/json; charset=utf-8",
+        headers=headers
+    )
+
+# Initialize CSRF protection; the upload and processing endpoints posted to by JavaScript
+# without a token are exempted with @csrf.exempt
+csrf = CSRFProtect(app)
 
 # Configure logging
+# Verbose request diagnostics are only wanted in development; LOG_LEVEL overrides the default
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.environ.get("LOG_LEVEL", "DEBUG" if os.environ.get("FLASK_ENV") == "development" else "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# Patterns used while handling requests, compiled once at import
+_MERMAID_BLOCK_RE = re.compile(r'```mermaid([\s\S]*?)```')
+_MISSING_RELATION_RE = re.compile(r'relation "([^"]+)" does not exist')
+_SELECT_QUERY_RE = re.compile(r'\s*select', re.IGNORECASE)
+_WRITE_COMMAND_RE = re.compile(r'^\s*(INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|TRUNCATE|GRANT)\s', re.IGNORECASE)
+
+# Reject oversized uploads before they are read; each upload is decoded in full in memory
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", 32)) * 1024 * 1024
+
+@app.before_request
+def reject_oversized_request():
+    # Checked here because views catch all exceptions, which would turn the 413 into a 500
+    if request.content_length is not None and request.content_length > app.config["MAX_CONTENT_LENGTH"]:
+        return jsonify({"error": "Upload is too large"}), 413
+
 # Configure database connection
 db_url = os.environ.get("DATABASE_URL")
 if not db_url:
@@ -81,21 +170,30 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
-    "pool_size": 10,
-    "max_overflow": 20,
+    # Sized per worker process: 10 + 10 covers 16 request threads plus the agent job
+    # threads, and 4 gunicorn workers stay at 80 connections, under PostgreSQL's default 100
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+    "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+    "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+    # Reuse the most recently returned connection so idle ones can be recycled
+    "pool_use_lifo": True,
     "connect_args": {"connect_timeout": 15}
 }
-app.config["SQLALCHEMY_ECHO"] = True  # Echo SQL queries for debugging
+# psycopg 3 (postgresql+psycopg:// URLs) prepares a statement on the server once it has run
+# this many times on a connection, so repeated queries are not re-parsed and re-planned;
+# psycopg2 has no server-side preparation
+if db_url and db_url.startswith("postgresql+psycopg://"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"]["prepare_threshold"] = int(
+        os.environ.get("DB_PREPARE_THRESHOLD", 1)
+    )
+# Echo SQL queries for debugging in development only; logging every query is costly
+app.config["SQLALCHEMY_ECHO"] = os.environ.get("FLASK_ENV") == "development"
 
-# Initialize database with app
+# Initialize database with app; connections are checked on checkout by pool_pre_ping
 try:
     db.init_app(app)
-    with app.app_context():
-        # Test database connection
-        db.engine.connect()
-        logger.info("Database connection successful!")
 except Exception as e:
-    logger.error(f"Error connecting to database: {str(e)}")
+    logger.error(f"Error initializing database: {str(e)}")
     logger.error(traceback.format_exc())
 
 # Initialize Flask-Login
@@ -104,28 +202,119 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
-# Add CORS headers to allow Authorization header
+# CORS headers added to every response, allowing the Authorization header
+_CORS_HEADERS = {
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-CSRFToken',
+    'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS',
+    'Access-Control-Allow-Credentials': 'true'
+}
+
 @app.after_request
 def after_request(response):
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,X-CSRFToken')
-    response.headers.add('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS')
-    response.headers.add('Access-Control-Allow-Credentials', 'true')
+    response.headers.extend(_CORS_HEADERS)
     return response
 
+# Users loaded for authentication are cached briefly so logged-in requests skip the lookup;
+# only column values are cached, and every request builds its own User from them. The cache
+# is per process, so an eviction reaches other workers only when their entry expires
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_ITEMS = 1024
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+def evict_cached_user(user_id):
+    """Drop a user from the authentication cache so the next request reloads it"""
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] > USER_CACHE_TTL_SECONDS:
+            del _user_cache[user_id]
+            entry = None
+    
+    if entry is None:
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        columns = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        with _user_cache_lock:
+            _user_cache[user_id] = (time.monotonic(), columns)
+            while len(_user_cache) > USER_CACHE_MAX_ITEMS:
+                _user_cache.popitem(last=False)
+        return user
+    
+    # Rebuild the user as a detached, already-loaded instance and attach it to this
+    # request's session without querying the database
+    user = User(**entry[1])
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
-# Create all tables in the database
-with app.app_context():
+# Create all tables in the database once, from a one-shot init run (RUN_DB_INIT=1) or in
+# development, rather than from every worker process on every start
+if os.environ.get("RUN_DB_INIT") == "1" or os.environ.get("FLASK_ENV") == "development":
+    with app.app_context():
+        try:
+            db.create_all()
+            logger.info("Database tables created successfully")
+        except Exception as e:
+            logger.error(f"Error creating database tables: {str(e)}")
+            logger.error(traceback.format_exc())
+
+# Templates check the database connection on every render, and the SQL console when a
+# query fails; the result is reused briefly
+DB_STATUS_CACHE_SECONDS = 10
+
+@functools.lru_cache(maxsize=1)
+def db_connection_status(time_bucket):
+    """Check the database connection; time_bucket limits this to one check per interval"""
     try:
-        db.create_all()
-        logger.info("Database tables created successfully")
+        db_info = LedgerSQL.get_database_info()
+        logging.debug("Database info: %s", db_info)
+        return db_info.get('connected', False)
     except Exception as e:
-        logger.error(f"Error creating database tables: {str(e)}")
-        logger.error(traceback.format_exc())
+        logging.error(f"Database connection check error: {str(e)}")
+        return False
+
+def database_connected():
+    """Report whether the database is reachable, checking at most once per DB_STATUS_CACHE_SECONDS"""
+    return db_connection_status(int(time.monotonic() // DB_STATUS_CACHE_SECONDS))
+
+# The SQL console suggests table names when a query names a missing table; the table
+# list is reused for a short while so repeated typos do not each query the catalog
+TABLE_LIST_CACHE_SECONDS = 60
+
+@functools.lru_cache(maxsize=1)
+def cached_table_index(time_bucket):
+    """List the database tables, and index them by lowercase first letter
+
+    Args:
+        time_bucket (int): Current cache interval
+
+    Returns:
+        tuple: (list of table names, dict of initial letter to table names)
+    """
+    tables = LedgerSQL.list_tables() or []
+    tables_by_initial = {}
+    for table in tables:
+        if table:
+            tables_by_initial.setdefault(table[0].lower(), []).append(table)
+    return tables, tables_by_initial
+
+def table_index():
+    """Table names and their first-letter index, listed at most once per TABLE_LIST_CACHE_SECONDS"""
+    return cached_table_index(int(time.monotonic() // TABLE_LIST_CACHE_SECONDS))
 
 # Timestamp function
+@functools.lru_cache(maxsize=32)
+def timezone_parts(timezone_offset):
+    """Build the offset and GMT±n label for a timezone once; timestamp() runs on every template render"""
+    gmt_sign = "+" if timezone_offset >= 0 else "-"
+    return timedelta(hours=timezone_offset), f"GMT{gmt_sign}{abs(timezone_offset)}"
+
 def timestamp(dt=None, timezone_offset=-5):
     """
     Generate a formatted timestamp string in the format YYYYMMDD_HHMMSS GMT-n
@@ -140,31 +329,15 @@ def timestamp(dt=None, timezone_offset=-5):
     if dt is None:
         dt = datetime.now()
     
-    # Calculate the time with offset
-    from datetime import timedelta
-    adjusted_dt = dt + timedelta(hours=timezone_offset)
-    
-    # Format the timestamp with timezone indicator
-    gmt_sign = "+" if timezone_offset >= 0 else "-"
-    gmt_value = abs(timezone_offset)
-    
-    return f"{adjusted_dt.strftime('%Y%m%d_%H%M%S')} GMT{gmt_sign}{gmt_value}"
+    offset, suffix = timezone_parts(timezone_offset)
+    return f"{(dt + offset).strftime('%Y%m%d_%H%M%S')} {suffix}"
 
 # Make the timestamp function available to all templates
 @app.context_processor
 def utility_processor():
     def check_db_connection():
         """Check if the database connection is working"""
-        try:
-            # Use our new LedgerSQL class to check connection and get DB info
-            from utils.ledger_sql import LedgerSQL
-            
-            db_info = LedgerSQL.get_database_info()
-            logging.debug(f"Database info: {db_info}")
-            return db_info.get('connected', False)
-        except Exception as e:
-            logging.error(f"Database connection check error: {str(e)}")
-            return False
+        return database_connected()
     
     def get_db_url():
         """Get the database URL (masked for security)"""
@@ -191,11 +364,8 @@ def prompts():
     """
     Display the prompt management interface
     """
-    from utils.prompt_manager import get_default_prompts, get_prompt_list
-    
     # Get all prompts for the current user
-    default_prompts = get_default_prompts()
-    prompt_list = get_prompt_list()
+    default_prompts, prompt_list = default_prompt_catalog()
     
     # Check session for custom prompts
     custom_prompts = session.get('custom_prompts', {})
@@ -210,14 +380,17 @@ def prompts():
     
     return render_template("prompts.html", prompts=prompts, prompt_list=prompt_list)
 
+@functools.lru_cache(maxsize=1)
+def default_prompt_catalog():
+    """Load the built-in prompts and prompt list once; they do not change while the app runs"""
+    return get_default_prompts(), get_prompt_list()
+
 @app.route("/api/prompts/save", methods=["POST"])
 @login_required
 def save_prompt():
     """
     Save a custom prompt
     """
-    from utils.prompt_manager import save_custom_prompt
-    
     data = request.json
     prompt_key = data.get('prompt_key')
     prompt_data = data.get('prompt_data')
@@ -238,8 +411,6 @@ def reset_prompt():
     """
     Reset a prompt to its default value
     """
-    from utils.prompt_manager import reset_prompt as reset_prompt_func
-    
     data = request.json
     prompt_key = data.get('prompt_key')
     
@@ -259,8 +430,6 @@ def reset_all_prompts():
     """
     Reset all prompts to their default values
     """
-    from utils.prompt_manager import reset_all_prompts as reset_all_prompts_func
-    
     reset_all_prompts_func(current_user.id)
     
     return jsonify({"success": True})
@@ -272,8 +441,6 @@ def set_active_prompt():
     """
     Set the active prompt
     """
-    from utils.prompt_manager import set_active_prompt_key
-    
     # Get prompt key from request
     data = request.get_json()
     prompt_key = data.get('prompt_key')
@@ -295,8 +462,6 @@ def prompt_status():
     """
     Get the status of prompts (custom or default, and which is active)
     """
-    from utils.prompt_manager import get_active_prompt_key
-    
     # Get custom prompts from session
     custom_prompts = session.get('custom_prompts', {})
     
@@ -309,38 +474,25 @@ def prompt_status():
         "active_prompt_key": active_prompt_key
     })
 
+DOCUMENTATION_FILE = 'COBOL_Documentation_Generator.md'
+
+@functools.lru_cache(maxsize=4)
+def rendered_markdown_file(path, mtime):
+    """Read and render a markdown file; mtime is part of the cache key so edits are picked up"""
+    with open(path, 'r') as f:
+        md_content = f.read()
+    
+    # Convert markdown to HTML, wrapping Mermaid diagrams for client-side rendering
+    return documentation_to_html(md_content)
+
 @app.route("/documentation")
 def view_documentation():
     """
     Display the COBOL Documentation Generator markdown documentation with proper rendering
     """
     try:
-        import markdown
-        
-        # Read the markdown file
-        with open('COBOL_Documentation_Generator.md', 'r') as f:
-            md_content = f.read()
-        
-        # Convert markdown to HTML
-        html_content = markdown.markdown(
-            md_content,
-            extensions=[
-                'markdown.extensions.tables',
-                'markdown.extensions.fenced_code',
-                'markdown.extensions.codehilite',
-                'markdown.extensions.toc'
-            ]
-        )
-        
-        # Process Mermaid diagrams
-        # Find mermaid code blocks and wrap them properly for client-side rendering
-        mermaid_pattern = r'```mermaid\s+(.*?)\s+```'
-        
-        def mermaid_replace(match):
-            diagram_code = match.group(1).strip()
-            return f'<div class="mermaid">{diagram_code}</div>'
-        
-        html_content = re.sub(mermaid_pattern, mermaid_replace, html_content, flags=re.DOTALL)
+        # The rendered page is reused until the markdown file changes
+        html_content = rendered_markdown_file(DOCUMENTATION_FILE, os.stat(DOCUMENTATION_FILE).st_mtime)
         
         return render_template('documentation_viewer.html', doc_content=html_content)
     except Exception as e:
@@ -348,6 +500,31 @@ def view_documentation():
         logger.error(f"Error rendering documentation: {str(e)}")
         return f"<h1>Error rendering documentation</h1><p>{str(e)}</p><pre>{traceback.format_exc()}</pre>"
 
+# Tooltip defaults used until a user saves their own tooltip settings
+TOOLTIP_DEFAULTS = {
+    'tooltip_delay': 1000,
+    'tooltip_x_offset': 10,
+    'tooltip_y_offset': 10,
+    'tooltip_font_size': 6,
+    'tooltip_opacity': 0.9
+}
+
+# Settings used until a user saves their own; routes copy it before storing it in the session
+DEFAULT_USER_SETTINGS = MappingProxyType({
+    'llm_provider': 'groq',          # Default to GROQ
+    'llm_model': None,               # Will be set to default for the provider
+    'detail_level': 'medium',        # medium detail level
+    'audience': 'technical',         # technical audience
+    'documentation_style': 'formal', # formal style
+    **TOOLTIP_DEFAULTS
+})
+
+# /api/llm-settings and the ledger dashboard start from a larger, more transparent tooltip
+LEDGER_TOOLTIP_DEFAULTS = MappingProxyType({
+    'tooltip_font_size': 12,
+    'tooltip_opacity': 0.75
+})
+
 @app.route("/")
 def index():
     # Get user settings from session
@@ -355,21 +532,12 @@ def index():
     if hasattr(current_user, 'id'):
         user_settings = session.get('user_settings', {})
     
-    # Default settings if none exist
+    # Default settings if none exist; anonymous visitors get them without a session write,
+    # which would otherwise re-sign the cookie or rewrite the Redis session on every request
     if not user_settings:
-        user_settings = {
-            'llm_provider': 'groq',          # Default to GROQ
-            'llm_model': None,               # Will be set to default for the provider
-            'detail_level': 'medium',        # medium detail level
-            'audience': 'technical',         # technical audience
-            'documentation_style': 'formal', # formal style
-            'tooltip_delay': 1000,           # 1000ms delay for tooltips
-            'tooltip_x_offset': 10,          # 10px right offset
-            'tooltip_y_offset': 10,          # 10px down offset
-            'tooltip_font_size': 6,          # 6px font size
-            'tooltip_opacity': 0.9           # 90% opacity
-        }
-        session['user_settings'] = user_settings
+        user_settings = dict(DEFAULT_USER_SETTINGS)
+        if hasattr(current_user, 'id'):
+            session['user_settings'] = user_settings
     
     return render_template("index.html", user_settings=user_settings)
 
@@ -397,11 +565,10 @@ def register():
             return render_template("register.html")
         
         # Create new user
-        from werkzeug.security import generate_password_hash
         new_user = User(
             username=username,
             email=email,
-            password_hash=generate_password_hash(password)
+            password_hash=hash_password(password)
         )
         
         db.session.add(new_user)
@@ -424,14 +591,23 @@ def login():
             return render_template("login.html")
         
         # Verify user
-        from werkzeug.security import check_password_hash
         user = User.query.filter_by(username=username).first()
         
-        if not user or not check_password_hash(user.password_hash, password):
+        if not user or not verify_password(user.password_hash, password):
             flash("Invalid credentials", "danger")
             return render_template("login.html")
         
-        # Log in user with Flask-Login
+        # Upgrade older password hashes now that the plain-text password is known
+        if needs_rehash(user.password_hash):
+            try:
+                user.password_hash = hash_password(password)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error upgrading password hash: {str(e)}")
+        
+        # Log in user with Flask-Login, dropping any cached copy from an earlier session
+        evict_cached_user(user.id)
         login_user(user, remember=True)
         
         # Set additional info in session if needed
@@ -444,6 +620,8 @@ def login():
 
 @app.route("/logout")
 def logout():
+    if current_user.is_authenticated:
+        evict_cached_user(current_user.id)
     logout_user()
     session.pop("username", None)
     flash("You have been logged out", "info")
@@ -452,8 +630,12 @@ def logout():
 @app.route("/dashboard")
 @login_required
 def dashboard():
-    # Get user's projects
-    projects = Project.query.filter_by(user_id=current_user.id).all()
+    # Get user's projects, loading their files and documentation up front
+    # so the template does not issue a query per project and per file
+    projects = (Project.query
+                .options(selectinload(Project.cobol_files).selectinload(CobolFile.documentation))
+                .filter_by(user_id=current_user.id)
+                .all())
     
     return render_template("dashboard.html", projects=projects)
 
@@ -468,16 +650,21 @@ def upload_cobol():
         cobol_code = ""
         
         # Debug the request format
-        logger.debug(f"Request method: {request.method}")
-        logger.debug(f"Request content type: {request.content_type}")
-        logger.debug(f"Request form keys: {list(request.form.keys()) if request.form else 'None'}")
-        logger.debug(f"Request files keys: {list(request.files.keys()) if request.files else 'None'}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request method: %s", request.method)
+            logger.debug("Request content type: %s", request.content_type)
+            logger.debug("Request form keys: %s", list(request.form.keys()) if request.form else 'None')
+            logger.debug("Request files keys: %s", list(request.files.keys()) if request.files else 'None')
         
         # Check if code was uploaded as file
         if 'file' in request.files and request.files['file'].filename:
             file = request.files['file']
-            logger.debug(f"File uploaded: {file.filename}")
-            cobol_code = file.read().decode('utf-8')
+            logger.debug("File uploaded: %s", file.filename)
+            try:
+                cobol_code = read_upload_text(file)
+            except UnicodeDecodeError:
+                logger.error("File encoding error")
+                return jsonify({"error": UPLOAD_ENCODING_ERROR}), 400
         # Check if code was pasted
         elif 'code' in request.form:
             logger.debug("Code found in form data")
@@ -486,11 +673,10 @@ def upload_cobol():
             # Attempt to read raw data as a fallback
             try:
                 raw_data = request.get_data(as_text=True)
-                logger.debug(f"Trying to parse raw data: {raw_data[:100]}..." if len(raw_data) > 100 else raw_data)
+                logger.debug("Trying to parse raw data: %.100s", raw_data)
                 
                 # If it looks like URL-encoded form data
                 if "code=" in raw_data:
-                    import urllib.parse
                     parsed = urllib.parse.parse_qs(raw_data)
                     if 'code' in parsed:
                         cobol_code = parsed['code'][0]
@@ -519,8 +705,8 @@ def upload_cobol():
         session['cobol_code'] = cobol_code
         
         # Debug the session data
-        logger.debug(f"Stored code in session, length: {len(cobol_code)}")
-        logger.debug(f"Session job_id: {job_id}")
+        logger.debug("Stored code in session, length: %s", len(cobol_code))
+        logger.debug("Session job_id: %s", job_id)
         
         return jsonify({
             "status": "success", 
@@ -532,13 +718,270 @@ def upload_cobol():
         logger.error(f"Error uploading COBOL code: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Bump when the extraction, documentation, or diagram prompts change to invalidate cached responses
+PROMPT_VERSION = "1"
+
+def source_hash(cobol_code):
+    """SHA-256 of COBOL source with trailing whitespace and blank edges removed, used as a cache key"""
+    normalized_code = "\n".join(line.rstrip() for line in cobol_code.splitlines()).strip()
+    return hashlib.sha256(normalized_code.encode('utf-8')).hexdigest()
+
+# Documentation generated after a failed LLM call carries an "## Error: ..." section
+_ERROR_SECTION_RE = re.compile(r'^## Error: ', re.MULTILINE)
+
+def is_cacheable_llm_output(result):
+    """Whether a stage result came from the model rather than an error or fallback path
+    
+    Args:
+        result: A stage result (Markdown documentation or structured data)
+        
+    Returns:
+        bool: False for error documentation, error payloads, and fallback structures
+    """
+    if isinstance(result, str):
+        return _ERROR_SECTION_RE.search(result) is None
+    if isinstance(result, dict):
+        return "error" not in result and result.get("description") != ANALYSIS_FALLBACK_DESCRIPTION
+    return result is not None
+
+def cached_llm_stage(stage, model_id, input_hash, compute, cacheable=is_cacheable_llm_output):
+    """Run an LLM pipeline stage, reusing a cached result for the same input
+    
+    Args:
+        stage (str): Name of the pipeline stage
+        model_id (str): Provider and model (or a hash of the settings) the stage depends on
+        input_hash (str): SHA-256 of the normalized COBOL source
+        compute (callable): Produces the stage result on a cache miss
+        cacheable (callable): Decides whether a computed result may be cached; error
+            and fallback results are returned but recomputed on the next request
+        
+    Returns:
+        The JSON-serializable stage result
+    """
+    key = f"{stage}:{PROMPT_VERSION}:{model_id}:{input_hash}"
+    cached = llm_cache.get(key)
+    if cached is not None:
+        logger.debug("LLM cache hit for stage %s", stage)
+        return json.loads(cached)
+    
+    result = compute()
+    if cacheable(result):
+        llm_cache.put(key, json.dumps(result))
+    else:
+        logger.debug("Not caching error or fallback result for stage %s", stage)
+    return result
+
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def documentation_pipeline(cobol_code, model_id, input_hash):
+    """Run the documentation pipeline one stage at a time
+    
+    Args:
+        cobol_code (str): The COBOL source code
+        model_id (str): Provider and model the LLM stages run on
+        input_hash (str): SHA-256 of the normalized COBOL source
+        
+    Yields:
+        tuple: (stage name, progress percentage, stage result); the last stage's
+            result is the final Markdown documentation
+    """
+    # Step 1: Parse COBOL code
+    parsed_structure = parse_cobol(cobol_code)
+    yield "parse", 25, parsed_structure
+    
+    # Step 2: Extract structured information using Perplexity AI
+    structured_data = cached_llm_stage(
+        "extract", model_id, input_hash,
+        lambda: extract_structure(cobol_code, parsed_structure)
+    )
+    yield "extract", 50, structured_data
+    
+    # Step 3: Generate documentation with Perplexity AI
+    documentation = cached_llm_stage(
+        "generate", model_id, input_hash,
+        lambda: generate_documentation(structured_data)
+    )
+    yield "generate", 75, documentation
+    
+    # Step 4: Generate diagrams for the documentation with Perplexity AI
+    final_documentation = cached_llm_stage(
+        "diagrams", model_id, input_hash,
+        lambda: generate_diagrams(documentation)
+    )
+    
+    # Step 5: Enhance with tabbed diagram views if needed
+    final_documentation = add_diagram_tabs(final_documentation)
+    yield "diagrams", 100, final_documentation
+
+# Signed tokens let clients name generated documentation in later requests instead of
+# the session carrying it; they expire together with the stored documentation
+_doc_token_serializer = URLSafeTimedSerializer(app.secret_key, salt="doc-token")
+
+def make_doc_token(doc_id, program_id=None):
+    """Sign a document store ID, and the program ID used for the download filename"""
+    return _doc_token_serializer.dumps({"doc_id": doc_id, "program_id": program_id})
+
+def requested_doc():
+    """Find the documentation a request refers to
+    
+    Uses the doc_token request parameter when given, otherwise the documentation
+    last generated in this session.
+    
+    Returns:
+        tuple: (doc_id, program_id); doc_id is None without a valid reference
+    """
+    token = request.values.get('doc_token')
+    if not token:
+        return session.get('doc_id'), session.get('program_id')
+    try:
+        data = _doc_token_serializer.loads(token, max_age=DOC_TTL_SECONDS)
+    except BadSignature:
+        return None, None
+    return data.get("doc_id"), data.get("program_id")
+
+# Characters decoded per read when loading an uploaded file
+UPLOAD_READ_CHUNK_CHARS = 256 * 1024
+# Returned with a 400 when an uploaded file is not valid UTF-8
+UPLOAD_ENCODING_ERROR = "The uploaded file contains invalid characters. Please ensure it's a text file with UTF-8 encoding."
+
+def read_upload_text(file):
+    """Decode an uploaded file straight from its stream
+    
+    The stream is decoded a chunk at a time, so a large upload that Werkzeug has spooled
+    to disk is not also held in memory as raw bytes; the decoded text itself is returned
+    whole, since the parser and the LLM prompts take the complete source.
+    Line endings are kept as uploaded, since COBOL sources are column-sensitive.
+    
+    Args:
+        file (FileStorage): The uploaded file
+        
+    Returns:
+        str: The file's text
+        
+    Raises:
+        UnicodeDecodeError: If the file is not valid UTF-8 (e.g. EBCDIC)
+    """
+    reader = io.TextIOWrapper(file.stream, encoding='utf-8', newline='')
+    return ''.join(iter(functools.partial(reader.read, UPLOAD_READ_CHUNK_CHARS), ''))
+
+def mermaid_block_to_div(match):
+    """Replace a fenced Mermaid block with a div that mermaid.js renders client-side"""
+    return f'<div class="mermaid">{match.group(1).strip()}</div>'
+
+def render_markdown(text):
+    """Render Markdown to HTML with python-markdown"""
+    return python_markdown().reset().convert(text)
+
+# Markdown instances keep state between conversions and are not thread-safe, so each
+# worker thread builds one and resets it per document instead of reloading extensions
+_markdown_local = threading.local()
+
+def python_markdown():
+    """Return this thread's python-markdown converter, creating it on first use"""
+    md = getattr(_markdown_local, "md", None)
+    if md is None:
+        # Define custom extensions for proper markdown processing; code blocks without a
+        # language are left unhighlighted rather than trying every Pygments lexer on them
+        md = _markdown_local.md = markdown.Markdown(
+            extensions=[
+                'markdown.extensions.extra',
+                'markdown.extensions.codehilite',
+                'markdown.extensions.tables',
+                'markdown.extensions.toc'
+            ],
+            extension_configs={
+                'markdown.extensions.codehilite': {'guess_lang': False}
+            }
+        )
+    return md
+
+def upsert_statement(model, rows, conflict_columns, update_columns):
+    """Build an INSERT ... ON CONFLICT DO UPDATE statement for the current database dialect
+    
+    Args:
+        model: SQLAlchemy model to write to
+        rows (list): Column values for each new row
+        conflict_columns (list): Columns of the unique constraint that identifies an existing row
+        update_columns (list): Columns copied from the new values onto an existing row
+        
+    Returns:
+        Insert: The upsert statement, ready to execute
+    """
+    insert = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(model).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=conflict_columns,
+        set_={column: stmt.excluded[column] for column in update_columns}
+    )
+
+def upsert_id(model, values, conflict_columns, update_columns):
+    """Insert a row, or update the existing row that conflicts with it, in one statement
+    
+    Args:
+        model: SQLAlchemy model to write to
+        values (dict): Column values for the new row
+        conflict_columns (list): Columns of the unique constraint that identifies an existing row
+        update_columns (list): Columns copied from values onto an existing row
+        
+    Returns:
+        int: ID of the inserted or updated row
+    """
+    stmt = upsert_statement(model, [values], conflict_columns, update_columns).returning(model.id)
+    return db.session.execute(stmt).scalar_one()
+
+def add_diagram_tabs(documentation):
+    """Add tabbed diagram views to documentation with Mermaid blocks that do not have them yet
+    
+    Args:
+        documentation (str): Markdown documentation
+        
+    Returns:
+        str: The enhanced documentation, or the original if there is nothing to enhance
+    """
+    if enhance_markdown_with_tabs is None or '```mermaid' not in documentation:
+        return documentation
+    if '<div class="mermaid-container">' in documentation:
+        return documentation
+    try:
+        documentation = enhance_markdown_with_tabs(documentation)
+        logger.debug("Enhanced documentation with tabbed diagram views")
+    except Exception as e:
+        logger.warning(f"Could not enhance documentation with tabbed diagram views: {str(e)}")
+    return documentation
+
+def documentation_to_html(documentation):
+    """Convert Markdown documentation to HTML, keeping Mermaid blocks for client-side rendering
+    
+    Args:
+        documentation (str): Markdown documentation
+        
+    Returns:
+        str: HTML documentation
+    """
+    # Replace mermaid code blocks with proper divs for mermaid.js
+    # This preserves mermaid blocks for client-side rendering; documents without
+    # diagrams skip the regex scan entirely
+    mermaid_processed = documentation
+    if '```mermaid' in documentation:
+        try:
+            mermaid_processed, block_count = _MERMAID_BLOCK_RE.subn(mermaid_block_to_div, documentation)
+            logger.debug("Processed %s mermaid blocks", block_count)
+        except Exception as mermaid_error:
+            # If mermaid processing fails, the original documentation is used
+            logger.error(f"Error processing mermaid blocks: {str(mermaid_error)}")
+    
+    # Process regular markdown after handling mermaid blocks; python-markdown
+    # already escapes the contents of code spans and blocks
+    html_content = render_markdown(mermaid_processed)
+    logger.info("Successfully converted markdown to HTML on server-side")
+    return html_content
+
 @app.route("/api/process", methods=["POST"])
 @csrf.exempt
 def process_cobol():
     try:
-        # Import the markdown conversion library
-        import markdown
-        
         # Generate a unique job ID
         job_id = str(uuid.uuid4())
         
@@ -550,10 +993,13 @@ def process_cobol():
         for field_name in file_fields:
             if field_name in request.files and request.files[field_name].filename:
                 file = request.files[field_name]
-                logger.debug(f"File uploaded: {file.filename}")
+                logger.debug("File uploaded: %s", file.filename)
                 try:
-                    cobol_code = file.read().decode('utf-8')
+                    cobol_code = read_upload_text(file)
                     break
+                except UnicodeDecodeError:
+                    logger.error("File encoding error")
+                    return jsonify({"error": UPLOAD_ENCODING_ERROR}), 400
                 except Exception as e:
                     logger.error(f"Error reading file: {str(e)}")
         
@@ -561,7 +1007,7 @@ def process_cobol():
         if not cobol_code:
             for field_name in ['cobolCode', 'code']:  # Check multiple possible field names
                 if field_name in request.form and request.form[field_name].strip():
-                    logger.debug(f"Code found in form field: {field_name}")
+                    logger.debug("Code found in form field: %s", field_name)
                     cobol_code = request.form[field_name]
                     break
         
@@ -569,7 +1015,7 @@ def process_cobol():
         if not cobol_code:
             cobol_code = session.get('cobol_code', '')
             if cobol_code:
-                logger.debug(f"Retrieved code from session, length: {len(cobol_code)}")
+                logger.debug("Retrieved code from session, length: %s", len(cobol_code))
             
         if not cobol_code:
             logger.error("No COBOL code found for processing")
@@ -584,203 +1030,373 @@ def process_cobol():
             'status': 'processing',
             'progress_percentage': 10,
             'status_message': 'Parsing COBOL code...',
-            'started_at': datetime.utcnow().isoformat(),
+            'started_at': int(time.time()),  # epoch seconds; smaller in the session cookie than an ISO string
             'result': None,
             'error': None
         }
         
-        # Step 1: Parse COBOL code
-        parsed_structure = parse_cobol(cobol_code)
-        
-        # Step 2: Extract structured information using Perplexity AI
-        structured_data = extract_structure(cobol_code, parsed_structure)
-        
-        # Step 3: Generate documentation with Perplexity AI
-        documentation = generate_documentation(structured_data)
-        
-        # Step 4: Generate diagrams for the documentation with Perplexity AI
-        final_documentation = generate_diagrams(documentation)
-        
-        # Step 5: Enhance with tabbed diagram views if needed
-        if '```mermaid' in final_documentation and '<div class="mermaid-container">' not in final_documentation:
-            try:
-                from utils.mermaid_viewer import enhance_markdown_with_tabs
-                final_documentation = enhance_markdown_with_tabs(final_documentation)
-                logger.debug("Enhanced documentation with tabbed diagram views")
-            except Exception as e:
-                logger.warning(f"Could not enhance documentation with tabbed diagram views: {str(e)}")
+        # LLM stages are cached by source content, so resubmitting the same program is free
+        input_hash = source_hash(cobol_code)
+        user_settings = session.get('user_settings', {})
+        model_id = f"{user_settings.get('llm_provider') or 'default'}/{user_settings.get('llm_model') or 'default'}"
         
-        # Store documentation in a temporary file rather than in the session
+        # Documentation is stored in the document store rather than in the session
         doc_id = str(uuid.uuid4())
         session['doc_id'] = doc_id
-        tmp_path = f"/tmp/{doc_id}.md"
         
-        # Write documentation to temporary file
-        with open(tmp_path, "w") as f:
-            f.write(final_documentation)
+        # Stream stage progress when the client asks for Server-Sent Events
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            # The session cookie is sent with the response headers, before the generator
+            # runs, so the stream records its progress and result in the job store instead
+            record_id = agent_job_record_id(job_id)
+            update_job(
+                record_id,
+                status='processing',
+                progress_percentage=10,
+                status_message='Parsing COBOL code...',
+                owner=current_job_owner()
+            )
             
-        # Store just basic metadata in session
-        doc_metadata = {
-            'length': len(final_documentation),
-            'timestamp': datetime.utcnow().isoformat(),
-        }
-        session['doc_metadata'] = doc_metadata
+            def generate_events():
+                try:
+                    program_id = None
+                    for stage, progress, result in documentation_pipeline(cobol_code, model_id, input_hash):
+                        if stage == "extract" and result:
+                            program_id = result.get('program_id')
+                        update_job(record_id, progress_percentage=progress, status_message=f'Finished {stage} stage')
+                        yield sse_event("stage", {"stage": stage, "pct": progress})
+                    final_documentation = result
+                    save_documentation(doc_id, final_documentation)
+                    update_job(
+                        record_id,
+                        status='completed',
+                        progress_percentage=100,
+                        status_message='Documentation generated successfully',
+                        doc_id=doc_id,
+                        program_id=program_id
+                    )
+                    
+                    try:
+                        documentation, doc_format = documentation_to_html(final_documentation), "html"
+                    except Exception as html_error:
+                        logger.error(f"Error during HTML conversion/escaping: {str(html_error)}")
+                        documentation, doc_format = final_documentation, "markdown"
+                    
+                    yield sse_event("complete", {
+                        "status": "success",
+                        "job_id": job_id,
+                        "documentation": documentation,
+                        "format": doc_format,
+                        "doc_token": make_doc_token(doc_id, program_id)
+                    })
+                except Exception as stream_error:
+                    logger.error(f"Error processing COBOL code: {str(stream_error)}")
+                    update_job(
+                        record_id,
+                        status='failed',
+                        progress_percentage=100,
+                        status_message='Documentation generation failed',
+                        error=str(stream_error)
+                    )
+                    yield sse_event("error", {"error": str(stream_error)})
+            
+            return Response(
+                generate_events(),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
+        stage_results = {}
+        for stage, progress, result in documentation_pipeline(cobol_code, model_id, input_hash):
+            stage_results[stage] = result
+        structured_data = stage_results["extract"]
+        final_documentation = stage_results["diagrams"]
         
-        # Store the documentation in the session as well for job status endpoint
-        session['documentation'] = final_documentation
+        save_documentation(doc_id, final_documentation)
         
         # Store program ID in session for the download filename
         if structured_data and 'program_id' in structured_data:
             session['program_id'] = structured_data.get('program_id')
+        doc_token = make_doc_token(doc_id, (structured_data or {}).get('program_id'))
         
         # Convert Markdown to HTML on server-side
-        # Define custom extensions for proper markdown processing
-        md = markdown.Markdown(
-            extensions=[
-                'markdown.extensions.extra',
-                'markdown.extensions.codehilite',
-                'markdown.extensions.tables',
-                'markdown.extensions.toc'
-            ]
-        )
-        
         try:
-            # Replace mermaid code blocks with proper divs for mermaid.js
-            # This preserves mermaid blocks for client-side rendering
-            try:
-                mermaid_processed = final_documentation
-                mermaid_blocks = re.findall(r'```mermaid([\s\S]*?)```', mermaid_processed)
-                
-                for i, block in enumerate(mermaid_blocks):
-                    # Replace each mermaid code block with a div
-                    mermaid_processed = mermaid_processed.replace(
-                        f"```mermaid{block}```",
-                        f'<div class="mermaid">{block.strip()}</div>',
-                        1  # Replace only the first occurrence each time
-                    )
-                logger.debug(f"Processed {len(mermaid_blocks)} mermaid blocks")
-            except Exception as mermaid_error:
-                logger.error(f"Error processing mermaid blocks: {str(mermaid_error)}")
-                # If mermaid processing fails, use original documentation
-                mermaid_processed = final_documentation
+            html_content = documentation_to_html(final_documentation)
             
-            # Process regular markdown after handling mermaid blocks
-            try:
-                html_content = md.convert(mermaid_processed)
-                logger.info("Successfully converted markdown to HTML on server-side")
-                
-                # Additional step to fix code blocks and ensure HTML is valid for JSON
-                html_content = re.sub(
-                    r'<code>(.*?)</code>',
-                    lambda m: f'<code>{m.group(1).replace("<", "&lt;").replace(">", "&gt;")}</code>',
-                    html_content,
-                    flags=re.DOTALL
-                )
-                
-                # Update the job status to completed
-                session['job_status'] = {
-                    'status': 'completed',
-                    'progress_percentage': 100,
-                    'status_message': 'Documentation generated successfully',
-                    'result': {
-                        'documentation': html_content,
-                        'format': 'html',
-                        'job_id': job_id
-                    }
-                }
-                
-                # Create a Response object with explicit content-type
-                from flask import Response
-                response_data = json.dumps({
-                    "status": "success",
-                    "job_id": job_id,
-                    "documentation": html_content,
-                    "format": "html"
-                })
-                
-                return Response(
-                    response=response_data,
-                    status=200,
-                    mimetype="application/json"
-                )
-            except Exception as html_error:
-                logger.error(f"Error during HTML conversion/escaping: {str(html_error)}")
-                
-                # Update the job status to completed but with markdown format
-                session['job_status'] = {
-                    'status': 'completed',
-                    'progress_percentage': 100,
-                    'status_message': 'Documentation generated successfully (markdown format)',
-                    'result': {
-                        'documentation': final_documentation,
-                        'format': 'markdown',
-                        'job_id': job_id
-                    }
-                }
-                
-                # If HTML conversion fails, use original markdown as fallback
-                return jsonify({
-                    "status": "success",
-                    "job_id": job_id,
-                    "documentation": final_documentation,
-                    "format": "markdown"
-                })
+            # Update the job status to completed; the documentation itself is in the document store
+            session['job_status'] = {
+                'status': 'completed',
+                'progress_percentage': 100,
+                'status_message': 'Documentation generated successfully'
+            }
             
-        except Exception as md_error:
-            logger.error(f"Error converting markdown to HTML: {str(md_error)}")
-            # Fall back to sending raw markdown
+            return json_response({
+                "status": "success",
+                "job_id": job_id,
+                "documentation": html_content,
+                "format": "html",
+                "doc_token": doc_token
+            })
+        except Exception as html_error:
+            logger.error(f"Error during HTML conversion/escaping: {str(html_error)}")
+            
+            # Update the job status to completed but with markdown format
+            session['job_status'] = {
+                'status': 'completed',
+                'progress_percentage': 100,
+                'status_message': 'Documentation generated successfully (markdown format)'
+            }
+            
+            # If HTML conversion fails, use original markdown as fallback
             return jsonify({
                 "status": "success",
                 "job_id": job_id,
                 "documentation": final_documentation,
-                "format": "markdown"
+                "format": "markdown",
+                "doc_token": doc_token
             })
         
     except Exception as e:
         logger.error(f"Error processing COBOL code: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Agent jobs requested in the background run on these threads rather than on the request thread
+AGENT_JOB_WORKERS = int(os.environ.get("AGENT_JOB_WORKERS", 4))
+_agent_job_executor = ThreadPoolExecutor(max_workers=AGENT_JOB_WORKERS, thread_name_prefix="agent-job")
+
+def run_agent_job(agent, cobol_code, user_settings, preferences, user_id, on_progress=None,
+                  on_chunk=None, on_field=None):
+    """Generate documentation with the agent, store it, and save it for the user
+    
+    Args:
+        agent (COBOLDocumentationAgent): Agent with the user's preferences applied
+        cobol_code (str): The COBOL source code
+        user_settings (dict): The user's saved settings
+        preferences (dict): Preferences sent with the request
+        user_id (int): ID of the logged-in user, or None
+        on_progress (callable, optional): Called with (percentage, message) as stages finish
+        on_chunk (callable, optional): Called with each documentation Markdown chunk as the LLM streams it
+        on_field (callable, optional): Called with (key, value) for each analysis field as it streams in
+        
+    Returns:
+        tuple: (structured data, Markdown documentation, document store ID)
+    """
+    def report(progress, message):
+        if on_progress is not None:
+            on_progress(progress, message)
+    
+    def run_agent():
+        # Step 1: Parse COBOL code
+        parsed_structure = parse_cobol(cobol_code)
+        report(25, 'Analyzing COBOL structure...')
+        
+        # Step 2: Use agent to analyze code and generate documentation
+        structured_data = agent.analyze_cobol_structure(
+            cobol_code, parsed_structure, prefetch_enrichment=True, on_field=on_field
+        )
+        report(50, 'Generating documentation...')
+        documentation = agent.generate_documentation(structured_data, on_chunk=on_chunk)
+        report(75, 'Enhancing diagrams...')
+        
+        # Step 3: Ensure the mermaid tabs are applied
+        documentation = add_diagram_tabs(documentation)
+        return {"structured_data": structured_data, "documentation": documentation}
+    
+    # The agent's output depends only on the code and the effective preferences, so
+    # identical requests reuse the cached result and skip parsing and the LLM calls
+    settings_json = json.dumps({**user_settings, **preferences}, sort_keys=True, default=str)
+    settings_hash = hashlib.sha256(settings_json.encode('utf-8')).hexdigest()
+    agent_result = cached_llm_stage(
+        "agent", settings_hash, source_hash(cobol_code), run_agent,
+        cacheable=lambda result: all(map(is_cacheable_llm_output, result.values()))
+    )
+    structured_data = agent_result["structured_data"]
+    documentation = agent_result["documentation"]
+    
+    # Store documentation in the document store rather than in the session
+    doc_id = str(uuid.uuid4())
+    save_documentation(doc_id, documentation)
+    
+    # If user is logged in, save the documentation
+    if user_id:
+        try:
+            # Upsert the project, file, and documentation: one statement per table
+            # instead of a lookup followed by an insert or update
+            program_id = structured_data.get('program_id', 'Unknown')
+            now = datetime.utcnow()
+            project_id = upsert_id(
+                Project,
+                dict(
+                    name=f"COBOL Documentation - {program_id}",
+                    description=structured_data.get('description', 'No description available'),
+                    user_id=user_id,
+                    created_at=now,
+                    updated_at=now
+                ),
+                conflict_columns=['user_id', 'name'],
+                update_columns=['updated_at']
+            )
+            cobol_file_id = upsert_id(
+                CobolFile,
+                dict(
+                    filename=f"{structured_data.get('program_id', 'program')}.cbl",
+                    content=cobol_code,
+                    program_id=program_id,
+                    project_id=project_id,
+                    created_at=now,
+                    updated_at=now
+                ),
+                conflict_columns=['project_id', 'program_id'],
+                update_columns=['content', 'updated_at']
+            )
+            upsert_id(
+                Documentation,
+                dict(content=documentation, cobol_file_id=cobol_file_id, created_at=now, updated_at=now),
+                conflict_columns=['cobol_file_id'],
+                update_columns=['content', 'updated_at']
+            )
+            
+            db.session.commit()
+            logger.info("Saved documentation for user %s", user_id)
+            
+        except Exception as db_error:
+            logger.error(f"Error saving documentation to database: {str(db_error)}")
+            db.session.rollback()
+    
+    return structured_data, documentation, doc_id
+
+# Agent and pipeline jobs are kept under their own prefix in the job store, apart from
+# project batch records, and name the user or browser session that started them
+def agent_job_record_id(job_id):
+    """Job store ID of the record kept for an agent or pipeline job"""
+    return f"agent:{job_id}"
+
+def current_job_owner():
+    """Identify who may see a job: the logged-in user, otherwise this browser session"""
+    if current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    if 'job_owner' not in session:
+        session['job_owner'] = str(uuid.uuid4())
+    return f"session:{session['job_owner']}"
+
+def agent_job_worker(job_id, agent, cobol_code, user_settings, preferences, user_id, events=None):
+    """Run an agent job in the background, recording its progress in the job store
+    
+    When an events queue is given, progress, analysis fields, documentation chunks, and
+    the final result are also put on it as (event, data) pairs for a Server-Sent Events
+    response; the last pair is always a "complete" or "error" event.
+    """
+    record_id = agent_job_record_id(job_id)
+    on_chunk = on_field = None
+    if events is not None:
+        on_chunk = lambda chunk: events.put(("chunk", {"text": chunk}))
+        on_field = lambda key, value: events.put(("field", {"key": key, "value": value}))
+    
+    def on_progress(progress, message):
+        update_job(record_id, status='processing', progress_percentage=progress, status_message=message)
+        if events is not None:
+            events.put(("stage", {"pct": progress, "message": message}))
+    
+    with app.app_context(), agent:
+        on_progress(10, 'Parsing COBOL code...')
+        try:
+            structured_data, documentation, doc_id = run_agent_job(
+                agent, cobol_code, user_settings, preferences, user_id, on_progress, on_chunk, on_field
+            )
+            update_job(
+                record_id,
+                status='completed',
+                progress_percentage=100,
+                status_message='Documentation generated successfully',
+                doc_id=doc_id,
+                program_id=structured_data.get('program_id')
+            )
+        except Exception as e:
+            logger.error(f"Error in background agent job {job_id}: {str(e)}")
+            update_job(
+                record_id,
+                status='failed',
+                progress_percentage=100,
+                status_message='Documentation generation failed',
+                error=str(e)
+            )
+            if events is not None:
+                events.put(("error", {"error": str(e)}))
+            return
+        
+        if events is not None:
+            try:
+                documentation, doc_format = documentation_to_html(documentation), "html"
+            except Exception as html_error:
+                logger.error(f"Error converting markdown to HTML in agent stream: {str(html_error)}")
+                doc_format = "markdown"
+            events.put(("complete", {
+                "status": "success",
+                "job_id": job_id,
+                "documentation": documentation,
+                "format": doc_format,
+                "doc_token": make_doc_token(doc_id, structured_data.get('program_id')),
+                "program_details": {
+                    "program_id": structured_data.get("program_id", "Unknown"),
+                    "description": structured_data.get("description", "No description available")
+                }
+            }))
+
+# The agent endpoint may be called from other origins
+_AGENT_RESPONSE_HEADERS = {"Access-Control-Allow-Origin": "*"}
+
 @app.route("/api/agent/process", methods=["POST"])
 @csrf.exempt
 def agent_process_cobol():
     try:
-        # Import the agent
-        from agent_fixed import COBOLDocumentationAgent
-        
-        # Log full request information for debugging
-        logger.info(f"API Agent Process - Request method: {request.method}")
-        logger.info(f"API Agent Process - Request content type: {request.content_type}")
-        logger.info(f"API Agent Process - Request form keys: {list(request.form.keys()) if request.form else 'None'}")
-        logger.info(f"API Agent Process - Request headers: {dict(request.headers)}")
-        logger.info(f"API Agent Process - Request query string: {request.query_string.decode('utf-8') if request.query_string else 'None'}")
-        
-        # Safely print the request data for debugging
-        try:
-            # Log the first part of different types of request data for debugging
-            request_data = request.get_data(as_text=True)
-            logger.info(f"API Agent Process - Raw request data first 100 chars: {request_data[:100]}")
+        # Log full request information for debugging; skipped entirely unless DEBUG is enabled,
+        # since it copies the whole request body and headers
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("API Agent Process - Request method: %s", request.method)
+            logger.debug("API Agent Process - Request content type: %s", request.content_type)
+            logger.debug("API Agent Process - Request headers: %s", dict(request.headers))
+            logger.debug("API Agent Process - Request query string: %s",
+                         request.query_string.decode('utf-8') if request.query_string else 'None')
             
-            if request.form:
-                logger.info(f"API Agent Process - Form data available with keys: {list(request.form.keys())}")
-            if request.json:
-                logger.info(f"API Agent Process - JSON data available with keys: {list(request.json.keys())}")
+            # Safely print the request data for debugging
+            try:
+                logger.debug("API Agent Process - Raw request data first 100 chars: %.100s",
+                             request.get_data(as_text=True))
                 
-            # Log CSRF token presence
-            csrf_token = request.form.get('csrf_token') or request.headers.get('X-CSRFToken')
-            logger.info(f"API Agent Process - CSRF token present: {bool(csrf_token)}")
-            
-        except Exception as data_error:
-            logger.error(f"API Agent Process - Error getting request data: {str(data_error)}")
+                if request.form:
+                    logger.debug("API Agent Process - Form data available with keys: %s", list(request.form.keys()))
+                json_data = request.get_json(silent=True)
+                if isinstance(json_data, dict):
+                    logger.debug("API Agent Process - JSON data available with keys: %s", list(json_data.keys()))
+                    
+                # Log CSRF token presence
+                csrf_token = request.form.get('csrf_token') or request.headers.get('X-CSRFToken')
+                logger.debug("API Agent Process - CSRF token present: %s", bool(csrf_token))
+                
+            except Exception as data_error:
+                logger.error(f"API Agent Process - Error getting request data: {str(data_error)}")
         
         # Get the COBOL code from session
         cobol_code = session.get('cobol_code', '')
-        job_id = session.get('job_id', str(uuid.uuid4()))
+        # Only generate a job ID when the session does not already have one
+        job_id = session.get('job_id') or str(uuid.uuid4())
         user_id = session.get('user_id')
         
         if not cobol_code:
             return jsonify({"error": "No COBOL code found for processing"}), 400
         
-        # Create an agent instance
+        # Get job_id from form data or URL params if available
+        form_job_id = request.form.get('job_id')
+        if form_job_id:
+            job_id = form_job_id
+            logger.debug("Using job_id from form data: %s", job_id)
+        
+        # A client-supplied job ID must not name another user's or session's job
+        existing_job = get_job(agent_job_record_id(job_id))
+        if existing_job is not None and existing_job.get('owner') != current_job_owner():
+            return jsonify({"error": "Job not found"}), 404
+        
+        # Create an agent instance; whoever runs the job closes it, ending its monitoring session
         agent = COBOLDocumentationAgent(session_id=job_id, user_id=user_id)
         
         # Get user preferences from session
@@ -789,18 +1405,13 @@ def agent_process_cobol():
             for key, value in user_settings.items():
                 agent.set_user_preference(key, value)
                 
-        # Get job_id and preferences from form data (new URL-encoded format)
+        # Get preferences from form data (new URL-encoded format)
         preferences = {}
         
-        # Get job_id from form data or URL params if available
-        form_job_id = request.form.get('job_id')
-        if form_job_id:
-            job_id = form_job_id
-            logger.debug(f"Using job_id from form data: {job_id}")
-        
         # Handle individual preference fields as sent from the frontend
         if request.form:
-            logger.debug(f"Form data received: {list(request.form.keys())}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Form data received: %s", list(request.form.keys()))
             llm_provider = request.form.get('llm_provider')
             llm_model = request.form.get('llm_model')
             detail_level = request.form.get('detail_level')
@@ -819,7 +1430,7 @@ def agent_process_cobol():
             if doc_style:
                 preferences['documentation_style'] = doc_style
             
-            logger.debug(f"Constructed preferences from form fields: {preferences}")
+            logger.debug("Constructed preferences from form fields: %s", preferences)
         # Fall back to JSON data if form data isn't in the expected format
         elif request.json:
             if 'preferences' in request.json:
@@ -836,225 +1447,99 @@ def agent_process_cobol():
                 # Remove None values
                 preferences = {k: v for k, v in preferences.items() if v is not None}
             
-            logger.debug(f"Got preferences from JSON data: {preferences}")
-        
-        # Apply the preferences
-        for key, value in preferences.items():
-            logger.debug(f"Setting user preference: {key} = {value}")
-            agent.set_user_preference(key, value)
-        
-        # Step 1: Parse COBOL code
-        parsed_structure = parse_cobol(cobol_code)
-        
-        # Step 2: Use agent to analyze code and generate documentation
-        structured_data = agent.analyze_cobol_structure(cobol_code, parsed_structure)
-        documentation = agent.generate_documentation(structured_data)
-        
-        # Step 3: Ensure the mermaid tabs are applied
-        if '```mermaid' in documentation and '<div class="mermaid-container">' not in documentation:
-            try:
-                from utils.mermaid_viewer import enhance_markdown_with_tabs
-                documentation = enhance_markdown_with_tabs(documentation)
-                logger.debug("Enhanced documentation with tabbed diagram views in agent processing")
-            except Exception as e:
-                logger.warning(f"Could not enhance documentation with tabbed diagram views: {str(e)}")
-        
-        # Store only necessary data in session
-        # Store the program_id in session for the download filename
-        # Full documentation is too large for session cookie, so we'll limit it
-        
-        # Store only program_id and a truncated version of the documentation
-        if structured_data and 'program_id' in structured_data:
-            session['program_id'] = structured_data.get('program_id')
-            
-        # Store documentation in a temporary file rather than in the session
-        doc_id = str(uuid.uuid4())
-        session['doc_id'] = doc_id
-        tmp_path = f"/tmp/{doc_id}.md"
-        
-        # Write documentation to temporary file
-        with open(tmp_path, "w") as f:
-            f.write(documentation)
-            
-        # Store just basic metadata in session
-        doc_metadata = {
-            'length': len(documentation),
-            'timestamp': datetime.utcnow().isoformat(),
-        }
-        session['doc_metadata'] = doc_metadata
-        
-        # If user is logged in, save the documentation
-        if user_id:
-            try:
-                # Get the project, or create one if it doesn't exist
-                project = Project.query.filter_by(
-                    user_id=user_id,
-                    name=f"COBOL Documentation - {structured_data.get('program_id', 'Unknown')}"
-                ).first()
-                
-                if not project:
-                    project = Project(
-                        name=f"COBOL Documentation - {structured_data.get('program_id', 'Unknown')}",
-                        description=structured_data.get('description', 'No description available'),
-                        user_id=user_id
-                    )
-                    db.session.add(project)
-                    db.session.flush()
-                
-                # Create or update the COBOL file
-                cobol_file = CobolFile.query.filter_by(
-                    project_id=project.id,
-                    program_id=structured_data.get('program_id', 'Unknown')
-                ).first()
-                
-                if not cobol_file:
-                    cobol_file = CobolFile(
-                        filename=f"{structured_data.get('program_id', 'program')}.cbl",
-                        content=cobol_code,
-                        program_id=structured_data.get('program_id', 'Unknown'),
-                        project_id=project.id
-                    )
-                    db.session.add(cobol_file)
-                    db.session.flush()
-                else:
-                    cobol_file.content = cobol_code
-                    cobol_file.updated_at = datetime.utcnow()
-                
-                # Create or update the documentation
-                doc = Documentation.query.filter_by(cobol_file_id=cobol_file.id).first()
-                if not doc:
-                    doc = Documentation(
-                        content=documentation,
-                        cobol_file_id=cobol_file.id
-                    )
-                    db.session.add(doc)
-                else:
-                    doc.content = documentation
-                    doc.updated_at = datetime.utcnow()
-                
-                db.session.commit()
-                logger.info(f"Saved documentation for user {user_id}")
-                
-            except Exception as db_error:
-                logger.error(f"Error saving documentation to database: {str(db_error)}")
-                db.session.rollback()
-        
-        # Convert Markdown to HTML on server-side
-        import markdown
-        import re  # Ensure re is imported
-        
-        # Define custom extensions for proper markdown processing
-        md = markdown.Markdown(
-            extensions=[
-                'markdown.extensions.extra',
-                'markdown.extensions.codehilite',
-                'markdown.extensions.tables',
-                'markdown.extensions.toc'
-            ]
-        )
-        
-        try:
-            # Replace mermaid code blocks with proper divs for mermaid.js
-            # This preserves mermaid blocks for client-side rendering
-            mermaid_processed = documentation
-            mermaid_blocks = re.findall(r'```mermaid([\s\S]*?)```', mermaid_processed)
-            
-            for i, block in enumerate(mermaid_blocks):
-                # Replace each mermaid code block with a div
-                mermaid_processed = mermaid_processed.replace(
-                    f"```mermaid{block}```",
-                    f'<div class="mermaid">{block.strip()}</div>',
-                    1  # Replace only the first occurrence each time
-                )
+            logger.debug("Got preferences from JSON data: %s", preferences)
+        
+        # Apply the preferences
+        for key, value in preferences.items():
+            logger.debug("Setting user preference: %s = %s", key, value)
+            agent.set_user_preference(key, value)
+        
+        # Clients that send async=1 (or Prefer: respond-async) get the job ID right away and poll
+        # /api/job-status, so the request thread is not held for the LLM calls
+        if request.values.get('async') == '1' or 'respond-async' in request.headers.get('Prefer', ''):
+            update_job(
+                agent_job_record_id(job_id),
+                status='queued',
+                progress_percentage=0,
+                status_message='Queued for processing',
+                owner=current_job_owner()
+            )
+            _agent_job_executor.submit(agent_job_worker, job_id, agent, cobol_code, user_settings, preferences, user_id)
+            return jsonify({"status": "queued", "job_id": job_id}), 202
+        
+        # Clients that accept Server-Sent Events see analysis fields and documentation text as
+        # the LLM produces them. The job runs on a job thread and hands its events to the response
+        # through a queue; the session cookie is sent before the stream starts, so the result is
+        # recorded in the job store and bound to the session by /api/job-status
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            update_job(
+                agent_job_record_id(job_id),
+                status='processing',
+                progress_percentage=0,
+                status_message='Starting documentation generation',
+                owner=current_job_owner()
+            )
+            events = queue.Queue()
+            _agent_job_executor.submit(
+                agent_job_worker, job_id, agent, cobol_code, user_settings, preferences, user_id, events
+            )
             
-            # Process regular markdown after handling mermaid blocks
-            html_content = md.convert(mermaid_processed)
-            logger.info("Successfully converted markdown to HTML on server-side in agent process")
+            def generate_events():
+                while True:
+                    event, data = events.get()
+                    yield sse_event(event, data)
+                    if event in ("complete", "error"):
+                        break
             
-            # Additional step to fix code blocks
-            html_content = re.sub(
-                r'<code>(.*?)</code>',
-                lambda m: f'<code>{m.group(1).replace("<", "&lt;").replace(">", "&gt;")}</code>',
-                html_content,
-                flags=re.DOTALL
+            return Response(
+                generate_events(),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **_AGENT_RESPONSE_HEADERS}
             )
+        
+        with agent:
+            structured_data, documentation, doc_id = run_agent_job(agent, cobol_code, user_settings, preferences, user_id)
+        
+        # Store only necessary data in session
+        # Store the program_id in session for the download filename
+        if structured_data and 'program_id' in structured_data:
+            session['program_id'] = structured_data.get('program_id')
             
-            # Create a direct response with explicit content-type
-            response_data = json.dumps({
+        # The documentation itself is in the document store rather than in the session
+        session['doc_id'] = doc_id
+        doc_token = make_doc_token(doc_id, structured_data.get('program_id'))
+        
+        # Convert Markdown to HTML on server-side
+        program_details = {
+            "program_id": structured_data.get("program_id", "Unknown"),
+            "description": structured_data.get("description", "No description available")
+        }
+        try:
+            html_content = documentation_to_html(documentation)
+            return json_response({
                 "status": "success",
                 "job_id": job_id,
                 "documentation": html_content,
                 "format": "html",
-                "program_details": {
-                    "program_id": structured_data.get("program_id", "Unknown"),
-                    "description": structured_data.get("description", "No description available")
-                }
-            })
-            
-            # Create a Response object with explicit content-type
-            response = Response(
-                response=response_data,
-                status=200,
-                mimetype="application/json"
-            )
-            
-            # Add CORS and other headers
-            response.headers["Content-Type"] = "application/json; charset=utf-8"
-            response.headers["Access-Control-Allow-Origin"] = "*"
-            
-            logger.info(f"Sending success response with content type: {response.headers['Content-Type']}")
-            
-            return response
+                "doc_token": doc_token,
+                "program_details": program_details
+            }, headers=_AGENT_RESPONSE_HEADERS)
             
         except Exception as md_error:
             logger.error(f"Error converting markdown to HTML in agent process: {str(md_error)}")
-            # Fall back to sending raw markdown with explicit content type
-            response_data = json.dumps({
+            # Fall back to sending raw markdown
+            return json_response({
                 "status": "success",
                 "job_id": job_id,
                 "documentation": documentation,
                 "format": "markdown",
-                "program_details": {
-                    "program_id": structured_data.get("program_id", "Unknown"),
-                    "description": structured_data.get("description", "No description available")
-                }
-            })
-            
-            # Create a Response object with explicit content-type
-            response = Response(
-                response=response_data,
-                status=200,
-                mimetype="application/json"
-            )
-            
-            # Add CORS and other headers
-            response.headers["Content-Type"] = "application/json; charset=utf-8"
-            response.headers["Access-Control-Allow-Origin"] = "*"
-            
-            logger.info(f"Sending fallback markdown response with content type: {response.headers['Content-Type']}")
-            
-            return response
+                "doc_token": doc_token,
+                "program_details": program_details
+            }, headers=_AGENT_RESPONSE_HEADERS)
         
     except Exception as e:
         logger.error(f"Error in agent processing COBOL code: {str(e)}")
-        
-        # Create an error response with explicit content type
-        response_data = json.dumps({"error": str(e)})
-        
-        # Create a Response object with explicit content-type
-        response = Response(
-            response=response_data,
-            status=500,
-            mimetype="application/json"
-        )
-        
-        # Add CORS and other headers
-        response.headers["Content-Type"] = "application/json; charset=utf-8"
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        
-        logger.info(f"Sending error response with content type: {response.headers['Content-Type']}")
-        
-        return response
+        return json_response({"error": str(e)}, status=500, headers=_AGENT_RESPONSE_HEADERS)
 
 @app.route("/api/job-status", methods=["GET"])
 @csrf.exempt
@@ -1066,47 +1551,75 @@ def get_job_status():
             return jsonify({"error": "No job ID provided"}), 400
             
         # Log information for troubleshooting
-        logger.debug(f"Job status request for job_id: {job_id}")
+        logger.debug("Job status request for job_id: %s", job_id)
+        
+        # Background jobs report their real progress through the job store; only the
+        # user or session that started a job may see it
+        job = get_job(agent_job_record_id(job_id))
+        if job is not None:
+            if job.pop('owner', None) != current_job_owner():
+                return jsonify({"error": "Job not found"}), 404
+            if job.get('status') != 'completed':
+                return jsonify(job)
+            
+            documentation = load_documentation(job['doc_id'])
+            if documentation is None:
+                return jsonify({"error": "Documentation not found, it may have expired"}), 404
+            
+            # Point this session's download and translation at the finished documentation
+            session['job_id'] = job_id
+            session['doc_id'] = job['doc_id']
+            if job.get('program_id'):
+                session['program_id'] = job['program_id']
+            return jsonify({
+                'status': 'completed',
+                'progress_percentage': 100,
+                'status_message': job['status_message'],
+                'result': {
+                    'job_id': job_id,
+                    'markdown': documentation,
+                    'doc_token': make_doc_token(job['doc_id'], job.get('program_id'))
+                }
+            })
             
         # Check if we have the requested job ID in the session
         session_job_id = session.get('job_id')
-        documentation = session.get('documentation')
+        documentation = None
         job_status = session.get('job_status', {})
         doc_id = session.get('doc_id')
         
-        logger.debug(f"Session job_id: {session_job_id}, doc_id: {doc_id}")
+        logger.debug("Session job_id: %s, doc_id: %s", session_job_id, doc_id)
         
-        # Check if we have temporary file documentation
+        # Check if we have stored documentation
         if doc_id:
-            tmp_path = f"/tmp/{doc_id}.md"
             try:
-                if os.path.exists(tmp_path):
-                    with open(tmp_path, "r") as f:
-                        documentation = f.read()
-                    logger.debug(f"Retrieved documentation from temp file: {tmp_path}")
-            except Exception as temp_error:
-                logger.error(f"Error reading temp documentation: {str(temp_error)}")
+                documentation = load_documentation(doc_id)
+                if documentation is not None:
+                    logger.debug("Retrieved stored documentation: %s", doc_id)
+            except Exception as store_error:
+                logger.error(f"Error reading stored documentation: {str(store_error)}")
         
         if session_job_id and session_job_id == job_id and documentation:
-            # We have the documentation in the session or temp file, job is complete
-            logger.debug(f"Returning completed status for job_id: {job_id}")
+            # We have the stored documentation, job is complete
+            logger.debug("Returning completed status for job_id: %s", job_id)
             return jsonify({
                 'status': 'completed',
                 'progress_percentage': 100,
                 'status_message': 'Documentation generated successfully',
                 'result': {
                     'job_id': job_id,
-                    'markdown': documentation
+                    'markdown': documentation,
+                    'doc_token': make_doc_token(doc_id, session.get('program_id'))
                 }
             })
         elif session_job_id and session_job_id == job_id and job_status:
             # Job is known and we have status information
             # Return the status stored in the session
-            logger.debug(f"Returning stored job status for job_id: {job_id}")
+            logger.debug("Returning stored job status for job_id: %s", job_id)
             return jsonify(job_status)
         elif session_job_id and session_job_id == job_id:
             # Job is known but no detailed status or documentation yet
-            logger.debug(f"Returning processing status for job_id: {job_id}")
+            logger.debug("Returning processing status for job_id: %s", job_id)
             return jsonify({
                 'status': 'processing',
                 'progress_percentage': 50,
@@ -1125,47 +1638,169 @@ def get_job_status():
         logger.error(f"Error getting job status: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Custom IDs tie each batch response back to the COBOL file it documents
+BATCH_CUSTOM_ID_PREFIX = "cobol_file-"
+# Batch records name the submitting user and keep the final status once results are
+# stored; they outlive the provider's 24h completion window
+BATCH_RECORD_TTL_SECONDS = 2 * 86400
+
+def batch_record_id(batch_id):
+    """Job store ID of the record kept for a project batch"""
+    return f"batch:{batch_id}"
+
+@app.route("/api/project/process", methods=["POST"])
+@login_required
+def process_project():
+    """Submit documentation for every COBOL file in a project as a single batch job"""
+    try:
+        
+        data = request.get_json(silent=True) or request.form
+        project_id = data.get('project_id')
+        if not project_id:
+            return jsonify({"error": "No project ID provided"}), 400
+        
+        project = Project.query.filter_by(id=project_id, user_id=current_user.id).first()
+        if not project:
+            return jsonify({"error": "Project not found"}), 404
+        
+        cobol_files = CobolFile.query.filter_by(project_id=project.id).all()
+        if not cobol_files:
+            return jsonify({"error": "Project has no COBOL files"}), 400
+        
+        prompts = [
+            {
+                "custom_id": f"{BATCH_CUSTOM_ID_PREFIX}{cobol_file.id}",
+                "prompt": f"""
+            You are a technical documentation expert specializing in legacy COBOL systems.
+            Create detailed, well-organized Markdown documentation for the COBOL program {cobol_file.program_id or cobol_file.filename}.
+            Start with a title and overview of the program's purpose, describe each division,
+            explain the program flow and logic, and include a Mermaid flowchart of the program flow.
+            DO NOT include any HTML tags.
+            
+            COBOL CODE:
+            ```cobol
+            {cobol_file.content}
+            ```
+            """
+            }
+            for cobol_file in cobol_files
+        ]
+        
+        user_settings = session.get('user_settings', {})
+        model = user_settings.get('llm_model') if user_settings.get('llm_provider') == 'groq' else None
+        batch_id = submit_batch(prompts, model=model)
+        update_job(
+            batch_record_id(batch_id),
+            ttl=BATCH_RECORD_TTL_SECONDS,
+            user_id=current_user.id,
+            project_id=project.id
+        )
+        
+        logger.info("Submitted batch %s for project %s with %s files", batch_id, project.id, len(cobol_files))
+        return jsonify({
+            "status": "submitted",
+            "batch_id": batch_id,
+            "project_id": project.id,
+            "file_count": len(cobol_files)
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Error submitting project batch: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/project/batch/<batch_id>", methods=["GET"])
+@login_required
+def project_batch_status(batch_id):
+    """Report batch progress and store the documentation once the batch has completed"""
+    try:
+        # Only the user who submitted the batch may poll it
+        batch_record = get_job(batch_record_id(batch_id))
+        if batch_record is None or batch_record.get('user_id') != current_user.id:
+            return jsonify({"error": "Batch not found"}), 404
+        
+        # Results are stored once; later polls return the recorded final status
+        if batch_record.get('result') is not None:
+            return jsonify(batch_record['result'])
+        
+        status = get_batch_status(batch_id)
+        if status["status"] != "completed" or not status["output_file_id"]:
+            return jsonify(status)
+        
+        results = collect_batch_results(status["output_file_id"])
+        file_ids = [
+            int(custom_id[len(BATCH_CUSTOM_ID_PREFIX):])
+            for custom_id in results
+            if custom_id.startswith(BATCH_CUSTOM_ID_PREFIX)
+        ]
+        
+        # Only store documentation for files in the current user's projects; only their
+        # IDs are needed, so the files' source code is not loaded
+        cobol_file_ids = [
+            cobol_file.id
+            for cobol_file in db.session.query(CobolFile.id).join(Project).filter(
+                CobolFile.id.in_(file_ids),
+                Project.user_id == current_user.id
+            )
+        ]
+        
+        # Insert or update every file's documentation in a single statement
+        if cobol_file_ids:
+            now = datetime.utcnow()
+            db.session.execute(upsert_statement(
+                Documentation,
+                [
+                    dict(
+                        content=results[f"{BATCH_CUSTOM_ID_PREFIX}{cobol_file_id}"],
+                        cobol_file_id=cobol_file_id,
+                        created_at=now,
+                        updated_at=now
+                    )
+                    for cobol_file_id in cobol_file_ids
+                ],
+                conflict_columns=['cobol_file_id'],
+                update_columns=['content', 'updated_at']
+            ))
+            db.session.commit()
+        logger.info("Stored documentation for %s files from batch %s", len(cobol_file_ids), batch_id)
+        
+        status["documented_files"] = len(cobol_file_ids)
+        update_job(batch_record_id(batch_id), ttl=BATCH_RECORD_TTL_SECONDS, result=status)
+        return jsonify(status)
+        
+    except Exception as e:
+        logger.error(f"Error checking project batch {batch_id}: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/translate", methods=["POST"])
 def translate():
     try:
-        # Get doc_id from session
-        doc_id = session.get('doc_id')
+        # Get doc_id from the request's doc_token or the session
+        doc_id, program_id = requested_doc()
         target_language = request.form.get('language', 'en')
         
         if not doc_id:
             return jsonify({"error": "No documentation found for translation"}), 400
         
-        # Read from temporary file
-        tmp_path = f"/tmp/{doc_id}.md"
-        
-        try:
-            with open(tmp_path, "r") as f:
-                documentation = f.read()
-        except FileNotFoundError:
+        documentation = load_documentation(doc_id)
+        if documentation is None:
             return jsonify({"error": "Documentation file not found, it may have expired"}), 400
         
         # Translate the documentation
         translated_doc = translate_documentation(documentation, target_language)
         
-        # Create a new temp file for the translated version
+        # Store the translated version under a new ID
         translated_doc_id = str(uuid.uuid4())
-        translated_tmp_path = f"/tmp/{translated_doc_id}.md"
-        
-        # Save the translated documentation to a new temp file
-        with open(translated_tmp_path, "w") as f:
-            f.write(translated_doc)
+        save_documentation(translated_doc_id, translated_doc)
             
-        # Update session with the new doc_id
-        session['doc_id'] = translated_doc_id
-        session['doc_metadata'] = {
-            'length': len(translated_doc),
-            'timestamp': datetime.utcnow().isoformat(),
-            'language': target_language
-        }
+        # Clients using tokens get a new token; otherwise the session points at the translation
+        if not request.values.get('doc_token'):
+            session['doc_id'] = translated_doc_id
         
         return jsonify({
             "status": "success",
-            "translated_documentation": translated_doc
+            "translated_documentation": translated_doc,
+            "doc_token": make_doc_token(translated_doc_id, program_id)
         })
         
     except Exception as e:
@@ -1175,23 +1810,18 @@ def translate():
 @app.route("/api/download", methods=["GET"])
 def download_documentation():
     try:
-        # Get doc_id from session
-        doc_id = session.get('doc_id')
+        # Get doc_id from the request's doc_token or the session
+        doc_id, program_id = requested_doc()
         
         if not doc_id:
             return jsonify({"error": "No documentation found for download"}), 400
         
-        # Try to read from the temporary file
-        tmp_path = f"/tmp/{doc_id}.md"
-        
-        try:
-            with open(tmp_path, "r") as f:
-                documentation = f.read()
-        except FileNotFoundError:
+        documentation_file = open_documentation(doc_id)
+        if documentation_file is None:
             return jsonify({"error": "Documentation file not found, it may have expired"}), 400
         
         # Get program ID for the filename if available
-        program_id = session.get('program_id', 'cobol')
+        program_id = program_id or 'cobol'
         
         # Generate timestamp in GMT+0 format (pass 0 to timestamp function)
         ts = timestamp(timezone_offset=0)
@@ -1201,8 +1831,24 @@ def download_documentation():
         ts_prefix = ts.split()[0]  # Get just the YYYYMMDD_HHMMSS part
         filename = f"{ts_prefix}_{program_id}_documentation.md"
         
-        # Use the existing file rather than creating another copy
-        return send_file(tmp_path, as_attachment=True, download_name=filename)
+        # Stored documentation never changes for a doc_id, so the ID serves as a strong
+        # ETag and repeat downloads are answered with 304 without reading the file
+        response = send_file(
+            documentation_file,
+            as_attachment=True,
+            download_name=filename,
+            mimetype='text/markdown',
+            conditional=True,
+            etag=doc_id
+        )
+        if request.values.get('doc_token'):
+            # The URL names the document, so browsers may reuse it until it expires
+            response.headers['Cache-Control'] = f"private, max-age={DOC_TTL_SECONDS}, immutable"
+        else:
+            # The same URL serves whatever this session generated last; revalidate every time
+            response.headers['Cache-Control'] = "private, no-cache"
+            response.vary.add('Cookie')
+        return response
         
     except Exception as e:
         logger.error(f"Error downloading documentation: {str(e)}")
@@ -1218,14 +1864,13 @@ def validate_mermaid():
             return jsonify({"error": "No Mermaid code provided"}), 400
         
         # Import the validator
-        from utils.perplexity_client import validate_mermaid_syntax
         
         # Validate the Mermaid code
         is_valid, corrected_code, message = validate_mermaid_syntax(mermaid_code)
         
         # Log the validation attempt
         if not is_valid:
-            logger.info(f"Mermaid validation: {message}")
+            logger.info("Mermaid validation: %s", message)
         
         return jsonify({
             "is_valid": is_valid,
@@ -1239,11 +1884,58 @@ def validate_mermaid():
         return jsonify({"error": str(e)}), 500
 
 
+# Whether each provider's API key is set; read on every settings page and key check, and
+# only changed by /api/save-keys, which updates this process's environment
+_api_key_available = {
+    'perplexity': bool(os.environ.get('PERPLEXITY_API_KEY')),
+    'groq': bool(os.environ.get('GROQ_API_KEY'))
+}
+
+# Provider and model lists rarely change, so they are fetched at most once per interval
+MODEL_LIST_CACHE_SECONDS = 300
+
+def model_list_time_bucket():
+    """Current model-list cache interval"""
+    return int(time.monotonic() // MODEL_LIST_CACHE_SECONDS)
+
+@functools.lru_cache(maxsize=1)
+def cached_providers(time_bucket):
+    """List the configured LLM providers; time_bucket limits this to one lookup per interval"""
+    return llm_selector.get_providers()
+
+@functools.lru_cache(maxsize=1)
+def cached_provider_names(time_bucket):
+    """Configured LLM provider names as a set, for membership checks on every model lookup"""
+    return frozenset(cached_providers(time_bucket))
+
+@functools.lru_cache(maxsize=32)
+def cached_models(provider, has_groq_key, time_bucket):
+    """List a provider's models; time_bucket limits this to one lookup per interval
+    
+    Args:
+        provider (str): LLM provider name
+        has_groq_key (bool): Whether GROQ_API_KEY is set, for Groq outside the selector
+        time_bucket (int): Current cache interval
+        
+    Returns:
+        list: Available models, or an empty list for an unavailable provider
+    """
+    if provider in cached_provider_names(time_bucket):
+        return llm_selector.get_models(provider)
+    if provider == 'groq' and has_groq_key:
+        # Special case for Groq if not in selector but API key exists
+        return get_groq_models()
+    return []
+
+def models_for_provider(provider):
+    """List the models available for a provider, using the cached lists"""
+    return cached_models(provider, _api_key_available['groq'], model_list_time_bucket())
+
 @app.route("/llm-settings", methods=["GET", "POST"])
 @login_required
 def llm_settings():
     # Get available LLM providers and models
-    available_providers = llm_selector.get_providers()
+    available_providers = cached_providers(model_list_time_bucket())
     
     # Get current user settings
     user_settings = {}
@@ -1254,18 +1946,7 @@ def llm_settings():
     
     # Default settings if none exist
     if not user_settings:
-        user_settings = {
-            'llm_provider': 'groq',         # Default to GROQ
-            'llm_model': None,              # Will be set to default for the provider
-            'detail_level': 'medium',       # medium detail level
-            'audience': 'technical',        # technical audience
-            'documentation_style': 'formal', # formal style
-            'tooltip_delay': 1000,          # 1000ms delay for tooltips
-            'tooltip_x_offset': 10,         # 10px right offset
-            'tooltip_y_offset': 10,         # 10px down offset
-            'tooltip_font_size': 6,         # 6px font size
-            'tooltip_opacity': 0.9          # 90% opacity
-        }
+        user_settings = dict(DEFAULT_USER_SETTINGS)
         session['user_settings'] = user_settings
     
     # Handle form submission
@@ -1287,17 +1968,11 @@ def llm_settings():
     
     # Get models for the currently selected provider
     current_provider = user_settings.get('llm_provider', 'groq')
-    available_models = []
-    
-    if current_provider in available_providers:
-        available_models = llm_selector.get_models(current_provider)
-    elif current_provider == 'groq' and os.environ.get('GROQ_API_KEY'):
-        # Special case for Groq if not in selector but API key exists
-        available_models = get_groq_models()
+    available_models = models_for_provider(current_provider)
     
     # Check if API keys are set
-    has_perplexity_key = bool(os.environ.get('PERPLEXITY_API_KEY'))
-    has_groq_key = bool(os.environ.get('GROQ_API_KEY'))
+    has_perplexity_key = _api_key_available['perplexity']
+    has_groq_key = _api_key_available['groq']
     
     return render_template("llm_settings.html", 
                           user_settings=user_settings,
@@ -1306,6 +1981,24 @@ def llm_settings():
                           has_perplexity_key=has_perplexity_key,
                           has_groq_key=has_groq_key)
 
+# Name of each tooltip setting in tooltip-config.js
+TOOLTIP_CONFIG_NAMES = {
+    'tooltip_delay': 'delay',
+    'tooltip_x_offset': 'xOffset',
+    'tooltip_y_offset': 'yOffset',
+    'tooltip_font_size': 'fontSize',
+    'tooltip_opacity': 'opacity'
+}
+
+# Type and allowed range of each tooltip setting; submitted values are clamped to the range
+TOOLTIP_SETTING_SPECS = {
+    'tooltip_delay': (int, 0, 5000),        # 0-5000ms
+    'tooltip_x_offset': (int, -500, 500),   # -500px to +500px
+    'tooltip_y_offset': (int, -500, 500),   # -500px to +500px
+    'tooltip_font_size': (int, 6, 48),      # 6-48px font size
+    'tooltip_opacity': (float, 0.1, 1.0)    # 0.1-1.0 opacity
+}
+
 @app.route("/tooltip-settings", methods=["GET", "POST"])
 @login_required
 def tooltip_settings():
@@ -1317,90 +2010,24 @@ def tooltip_settings():
     
     # Default settings if none exist
     if not user_settings:
-        user_settings = {
-            'llm_provider': 'groq',         # Default to GROQ
-            'llm_model': None,              # Will be set to default for the provider
-            'detail_level': 'medium',       # medium detail level
-            'audience': 'technical',        # technical audience
-            'documentation_style': 'formal', # formal style
-            'tooltip_delay': 1000,          # 1000ms delay for tooltips
-            'tooltip_x_offset': 10,         # 10px right offset
-            'tooltip_y_offset': 10,         # 10px down offset
-            'tooltip_font_size': 6,         # 6px font size
-            'tooltip_opacity': 0.9          # 90% opacity
-        }
+        user_settings = dict(DEFAULT_USER_SETTINGS)
         session['user_settings'] = user_settings
     
     # Handle form submission
     if request.method == "POST":
-        # Update tooltip settings
-        try:
-            tooltip_delay = int(request.form.get('tooltip_delay', 1000))
-            tooltip_x_offset = int(request.form.get('tooltip_x_offset', 10))
-            tooltip_y_offset = int(request.form.get('tooltip_y_offset', 10))
-            tooltip_font_size = int(request.form.get('tooltip_font_size', 10))
-            # Get the value and check for NaN before conversion
-            opacity_value = request.form.get('tooltip_opacity', '0.9')
-            if opacity_value.lower() == 'nan':
-                tooltip_opacity = 0.9  # Default if NaN is detected
-            else:
-                try:
-                    tooltip_opacity = float(opacity_value)
-                    # Check for NaN after conversion (handles case sensitivity)
-                    if tooltip_opacity != tooltip_opacity:  # NaN check - NaN is the only value that doesn't equal itself
-                        tooltip_opacity = 0.9
-                except ValueError:
-                    tooltip_opacity = 0.9
-            
-            # Add validation to ensure reasonable values
-            user_settings['tooltip_delay'] = max(0, min(5000, tooltip_delay))  # 0-5000ms
-            user_settings['tooltip_x_offset'] = max(-500, min(500, tooltip_x_offset))  # -500px to +500px
-            user_settings['tooltip_y_offset'] = max(-500, min(500, tooltip_y_offset))  # -500px to +500px
-            user_settings['tooltip_font_size'] = max(6, min(48, tooltip_font_size))  # 6-48px font size
-            user_settings['tooltip_opacity'] = max(0.1, min(1.0, tooltip_opacity))  # 0.1-1.0 opacity
-            
-            # Update the actual JS file with new default values
+        # Update tooltip settings, using the default for any value that is not a number
+        invalid = False
+        for key, (cast, low, high) in TOOLTIP_SETTING_SPECS.items():
             try:
-                with open('static/js/tooltip-config.js', 'r') as file:
-                    content = file.read()
-                    
-                # Update default values using regex
-                import re
-                # Replace delay value
-                content = re.sub(r'(delay:)\s*(\d+),', f'delay: {user_settings["tooltip_delay"]},', content)
-                # Replace xOffset value
-                content = re.sub(r'(xOffset:)\s*(-?\d+),', f'xOffset: {user_settings["tooltip_x_offset"]},', content)
-                # Replace yOffset value
-                content = re.sub(r'(yOffset:)\s*(-?\d+),', f'yOffset: {user_settings["tooltip_y_offset"]},', content)
-                # Replace fontSize value
-                content = re.sub(r'(fontSize:)\s*(\d+),', f'fontSize: {user_settings["tooltip_font_size"]},', content)
-                # Replace opacity value if it exists
-                if re.search(r'(opacity:)\s*([\d\.]+)', content):
-                    content = re.sub(r'(opacity:)\s*([\d\.]+)', f'opacity: {user_settings["tooltip_opacity"]},', content)
-                else:
-                    # Add opacity setting if it doesn't exist
-                    content = content.replace('fontSize:', 'opacity: ' + str(user_settings["tooltip_opacity"]) + ',\n    fontSize:')
-                
-                # Write back the updated content
-                with open('static/js/tooltip-config.js', 'w') as file:
-                    file.write(content)
-                
-                app.logger.info(f"Updated tooltip-config.js with new defaults: delay={user_settings['tooltip_delay']}, " +
-                               f"xOffset={user_settings['tooltip_x_offset']}, yOffset={user_settings['tooltip_y_offset']}, " +
-                               f"fontSize={user_settings['tooltip_font_size']}, opacity={user_settings['tooltip_opacity']}")
-                
-            except Exception as e:
-                app.logger.error(f"Failed to update tooltip-config.js: {str(e)}")
-                # This is just a convenience feature, so we don't need to fail if it doesn't work
-                flash("Settings saved to session but could not update JS file: " + str(e), "warning")
-                
-        except ValueError:
-            # If conversion fails, use default values
-            user_settings['tooltip_delay'] = 1000
-            user_settings['tooltip_x_offset'] = 10
-            user_settings['tooltip_y_offset'] = 10
-            user_settings['tooltip_font_size'] = 6
-            user_settings['tooltip_opacity'] = 0.9
+                value = cast(request.form.get(key, TOOLTIP_DEFAULTS[key]))
+                if value != value:  # NaN is the only value that doesn't equal itself
+                    raise ValueError(key)
+            except (TypeError, ValueError):
+                value = TOOLTIP_DEFAULTS[key]
+                invalid = True
+            user_settings[key] = max(low, min(high, value))
+        
+        if invalid:
             flash("Invalid tooltip settings provided. Using default values.", "warning")
         
         # Save settings to session
@@ -1413,6 +2040,17 @@ def tooltip_settings():
     
     return render_template("tooltip_settings.html", user_settings=user_settings)
 
+@app.route("/api/tooltip-defaults", methods=["GET"])
+def tooltip_defaults():
+    """
+    Get the tooltip configuration for the current session, named as in tooltip-config.js
+    """
+    user_settings = session.get('user_settings', {})
+    return jsonify({
+        name: user_settings.get(key, TOOLTIP_DEFAULTS[key])
+        for key, name in TOOLTIP_CONFIG_NAMES.items()
+    })
+
 @app.route("/settings")
 @login_required
 def settings():
@@ -1432,13 +2070,7 @@ def get_models():
     provider = request.args.get('provider', 'groq')
     
     # Get models for the specified provider
-    if provider in llm_selector.get_providers():
-        models = llm_selector.get_models(provider)
-    elif provider == 'groq' and os.environ.get('GROQ_API_KEY'):
-        # Special case for Groq if not in selector but API key exists
-        models = get_groq_models()
-    else:
-        models = []
+    models = models_for_provider(provider)
     
     return jsonify({
         "provider": provider,
@@ -1453,34 +2085,20 @@ def get_llm_settings():
     if hasattr(current_user, 'id'):
         user_settings = session.get('user_settings', {})
     
-    # Default settings if none exist
+    # Default settings if none exist; anonymous visitors get them without a session write,
+    # which would otherwise re-sign the cookie or rewrite the Redis session on every request
     if not user_settings:
-        user_settings = {
-            'llm_provider': 'groq',          # Default to GROQ
-            'llm_model': None,               # Will be set to default for the provider
-            'detail_level': 'medium',        # medium detail level
-            'audience': 'technical',         # technical audience
-            'documentation_style': 'formal', # formal style
-            'tooltip_delay': 1000,           # 1000ms delay for tooltips
-            'tooltip_x_offset': 10,          # 10px right offset
-            'tooltip_y_offset': 10,          # 10px down offset
-            'tooltip_font_size': 12,         # 12px font size
-            'tooltip_opacity': 0.75          # 75% opacity
-        }
-        session['user_settings'] = user_settings
+        user_settings = dict(DEFAULT_USER_SETTINGS, **LEDGER_TOOLTIP_DEFAULTS)
+        if hasattr(current_user, 'id'):
+            session['user_settings'] = user_settings
     
     # Check if API keys are set
-    has_perplexity_key = bool(os.environ.get('PERPLEXITY_API_KEY'))
-    has_groq_key = bool(os.environ.get('GROQ_API_KEY'))
+    has_perplexity_key = _api_key_available['perplexity']
+    has_groq_key = _api_key_available['groq']
     
     # Get models for the current provider
-    models = []
     current_provider = user_settings.get('llm_provider', 'groq')
-    
-    if current_provider in llm_selector.get_providers():
-        models = llm_selector.get_models(current_provider)
-    elif current_provider == 'groq' and has_groq_key:
-        models = get_groq_models()
+    models = models_for_provider(current_provider)
     
     # Create a JavaScript-friendly data structure
     settings_data = {
@@ -1508,18 +2126,13 @@ def check_api_keys():
             provider = 'groq'
     
     result = {
-        "perplexity": {"available": bool(os.environ.get('PERPLEXITY_API_KEY'))},
-        "groq": {"available": bool(os.environ.get('GROQ_API_KEY'))},
+        "perplexity": {"available": _api_key_available['perplexity']},
+        "groq": {"available": _api_key_available['groq']},
         "selected_provider": provider,
-        "needs_key": False
+        # The selected provider needs a key if it is a known provider without one
+        "needs_key": not _api_key_available.get(provider, True)
     }
     
-    # Check if the selected provider needs a key
-    if provider == 'perplexity' and not result["perplexity"]["available"]:
-        result["needs_key"] = True
-    elif provider == 'groq' and not result["groq"]["available"]:
-        result["needs_key"] = True
-    
     return jsonify(result)
 
 @app.route("/api/save-keys", methods=["POST"])
@@ -1534,35 +2147,43 @@ def save_api_keys():
         "groq": {"updated": False, "message": ""}
     }
     
+    # Key preferences are collected here and written to the session once at the end
+    user_settings = (session.get('user_settings') or {}) if current_user.is_authenticated else None
+    
     if perplexity_key:
         # In a real app, you would store this securely
         # For demo, we'll set it in environment variables
         os.environ['PERPLEXITY_API_KEY'] = perplexity_key
+        _api_key_available['perplexity'] = True
         result["perplexity"]["updated"] = True
         result["perplexity"]["message"] = "Perplexity API key updated successfully"
         
         # For authenticated users, save the preference
-        if current_user.is_authenticated:
-            user_settings = session.get('user_settings', {})
+        if user_settings is not None:
             user_settings['has_perplexity_key'] = True
-            session['user_settings'] = user_settings
         
     if groq_key:
         # In a real app, you would store this securely
         # For demo, we'll set it in environment variables
         os.environ['GROQ_API_KEY'] = groq_key
+        _api_key_available['groq'] = True
         result["groq"]["updated"] = True
         result["groq"]["message"] = "Groq API key updated successfully"
         
         # For authenticated users, save the preference
-        if current_user.is_authenticated:
-            user_settings = session.get('user_settings', {})
+        if user_settings is not None:
             user_settings['has_groq_key'] = True
-            session['user_settings'] = user_settings
         
         # Reinitialize the LLM selector to recognize the new API key
         if "groq" not in llm_selector.get_providers():
             llm_selector._initialize_providers()
+        # Drop the cached provider and model lists so the new key takes effect
+        cached_providers.cache_clear()
+        cached_provider_names.cache_clear()
+        cached_models.cache_clear()
+    
+    if user_settings is not None and (perplexity_key or groq_key):
+        session['user_settings'] = user_settings
     
     return jsonify(result)
 
@@ -1587,24 +2208,12 @@ def ledger_dashboard():
             
             # Default settings if none exist
             if not llm_settings_data:
-                llm_settings_data = {
-                    'llm_provider': 'groq',          # Default to GROQ
-                    'llm_model': None,               # Will be set to default for the provider
-                    'detail_level': 'medium',        # medium detail level
-                    'audience': 'technical',         # technical audience
-                    'documentation_style': 'formal', # formal style
-                    'tooltip_delay': 1000,           # 1000ms delay for tooltips
-                    'tooltip_x_offset': 10,          # 10px right offset
-                    'tooltip_y_offset': 10,          # 10px down offset
-                    'tooltip_font_size': 12,         # 12px font size
-                    'tooltip_opacity': 0.75          # 75% opacity
-                }
+                llm_settings_data = dict(DEFAULT_USER_SETTINGS, **LEDGER_TOOLTIP_DEFAULTS)
                 session['user_settings'] = llm_settings_data
                 
             # Update user settings with session data
             user_settings.update(llm_settings_data)
         except Exception as llm_err:
-            print(f"Error getting LLM settings: {str(llm_err)}")
             app.logger.error(f"Error getting LLM settings: {str(llm_err)}")
             # Continue without LLM settings
             user_settings['llm_provider'] = 'groq'  # Default fallback
@@ -1614,13 +2223,12 @@ def ledger_dashboard():
         try:
             api_key_status = check_api_keys()
         except Exception as api_err:
-            print(f"Error checking API keys: {str(api_err)}")
             app.logger.error(f"Error checking API keys: {str(api_err)}")
             api_key_status = {'has_groq': False, 'has_perplexity': False}
         
         # Log the dashboard access
-        print(f"Ledger dashboard accessed by: {current_user.username if current_user.is_authenticated else 'anonymous'}")
-        print(f"User settings for dashboard: {user_settings}")
+        logger.debug("Ledger dashboard accessed by: %s", current_user.username if current_user.is_authenticated else 'anonymous')
+        logger.debug("User settings for dashboard: %s", user_settings)
         
         # Pass all needed data to the template
         return render_template(
@@ -1629,10 +2237,9 @@ def ledger_dashboard():
             api_key_status=api_key_status
         )
     except Exception as e:
-        import traceback
         error_details = traceback.format_exc()
-        print(f"ERROR in ledger_dashboard: {str(e)}")
-        print(error_details)
+        logger.error(f"Error in ledger_dashboard: {str(e)}")
+        logger.error(error_details)
         
         # Return a basic error page with the error details
         return f"""
@@ -1664,20 +2271,18 @@ def db_test():
     """
     logger.debug("Database test endpoint called")
     try:
-        from utils.ledger_sql import LedgerSQL
-        
         # Get database info
         db_info = LedgerSQL.get_database_info()
-        logger.debug(f"Database info: {db_info}")
+        logger.debug("Database info: %s", db_info)
         
         # Run a simple query
         tables_query = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'"
-        logger.debug(f"Running test query: {tables_query}")
+        logger.debug("Running test query: %s", tables_query)
         tables = LedgerSQL.execute_query(tables_query, fetch_all=True)
         
         # Get row count
         user_count_query = "SELECT COUNT(*) FROM \"user\""
-        logger.debug(f"Running user count query: {user_count_query}")
+        logger.debug("Running user count query: %s", user_count_query)
         user_count = LedgerSQL.execute_query(user_count_query, fetch_one=True)
         
         response_data = {
@@ -1688,7 +2293,7 @@ def db_test():
             "user_count": user_count[0] if user_count else 0,
             "message": "Database test completed successfully"
         }
-        logger.debug(f"DB test response: {response_data}")
+        logger.debug("DB test response: %s", response_data)
         return jsonify(response_data)
         
     except Exception as e:
@@ -1706,24 +2311,23 @@ def execute_sql():
     """
     Execute SQL query for testing database
     """
-    import traceback
-    from utils.ledger_sql import LedgerSQL
     
     # Debug request information
-    logger.debug(f"execute_sql called by user: {current_user.username if current_user else 'Unknown'}")
-    logger.debug(f"Request JSON: {request.json}")
-    logger.debug(f"Request headers: {dict(request.headers)}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("execute_sql called by user: %s", current_user.username if current_user else 'Unknown')
+        logger.debug("Request JSON: %s", request.json)
+        logger.debug("Request headers: %s", dict(request.headers))
     
     # Get the query
     query = request.json.get('query', '') if request.json else ''
-    logger.debug(f"Received SQL query: {query}")
+    logger.debug("Received SQL query: %s", query)
     
     if not query:
         logger.warning("Empty SQL query received")
         return jsonify({"success": False, "message": "No SQL query provided"}), 400
     
     # Basic security check - only allow SELECT queries
-    if not query.strip().lower().startswith('select'):
+    if not _SELECT_QUERY_RE.match(query):
         logger.warning(f"Security check failed - non-SELECT query attempted: {query}")
         return jsonify({
             "success": False, 
@@ -1731,20 +2335,18 @@ def execute_sql():
         }), 403
     
     try:
-        # Check if database is connected
-        db_info = LedgerSQL.get_database_info()
-        if not db_info.get('connected', False):
-            logger.error("Database not connected")
-            return jsonify({
-                "success": False,
-                "message": "Database connection error. Please check the database configuration."
-            }), 500
-        
-        # Execute the query using our LedgerSQL module
-        logger.debug(f"Executing SQL query via LedgerSQL: {query}")
+        # Execute the query using our LedgerSQL module; the connection is only checked
+        # when the query fails, rather than with an extra round-trip before every query
+        logger.debug("Executing SQL query via LedgerSQL: %s", query)
         result = LedgerSQL.execute_query(query, fetch_all=True)
         
         if result is None:
+            if not database_connected():
+                logger.error("Database not connected")
+                return jsonify({
+                    "success": False,
+                    "message": "Database connection error. Please check the database configuration."
+                }), 500
             logging.error("SQL query returned None (possible execution error)")
             return jsonify({
                 "success": False,
@@ -1752,62 +2354,41 @@ def execute_sql():
             }), 500
         
         # Process the results
-        logging.debug(f"SQL query returned {len(result)} rows")
-        
-        # Check if we have SQLAlchemy Row objects or tuples
-        from sqlalchemy.engine.row import Row
+        logging.debug("SQL query returned %s rows", len(result))
         
         try:
             if len(result) > 0:
-                logging.debug(f"Result type: {type(result)}, First row type: {type(result[0])}")
+                logging.debug("Result type: %s, First row type: %s", type(result), type(result[0]))
                 
                 if isinstance(result[0], Row):
                     # SQLAlchemy Row objects - get column names from keys
                     column_names = result[0]._fields
-                    logging.debug(f"Column names from Row: {column_names}")
-                    
-                    # Convert Row objects to dictionaries
-                    rows = []
-                    for row in result:
-                        row_dict = {}
-                        for i, col in enumerate(column_names):
-                            # Convert SQLAlchemy values to JSON-serializable values
-                            value = row[i]
-                            if isinstance(value, datetime):
-                                row_dict[col] = value.isoformat()
-                            else:
-                                row_dict[col] = value
-                        rows.append(row_dict)
+                elif hasattr(result, 'description'):
+                    # Regular tuples - take column names from the cursor description
+                    column_names = [col[0] for col in result.description]
                 else:
-                    # Regular tuples - need to generate column names
-                    # First check if we have a cursor.description
-                    if hasattr(result, 'description'):
-                        column_names = [col[0] for col in result.description]
-                    else:
-                        # Generate numeric column names
-                        column_names = [f"column_{i}" for i in range(len(result[0]))]
-                    
-                    logging.debug(f"Generated column names: {column_names}")
-                    
-                    # Convert tuples to dictionaries
-                    rows = []
-                    for row in result:
-                        # Convert values to JSON-serializable types
-                        row_values = []
-                        for value in row:
-                            if isinstance(value, datetime):
-                                row_values.append(value.isoformat())
-                            else:
-                                row_values.append(value)
-                        
-                        # Create dictionary
-                        rows.append(dict(zip(column_names, row_values)))
+                    # Generate numeric column names
+                    column_names = [f"column_{i}" for i in range(len(result[0]))]
+                logging.debug("Column names: %s", column_names)
+                
+                if orjson is not None:
+                    # orjson writes datetimes, dates, and times in ISO format itself
+                    rows = [dict(zip(column_names, row)) for row in result]
+                else:
+                    # Convert rows to dictionaries of JSON-serializable values
+                    rows = [
+                        {
+                            col: value.isoformat() if isinstance(value, (date, time_of_day)) else value
+                            for col, value in zip(column_names, row)
+                        }
+                        for row in result
+                    ]
             else:
                 # No rows returned
                 column_names = []
                 rows = []
             
-            logging.debug(f"Processed {len(rows)} rows with columns: {column_names}")
+            logging.debug("Processed %s rows with columns: %s", len(rows), column_names)
         except Exception as e:
             logging.error(f"Error processing SQL results: {str(e)}")
             logging.error(traceback.format_exc())
@@ -1816,12 +2397,12 @@ def execute_sql():
                 "message": f"Error processing SQL results: {str(e)}"
             }), 500
         
-        return jsonify({
+        return json_response({
             "success": True,
             "columns": list(column_names),
             "rows": rows,
             "row_count": len(rows)
-        })
+        }, iso_datetimes=True)
         
     except Exception as e:
         error_message = str(e)
@@ -1833,13 +2414,12 @@ def execute_sql():
         # Check for common SQL errors
         if "relation" in error_message and "does not exist" in error_message:
             # Table doesn't exist error
-            import re
-            table_match = re.search(r'relation "([^"]+)" does not exist', error_message)
+            table_match = _MISSING_RELATION_RE.search(error_message)
             if table_match:
                 wrong_table = table_match.group(1)
                 # Get list of available tables to suggest alternatives
-                tables = LedgerSQL.list_tables()
-                similar_tables = [t for t in tables if len(t) > 0 and len(wrong_table) > 0 and t.lower().startswith(wrong_table[0].lower())]
+                tables, tables_by_initial = table_index()
+                similar_tables = tables_by_initial.get(wrong_table[:1].lower(), [])
                 
                 friendly_message = f"Table '{wrong_table}' doesn't exist"
                 suggestion_text = ""
@@ -1855,6 +2435,8 @@ def execute_sql():
             friendly_message = "Permission denied - you may not have access to this table or column"
         elif "violates not-null constraint" in error_message.lower():
             friendly_message = "Query violates NOT NULL constraint"
+        elif not database_connected():
+            friendly_message = "Database connection error. Please check the database configuration."
         
         logger.error(f"SQL query error: {error_message}")
         logger.error(traceback.format_exc())
@@ -1871,15 +2453,11 @@ def execute_psql():
     """
     Execute a psql command using the read-only user
     """
-    import re
-    import traceback
-    import logging
-    from utils.ledger_sql import LedgerSQL
     
     command = request.json.get('command', '')
     
     # Log the received command
-    logging.debug(f"Received PSQL command: '{command}'")
+    logging.debug("Received PSQL command: '%s'", command)
     
     if not command:
         return jsonify({"success": False, "message": "No command provided"}), 400
@@ -1890,10 +2468,10 @@ def execute_psql():
         command = command.replace("\\\\", "\\")
         
         # Log the command being executed
-        logging.debug(f"Executing PSQL command: '{command}'")
+        logging.debug("Executing PSQL command: '%s'", command)
         
         # Basic security check - only allow read operations for SQL statements
-        if re.match(r'^\s*(INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|TRUNCATE|GRANT)\s', command, re.IGNORECASE):
+        if _WRITE_COMMAND_RE.match(command):
             logging.warning(f"Security check failed: Write operation attempted: {command}")
             return jsonify({
                 "success": False,
@@ -1903,7 +2481,7 @@ def execute_psql():
         
         # Handle meta-commands specially
         if command.startswith("\\"):
-            logging.debug(f"Processing meta-command: {command}")
+            logging.debug("Processing meta-command: %s", command)
             
             # For \l command (list databases)
             if command == "\\l":
@@ -1913,9 +2491,7 @@ def execute_psql():
                 )
                 
                 if db_list:
-                    output = "List of databases:\n"
-                    for row in db_list:
-                        output += f"  {row[0]}\n"
+                    output = "List of databases:\n" + "".join(f"  {row[0]}\n" for row in db_list)
                     return jsonify({"success": True, "output": output})
             
             # For \dt command (list tables)
@@ -1923,11 +2499,12 @@ def execute_psql():
                 tables = LedgerSQL.list_tables()
                 
                 if tables:
-                    output = "List of relations:\n"
-                    output += " Schema |    Name     | Type  \n"
-                    output += "--------+-------------+-------\n"
-                    for table in tables:
-                        output += f" public | {table.ljust(11)} | table\n"
+                    output = "".join([
+                        "List of relations:\n",
+                        " Schema |    Name     | Type  \n",
+                        "--------+-------------+-------\n",
+                        *(f" public | {table.ljust(11)} | table\n" for table in tables)
+                    ])
                     return jsonify({"success": True, "output": output})
             
             # For \d command (describe table)
@@ -1936,14 +2513,16 @@ def execute_psql():
                 columns = LedgerSQL.get_table_schema(table_name)
                 
                 if columns:
-                    output = f"Table: {table_name}\n"
-                    output += " Column  |  Type  | Nullable | Default \n"
-                    output += "---------+--------+----------+---------\n"
+                    parts = [
+                        f"Table: {table_name}\n",
+                        " Column  |  Type  | Nullable | Default \n",
+                        "---------+--------+----------+---------\n"
+                    ]
                     for col in columns:
                         nullable = "YES" if col['nullable'] == "YES" else "NO"
                         default = col['default'] or ""
-                        output += f" {col['name'].ljust(7)} | {col['type'].ljust(6)} | {nullable.ljust(8)} | {default}\n"
-                    return jsonify({"success": True, "output": output})
+                        parts.append(f" {col['name'].ljust(7)} | {col['type'].ljust(6)} | {nullable.ljust(8)} | {default}\n")
+                    return jsonify({"success": True, "output": "".join(parts)})
             
             # For \conninfo command
             elif command == "\\conninfo":
@@ -1956,9 +2535,9 @@ def execute_psql():
                     
                     # Show row counts for main tables
                     if 'row_counts' in db_info:
-                        output += "\nRow counts:\n"
-                        for table, count in db_info['row_counts'].items():
-                            output += f"  {table}: {count}\n"
+                        output += "\nRow counts:\n" + "".join(
+                            f"  {table}: {count}\n" for table, count in db_info['row_counts'].items()
+                        )
                     
                     return jsonify({"success": True, "output": output})
             
@@ -1971,7 +2550,7 @@ def execute_psql():
         
         # Regular SQL command
         else:
-            logging.debug(f"Processing SQL command: {command}")
+            logging.debug("Processing SQL command: %s", command)
             
             # Add a semicolon if not present to ensure proper execution
             if not command.rstrip().endswith(';'):
@@ -1990,8 +2569,6 @@ def execute_psql():
             # Format the output
             if len(result) > 0:
                 # Get column names from first row
-                from sqlalchemy.engine.row import Row
-                
                 if isinstance(result[0], Row):
                     # SQLAlchemy Row object - get keys from it
                     column_names = result[0]._fields
@@ -1999,24 +2576,13 @@ def execute_psql():
                     # Regular tuple - generate numeric column names
                     column_names = [f"col{i}" for i in range(len(result[0]))]
                 
-                # Format as a table
-                output = ""
-                
-                # Add column headers
-                output += " " + " | ".join(str(col) for col in column_names) + " \n"
-                output += "-" + "-+-".join("-" * len(str(col)) for col in column_names) + "-\n"
-                
-                # Add rows
-                for row in result:
-                    if isinstance(row, Row):
-                        # Convert Row to tuple
-                        row_values = tuple(row)
-                    else:
-                        row_values = row
-                    
-                    output += " " + " | ".join(str(val) for val in row_values) + " \n"
-                    
-                output += f"({len(result)} rows)"
+                # Format as a table: column headers, a separator, the rows, and the row count
+                output = "".join([
+                    " " + " | ".join(map(str, column_names)) + " \n",
+                    "-" + "-+-".join("-" * len(str(col)) for col in column_names) + "-\n",
+                    *(" " + " | ".join(map(str, row)) + " \n" for row in result),
+                    f"({len(result)} rows)"
+                ])
                 
                 return jsonify({
                     "success": True,
@@ -2045,7 +2611,6 @@ def source_queue():
     """
     Display the source code queue
     """
-    from utils.ledger_manager import LedgerManager
     
     # Get source queue for current user
     queue_entries = LedgerManager.get_source_queue(user_id=current_user.id)
@@ -2058,13 +2623,34 @@ def doc_queue():
     """
     Display the documentation queue
     """
-    from utils.ledger_manager import LedgerManager
     
     # Get documentation queue for current user
     queue_entries = LedgerManager.get_doc_queue(user_id=current_user.id)
     
     return render_template("ledger/doc_queue.html", queue_entries=queue_entries)
 
+# Source type for each known file extension
+_SOURCE_EXTENSION_LANGUAGES = {
+    '.cob': 'COBOL', '.cobol': 'COBOL', '.cbl': 'COBOL',
+    '.jcl': 'JCL',
+    '.cpy': 'CPY',
+    '.py': 'PYTHON', '.pyw': 'PYTHON',
+    '.json': 'JSON',
+    '.xml': 'XML', '.html': 'XML', '.htm': 'XML',
+    '.sql': 'SQL', '.pgsql': 'SQL', '.mysql': 'SQL'
+}
+
+# Characters at the start of a source file scanned for language markers before the rest
+LANGUAGE_DETECTION_HEAD_CHARS = 8192
+
+# Source type detection patterns, compiled once and matched case-insensitively
+# so uploaded code is scanned in place rather than copied to uppercase first
+_COBOL_SOURCE_RE = re.compile(r'IDENTIFICATION\s+DIVISION|ID\s+DIVISION|PROGRAM-ID', re.IGNORECASE)
+_JCL_SOURCE_RE = re.compile(r'//\w+\s+(?:JOB|EXEC)', re.IGNORECASE)
+_COPYBOOK_RECORD_RE = re.compile(r'01\s+\w+-RECORD', re.IGNORECASE)
+_COPYBOOK_EXCLUDE_RE = re.compile(r'PROGRAM-ID|PROCEDURE\s+DIVISION', re.IGNORECASE)
+_SQL_SOURCE_RE = re.compile(r'SELECT\s+.*\s+FROM|CREATE\s+TABLE|INSERT\s+INTO', re.IGNORECASE)
+
 def detect_language_from_code(code_content, filename=None):
     """
     Detect the programming language from source code content and/or filename
@@ -2078,52 +2664,47 @@ def detect_language_from_code(code_content, filename=None):
     """
     # First check if we can detect from filename extension
     if filename:
-        # Convert to lowercase
-        filename = filename.lower()
-        
-        # Detect based on file extension
-        if filename.endswith(('.cob', '.cobol', '.cbl')):
-            return 'COBOL'
-        elif filename.endswith('.jcl'):
-            return 'JCL'
-        elif filename.endswith('.cpy'):
-            return 'CPY'
-        elif filename.endswith(('.py', '.pyw')):
-            return 'PYTHON'
-        elif filename.endswith('.json'):
-            return 'JSON'
-        elif filename.endswith(('.xml', '.html', '.htm')):
-            return 'XML'
-        elif filename.endswith(('.sql', '.pgsql', '.mysql')):
-            return 'SQL'
+        language = _SOURCE_EXTENSION_LANGUAGES.get(os.path.splitext(filename)[1].lower())
+        if language:
+            return language
     
     # If we couldn't detect from filename or no filename was provided, analyze the content
     if not code_content or len(code_content.strip()) < 10:
         return None
     
-    # Convert to uppercase for easier pattern matching
-    code_upper = code_content.upper()
+    # Language markers sit near the top of a source file, so scan its head first and
+    # only scan the whole file when nothing matches there
+    head = code_content[:LANGUAGE_DETECTION_HEAD_CHARS]
+    language = match_source_patterns(head, code_content)
+    if language is None and len(code_content) > len(head):
+        language = match_source_patterns(code_content, code_content)
+    return language
+
+def match_source_patterns(text, code_content):
+    """
+    Match source type detection patterns against part of a source file
     
+    Args:
+        text (str): The part of the source code to scan
+        code_content (str): The whole source code, which must not contain program markers for a copybook
+        
+    Returns:
+        str: Detected language (COBOL, JCL, CPY, or SQL) or None if no pattern matches
+    """
     # Check for COBOL specific patterns
-    if (re.search(r'IDENTIFICATION\s+DIVISION', code_upper) or 
-        re.search(r'ID\s+DIVISION', code_upper) or
-        re.search(r'PROGRAM-ID', code_upper)):
+    if _COBOL_SOURCE_RE.search(text):
         return 'COBOL'
     
     # Check for JCL specific patterns
-    if re.search(r'//\w+\s+JOB', code_upper) or re.search(r'//\w+\s+EXEC', code_upper):
+    if _JCL_SOURCE_RE.search(text):
         return 'JCL'
     
     # Check for CPY (copybook) patterns
-    if (re.search(r'01\s+\w+-RECORD', code_upper) and 
-        not re.search(r'PROGRAM-ID', code_upper) and
-        not re.search(r'PROCEDURE\s+DIVISION', code_upper)):
+    if _COPYBOOK_RECORD_RE.search(text) and not _COPYBOOK_EXCLUDE_RE.search(code_content):
         return 'CPY'
     
     # Check for SQL patterns
-    if (re.search(r'SELECT\s+.*\s+FROM', code_upper) or
-        re.search(r'CREATE\s+TABLE', code_upper) or
-        re.search(r'INSERT\s+INTO', code_upper)):
+    if _SQL_SOURCE_RE.search(text):
         return 'SQL'
     
     # Default to None if we can't determine
@@ -2136,22 +2717,23 @@ def add_source_code():
     """
     Add source code to the ledger queue
     """
-    from utils.ledger_manager import LedgerManager
     
     try:
         cobol_code = ""
         source_name = ""
         input_source = "Manual Pasted"
+        filename = None
         
         # Log all form data and files for debugging
-        logger.debug("==== ADD SOURCE DEBUG ====")
-        logger.debug(f"Form data keys: {list(request.form.keys())}")
-        logger.debug(f"Files keys: {list(request.files.keys() if request.files else [])}")
-        logger.debug(f"Form data values: {dict(request.form)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("==== ADD SOURCE DEBUG ====")
+            logger.debug("Form data keys: %s", list(request.form.keys()))
+            logger.debug("Files keys: %s", list(request.files.keys() if request.files else []))
+            logger.debug("Form data values: %s", dict(request.form))
         
         # Check which input method was selected
         input_method = request.form.get('inputMethod', 'paste')
-        logger.debug(f"Input method: {input_method}")
+        logger.debug("Input method: %s", input_method)
         
         # Get source name - this should always be present
         source_name = request.form.get('sourceName', '').strip()
@@ -2159,24 +2741,25 @@ def add_source_code():
             logger.error("Missing source name")
             return jsonify({"status": "error", "error": "Please provide a source name"}), 400
         
-        logger.debug(f"Source name: {source_name}")
+        logger.debug("Source name: %s", source_name)
         
         # Check if code was uploaded as file
         if input_method == 'file' and 'sourceFile' in request.files and request.files['sourceFile'].filename:
             file = request.files['sourceFile']
-            logger.debug(f"Processing uploaded file: {file.filename}")
+            filename = file.filename
+            logger.debug("Processing uploaded file: %s", filename)
             try:
-                cobol_code = file.read().decode('utf-8')
+                cobol_code = read_upload_text(file)
                 # Keep the user-provided source name
                 input_source = "External Input"
-                logger.debug(f"File content length: {len(cobol_code)}")
+                logger.debug("File content length: %s", len(cobol_code))
             except UnicodeDecodeError:
                 logger.error("File encoding error")
-                return jsonify({"status": "error", "error": "The uploaded file contains invalid characters. Please ensure it's a text file with UTF-8 encoding."}), 400
+                return jsonify({"status": "error", "error": UPLOAD_ENCODING_ERROR}), 400
         # Check if code was pasted
         elif input_method == 'paste' and 'sourceCode' in request.form and request.form['sourceCode'].strip():
             cobol_code = request.form['sourceCode']
-            logger.debug(f"Processing pasted code, length: {len(cobol_code)}")
+            logger.debug("Processing pasted code, length: %s", len(cobol_code))
             input_source = "Manual Pasted"
         else:
             # Check what's missing
@@ -2195,17 +2778,15 @@ def add_source_code():
         if not source_language:
             source_language = 'COBOL'
         
-        # Detect language from content and/or filename if possible
-        filename = None
-        if input_method == 'file' and 'sourceFile' in request.files and request.files['sourceFile'].filename:
-            filename = request.files['sourceFile'].filename
-            
-        detected_language = detect_language_from_code(cobol_code, filename)
-        if detected_language and detected_language != source_language:
-            logger.info(f"Language auto-detected as {detected_language} (was {source_language})")
-            source_language = detected_language
+        # Detect language from content and/or filename if possible; a language the user
+        # picked explicitly, rather than the COBOL default, is kept without scanning the code
+        if source_language == 'COBOL':
+            detected_language = detect_language_from_code(cobol_code, filename)
+            if detected_language and detected_language != source_language:
+                logger.info("Language auto-detected as %s (was %s)", detected_language, source_language)
+                source_language = detected_language
         
-        logger.debug(f"Adding to ledger: {source_name}, language: {source_language}, input_source: {input_source}")
+        logger.debug("Adding to ledger: %s, language: %s, input_source: %s", source_name, source_language, input_source)
         
         # Add to ledger
         source_id = LedgerManager.add_source_code(
@@ -2223,7 +2804,7 @@ def add_source_code():
         session['current_source_id'] = source_id
         session['job_id'] = job_id
         
-        logger.debug(f"Source added successfully: {source_id}")
+        logger.debug("Source added successfully: %s", source_id)
         return jsonify({
             "status": "success", 
             "message": "Source code added to ledger", 
@@ -2249,7 +2830,6 @@ def update_source_status():
     """
     Update the status of a source code entry
     """
-    from utils.ledger_manager import LedgerManager
     
     try:
         data = request.json
@@ -2276,7 +2856,6 @@ def delete_source():
     """
     Delete a source code entry and its associated documents
     """
-    from utils.ledger_manager import LedgerManager
     
     try:
         data = request.json
@@ -2286,21 +2865,17 @@ def delete_source():
             return jsonify({"error": "Missing source_id"}), 400
         
         # Check if source exists and belongs to current user
-        source = SourceCodeQueue.query.filter_by(source_id=source_id, user_id=current_user.id).first()
+        source = SourceCodeQueue.query.filter_by(source_id=source_id, user_id=current_user.id).with_entities(SourceCodeQueue.id).first()
         if not source:
             return jsonify({"error": "Source not found or you do not have permission to delete it"}), 404
         
-        # First delete associated documents
-        docs = DocGenerated.query.filter_by(doc_source_code_id=source_id).all()
-        for doc in docs:
-            db.session.delete(doc)
-        
-        # Delete source content
-        if source.content:
-            db.session.delete(source.content)
+        # Delete associated documents and source content first, one statement per table
+        # rather than loading and deleting each row
+        DocGenerated.query.filter_by(doc_source_code_id=source_id).delete(synchronize_session=False)
+        SourceCodeContent.query.filter_by(source_id=source_id).delete(synchronize_session=False)
         
         # Delete source
-        db.session.delete(source)
+        SourceCodeQueue.query.filter_by(id=source.id).delete(synchronize_session=False)
         db.session.commit()
         
         return jsonify({"success": True})
@@ -2316,8 +2891,6 @@ def get_source_code():
     """
     Get source code content from the ledger
     """
-    from utils.ledger_manager import LedgerManager
-    import traceback
     
     try:
         source_id = request.args.get('source_id')
@@ -2326,12 +2899,12 @@ def get_source_code():
             logger.error("Missing source_id in request")
             return jsonify({"success": False, "error": "Missing source_id"}), 400
         
-        logger.debug(f"Getting source code for id: {source_id}")
+        logger.debug("Getting source code for id: %s", source_id)
         source_data = LedgerManager.get_source_code(source_id)
         
         if source_data:
             # Log success but don't log content which could be large
-            logger.debug(f"Successfully retrieved source code for id: {source_id}, content length: {len(source_data.get('content', '')) if 'content' in source_data else 'N/A'}")
+            logger.debug("Successfully retrieved source code for id: %s, content length: %s", source_id, len(source_data.get('content', '')) if 'content' in source_data else 'N/A')
             return jsonify({"success": True, "source_data": source_data})
         else:
             logger.error(f"Source not found for id: {source_id}")
@@ -2348,9 +2921,6 @@ def process_ledger_source():
     """
     Process a source code from the ledger and generate documentation
     """
-    from utils.ledger_manager import LedgerManager
-    from utils.agent import COBOLDocumentationAgent
-    
     try:
         data = request.json
         source_id = data.get('source_id')
@@ -2372,99 +2942,50 @@ def process_ledger_source():
         # Create a placeholder for the doc_id
         doc_id = None
         
+        # Resolve the logged-in user once; it is passed to every ledger call below
+        user_id = current_user.id
+        
         # Create agent and process the code
-        agent = COBOLDocumentationAgent(session_id=str(uuid.uuid4()), user_id=current_user.id)
+        agent = LedgerDocumentationAgent(session_id=str(uuid.uuid4()), user_id=user_id)
         
         # Set agent preferences
         for key, value in preferences.items():
             agent.set_user_preference(key, value)
         
         try:
-            # First analyze the structure
-            cobol_code = source_data['content']
-            structured_data = agent.analyze_cobol_structure(cobol_code)
-            
-            # Generate a timestamp for the document
-            doc_timestamp = time.strftime("%y%m%d_%H%M%S", time.gmtime())
-            
             # If generate_doc is True, create a document in "In Process" status first
             if generate_doc:
                 # Create a placeholder document with "In Process" status
-                # Get language from source_data - check both 'language' and 'source_language' to handle both ORM and SQL
-                source_language = source_data.get('language', source_data.get('source_language', 'COBOL'))
                 doc_id = LedgerManager.add_documentation(
                     source_id=source_id,
                     doc_content="Documentation generation in progress...",
                     doc_status='In Process',
-                    in_language=source_language,
-                    user_id=current_user.id
+                    in_language=ledger_source_language(source_data),
+                    user_id=user_id
                 )
-                logger.debug(f"Created documentation entry with 'In Process' status, ID: {doc_id}")
-            
-            # Then generate documentation
-            documentation = agent.generate_documentation(structured_data)
-            
-            # If we're generating documentation, update the existing doc or create a new one
-            if generate_doc:
-                if doc_id:
-                    # Update the existing document with the generated content and "Pending" status
-                    LedgerManager.update_documentation(
-                        doc_id=doc_id,
-                        doc_content=documentation,
-                        doc_status='Pending',
-                        user_id=current_user.id
-                    )
-                    logger.debug(f"Updated documentation to 'Pending' status, ID: {doc_id}")
-                else:
-                    # Create a new document with "Pending" status
-                    doc_id = LedgerManager.add_documentation(
-                        source_id=source_id,
-                        doc_content=documentation,
-                        doc_status='Pending',
-                        in_language=source_language,  # Using the previously defined source_language variable
-                        user_id=current_user.id
-                    )
-                    logger.debug(f"Created new documentation with 'Pending' status, ID: {doc_id}")
+                logger.debug("Created documentation entry with 'In Process' status, ID: %s", doc_id)
             
-            # Update source status to completed
-            LedgerManager.update_source_status(source_id, "Completed")
+            # Clients that send async=1 (or Prefer: respond-async) get the IDs right away and poll
+            # /api/ledger/get-doc, so the request thread is not held for the LLM calls
+            if request.values.get('async') == '1' or 'respond-async' in request.headers.get('Prefer', ''):
+                _agent_job_executor.submit(
+                    ledger_source_worker, agent, source_id, source_data, doc_id, generate_doc, user_id
+                )
+                return jsonify({
+                    "success": True,
+                    "status": "queued",
+                    "doc_id": doc_id,
+                    "source_id": source_id
+                }), 202
             
-            # Process the documentation for display
-            import markdown
-            from utils.mermaid_viewer import enhance_markdown_with_tabs
+            documentation, doc_id = run_ledger_source_job(agent, source_id, source_data, doc_id, generate_doc, user_id)
             
             # Enhance documentation with tabbed diagram views if needed
-            if '```mermaid' in documentation and '<div class="mermaid-container">' not in documentation:
-                try:
-                    documentation = enhance_markdown_with_tabs(documentation)
-                    logger.debug("Enhanced documentation with tabbed diagram views")
-                except Exception as e:
-                    logger.warning(f"Could not enhance documentation with tabs: {str(e)}")
+            documentation = add_diagram_tabs(documentation)
             
             # Convert Markdown to HTML
-            md = markdown.Markdown(
-                extensions=[
-                    'markdown.extensions.extra',
-                    'markdown.extensions.codehilite',
-                    'markdown.extensions.tables',
-                    'markdown.extensions.toc'
-                ]
-            )
-            
             try:
-                # Process mermaid blocks
-                mermaid_processed = documentation
-                mermaid_blocks = re.findall(r'```mermaid([\s\S]*?)```', mermaid_processed)
-                
-                for i, block in enumerate(mermaid_blocks):
-                    mermaid_processed = mermaid_processed.replace(
-                        f"```mermaid{block}```",
-                        f'<div class="mermaid">{block.strip()}</div>',
-                        1
-                    )
-                
-                # Convert to HTML
-                html_content = md.convert(mermaid_processed)
+                html_content = documentation_to_html(documentation)
                 
                 return jsonify({
                     "success": True,
@@ -2488,17 +3009,7 @@ def process_ledger_source():
                 })
                 
         except Exception as agent_error:
-            # Update source status to error
-            LedgerManager.update_source_status(source_id, "Error")
-            
-            # If we created a document, mark it as error
-            if doc_id:
-                LedgerManager.update_documentation(
-                    doc_id=doc_id,
-                    doc_status='Error',
-                    user_id=current_user.id
-                )
-            
+            mark_ledger_source_failed(source_id, doc_id, user_id)
             logger.error(f"Agent error: {str(agent_error)}")
             return jsonify({"error": f"Agent processing error: {str(agent_error)}", "success": False}), 500
         
@@ -2506,13 +3017,84 @@ def process_ledger_source():
         logger.error(f"Error processing source code: {str(e)}")
         return jsonify({"error": str(e), "success": False}), 500
 
+def ledger_source_language(source_data):
+    """Language of a ledger source; ORM rows use 'language' and SQL rows 'source_language'"""
+    return source_data.get('language', source_data.get('source_language', 'COBOL'))
+
+def run_ledger_source_job(agent, source_id, source_data, doc_id, generate_doc, user_id):
+    """Analyze a ledger source, generate its documentation, and store it in the ledger
+    
+    Args:
+        agent (COBOLDocumentationAgent): Agent with the user's preferences applied
+        source_id (int): ID of the source in the ledger
+        source_data (dict): The ledger source, including its content
+        doc_id (int): ID of the "In Process" documentation entry, or None
+        generate_doc (bool): Whether to store the documentation in the ledger
+        user_id (int): ID of the user who requested the documentation
+        
+    Returns:
+        tuple: (Markdown documentation, documentation ID or None)
+    """
+    # First analyze the structure
+    structured_data = agent.analyze_cobol_structure(source_data['content'])
+    
+    # Then generate documentation
+    documentation = agent.generate_documentation(structured_data)
+    
+    # If we're generating documentation, update the existing doc or create a new one
+    if generate_doc:
+        if doc_id:
+            # Update the existing document with the generated content and "Pending" status
+            LedgerManager.update_documentation(
+                doc_id=doc_id,
+                doc_content=documentation,
+                doc_status='Pending',
+                user_id=user_id
+            )
+            logger.debug("Updated documentation to 'Pending' status, ID: %s", doc_id)
+        else:
+            # Create a new document with "Pending" status
+            doc_id = LedgerManager.add_documentation(
+                source_id=source_id,
+                doc_content=documentation,
+                doc_status='Pending',
+                in_language=ledger_source_language(source_data),
+                user_id=user_id
+            )
+            logger.debug("Created new documentation with 'Pending' status, ID: %s", doc_id)
+    
+    # Update source status to completed
+    LedgerManager.update_source_status(source_id, "Completed")
+    return documentation, doc_id
+
+def mark_ledger_source_failed(source_id, doc_id, user_id):
+    """Set a ledger source, and its documentation entry if one was created, to Error"""
+    # Update source status to error
+    LedgerManager.update_source_status(source_id, "Error")
+    
+    # If we created a document, mark it as error
+    if doc_id:
+        LedgerManager.update_documentation(
+            doc_id=doc_id,
+            doc_status='Error',
+            user_id=user_id
+        )
+
+def ledger_source_worker(agent, source_id, source_data, doc_id, generate_doc, user_id):
+    """Run a ledger source job in the background; its outcome is recorded in the ledger statuses"""
+    with app.app_context():
+        try:
+            run_ledger_source_job(agent, source_id, source_data, doc_id, generate_doc, user_id)
+        except Exception as e:
+            mark_ledger_source_failed(source_id, doc_id, user_id)
+            logger.error(f"Error in background ledger job for source {source_id}: {str(e)}")
+
 @app.route("/api/ledger/get-doc", methods=["GET"])
 @login_required
 def get_documentation():
     """
     Get documentation content from the ledger
     """
-    from utils.ledger_manager import LedgerManager
     
     try:
         doc_id = request.args.get('doc_id')
@@ -2537,7 +3119,6 @@ def update_doc_status():
     """
     Update the status of a documentation entry
     """
-    from utils.ledger_manager import LedgerManager
     
     try:
         data = request.json
@@ -2559,13 +3140,66 @@ def update_doc_status():
         logger.error(f"Error updating documentation status: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def filter_queue_entries(queue_entries, search, fields):
+    """Keep the ledger queue entries whose given fields contain a search term
+    
+    Args:
+        queue_entries (list): Queue entries from the LedgerManager
+        search (str): Search term, matched case-insensitively
+        fields (tuple): Names of the entry fields to search
+        
+    Returns:
+        list: The matching entries, in their original order
+    """
+    search = search.lower()
+    return [
+        entry for entry in queue_entries
+        if any(search in (entry.get(field) or '').lower() for field in fields)
+    ]
+
+def ledger_queue_page(model, user_id, status, limit, after, exclude_columns=(), search=None, search_fields=()):
+    """Fetch one page of a ledger queue, newest first, starting after a keyset cursor
+    
+    Pages are keyed on the row ID rather than an offset, so each page is read from the
+    index in the same time however far into the queue it is. The search is applied in
+    SQL, so a page and its cursor only cover matching entries.
+    
+    Args:
+        model: SourceCodeQueue or DocGenerated
+        user_id (int): Only return this user's entries, if given
+        status (str): Only return entries with this status, if given
+        limit (int): Maximum number of entries on the page
+        after (int): ID of the last entry on the previous page, or None for the first page
+        exclude_columns (tuple): Large columns to leave out of the entries
+        search (str): Only return entries whose search fields contain this term, matched
+            case-insensitively, if given
+        search_fields (tuple): Names of the columns to search
+        
+    Returns:
+        tuple: (list of entry dicts, cursor for the next page or None on the last page)
+    """
+    columns = [column for column in model.__table__.columns if column.name not in exclude_columns]
+    query = db.session.query(*columns)
+    if user_id:
+        query = query.filter(model.user_id == user_id)
+    if status:
+        query = query.filter(model.status == status)
+    if search and search.strip():
+        pattern = "%" + re.sub(r'([\\%_])', r'\\\1', search) + "%"
+        query = query.filter(or_(*(getattr(model, field).ilike(pattern, escape='\\') for field in search_fields)))
+    if after is not None:
+        query = query.filter(model.id < after)
+    rows = query.order_by(model.id.desc()).limit(limit).all()
+    
+    next_cursor = rows[-1].id if rows and len(rows) == limit else None
+    return [row._asdict() for row in rows], next_cursor
+
 @app.route("/api/ledger/get-source-queue", methods=["GET"])
 @login_required
 def get_source_queue():
     """
     Get source code queue entries for API usage
     """
-    from utils.ledger_manager import LedgerManager
     
     try:
         # Get query parameters
@@ -2574,33 +3208,36 @@ def get_source_queue():
         limit = request.args.get('limit', default=50, type=int)
         search = request.args.get('search')
         
-        logger.debug(f"Getting source queue: user_id={user_id}, status={status}, limit={limit}")
+        logger.debug("Getting source queue: user_id=%s, status=%s, limit=%s", user_id, status, limit)
         
         # Default to current user if no user_id provided
-        if not user_id and current_user and current_user.is_authenticated:
+        if not user_id and current_user.is_authenticated:
             user_id = current_user.id
-            logger.debug(f"Using current user ID: {user_id}")
-        
-        # Get queue entries
-        queue_entries = LedgerManager.get_source_queue(user_id=user_id, status=status, limit=limit)
+            logger.debug("Using current user ID: %s", user_id)
+        
+        # Get queue entries; clients that pass "after" (empty for the first page) page
+        # through the queue with the returned next_cursor
+        next_cursor = None
+        paged = 'after' in request.args
+        if paged:
+            queue_entries, next_cursor = ledger_queue_page(
+                SourceCodeQueue, user_id, status, limit, request.args.get('after', type=int),
+                search=search, search_fields=('source_id', 'source_name')
+            )
+        else:
+            queue_entries = LedgerManager.get_source_queue(user_id=user_id, status=status, limit=limit)
         
         # Ensure queue_entries is a list
         if queue_entries is None:
             queue_entries = []
             logger.warning("queue_entries was None, using empty list instead")
         
-        # Filter by search term if provided
-        if search and search.strip():
-            search = search.lower()
-            filtered_entries = []
-            for entry in queue_entries:
-                if (search in entry.get('source_id', '').lower() or 
-                    search in entry.get('source_name', '').lower()):
-                    filtered_entries.append(entry)
-            queue_entries = filtered_entries
+        # Filter by search term if provided; pages were already searched in SQL
+        if search and search.strip() and not paged:
+            queue_entries = filter_queue_entries(queue_entries, search, ('source_id', 'source_name'))
         
-        logger.debug(f"Returning {len(queue_entries)} source queue entries")
-        return jsonify({"success": True, "queue_entries": queue_entries})
+        logger.debug("Returning %s source queue entries", len(queue_entries))
+        return jsonify({"success": True, "queue_entries": queue_entries, "next_cursor": next_cursor})
         
     except Exception as e:
         logger.error(f"Error getting source queue: {str(e)}")
@@ -2613,7 +3250,6 @@ def get_doc_queue():
     """
     Get documentation queue entries for API usage
     """
-    from utils.ledger_manager import LedgerManager
     
     try:
         # Get query parameters
@@ -2622,48 +3258,52 @@ def get_doc_queue():
         limit = request.args.get('limit', default=50, type=int)
         search = request.args.get('search')
         
-        logger.debug(f"Getting doc queue: user_id={user_id}, status={status}, limit={limit}")
+        logger.debug("Getting doc queue: user_id=%s, status=%s, limit=%s", user_id, status, limit)
         
         # Default to current user if no user_id provided
-        if not user_id and current_user and current_user.is_authenticated:
+        if not user_id and current_user.is_authenticated:
             user_id = current_user.id
-            logger.debug(f"Using current user ID: {user_id}")
-        
-        # Get queue entries
-        queue_entries = LedgerManager.get_doc_queue(user_id=user_id, status=status, limit=limit)
+            logger.debug("Using current user ID: %s", user_id)
+        
+        # Get queue entries; clients that pass "after" (empty for the first page) page
+        # through the queue with the returned next_cursor
+        next_cursor = None
+        paged = 'after' in request.args
+        if paged:
+            queue_entries, next_cursor = ledger_queue_page(
+                DocGenerated, user_id, status, limit, request.args.get('after', type=int), exclude_columns=('doc_content',),
+                search=search, search_fields=('result_doc_id', 'doc_source_code_id')
+            )
+        else:
+            queue_entries = LedgerManager.get_doc_queue(user_id=user_id, status=status, limit=limit)
         
         # Ensure queue_entries is a list
         if queue_entries is None:
             queue_entries = []
             logger.warning("queue_entries was None, using empty list instead")
         
-        # Filter by search term if provided
-        if search and search.strip():
-            search = search.lower()
-            filtered_entries = []
-            for entry in queue_entries:
-                if (search in entry.get('result_doc_id', '').lower() or 
-                    search in entry.get('doc_source_code_id', '').lower()):
-                    filtered_entries.append(entry)
-            queue_entries = filtered_entries
+        # Filter by search term if provided; pages were already searched in SQL
+        if search and search.strip() and not paged:
+            queue_entries = filter_queue_entries(queue_entries, search, ('result_doc_id', 'doc_source_code_id'))
         
-        logger.debug(f"Returning {len(queue_entries)} doc queue entries")
-        return jsonify({"success": True, "queue_entries": queue_entries})
+        logger.debug("Returning %s doc queue entries", len(queue_entries))
+        return jsonify({"success": True, "queue_entries": queue_entries, "next_cursor": next_cursor})
         
     except Exception as e:
         logger.error(f"Error getting doc queue: {str(e)}")
         # Return an empty list instead of error to allow the UI to handle it gracefully
         return jsonify({"success": False, "error": str(e), "queue_entries": []})
 
+# Ledger downloads at least this large are gzipped for clients that accept it
+GZIP_MIN_BYTES = 1024
+GZIP_COMPRESS_LEVEL = 6
+
 @app.route("/api/ledger/download-doc", methods=["GET"])
 @login_required
 def download_ledger_doc():
     """
     Download documentation content as a Markdown file
     """
-    from utils.ledger_manager import LedgerManager
-    import time
-    import os
     
     try:
         doc_id = request.args.get('doc_id')
@@ -2671,38 +3311,45 @@ def download_ledger_doc():
         if not doc_id:
             return jsonify({"error": "Missing doc_id"}), 400
         
-        doc_data = LedgerManager.get_documentation(doc_id)
+        # Fetch the content and the source name for the filename in one query
+        doc_row = (
+            db.session.query(DocGenerated.doc_content, SourceCodeQueue.source_name)
+            .outerjoin(SourceCodeQueue, SourceCodeQueue.source_id == DocGenerated.doc_source_code_id)
+            .filter(DocGenerated.result_doc_id == doc_id)
+            .first()
+        )
         
-        if not doc_data:
+        if not doc_row:
             return jsonify({"error": "Documentation not found"}), 404
         
-        # Get source details for filename
-        source_id = doc_data['doc_source_code_id']
-        source_data = LedgerManager.get_source_code(source_id)
-        
         # Generate timestamp for filename
         timestamp = time.strftime("%y%m%d_%H%M%S", time.gmtime())
         
         # Create filename based on source name or doc ID
-        if source_data and 'source_name' in source_data:
-            base_name = os.path.splitext(source_data['source_name'])[0]
+        if doc_row.source_name:
+            base_name = os.path.splitext(doc_row.source_name)[0]
             filename = f"{timestamp}_{base_name}_documentation.md"
         else:
             filename = f"{timestamp}_documentation_{doc_id[-8:]}.md"
         
-        # Create a temporary file to serve
-        import tempfile
+        # Serve the content from memory; a temporary file was never removed afterwards.
+        # Markdown compresses several times over, so larger documents are sent gzipped
+        # to clients that accept it
+        content = doc_row.doc_content.encode('utf-8')
+        gzipped = len(content) >= GZIP_MIN_BYTES and request.accept_encodings['gzip'] > 0
+        if gzipped:
+            content = gzip.compress(content, compresslevel=GZIP_COMPRESS_LEVEL)
         
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.md') as temp:
-            temp.write(doc_data['doc_content'])
-            temp_path = temp.name
-        
-        return send_file(
-            temp_path,
+        response = send_file(
+            io.BytesIO(content),
             as_attachment=True,
             download_name=filename,
             mimetype='text/markdown'
         )
+        response.vary.add('Accept-Encoding')
+        if gzipped:
+            response.content_encoding = 'gzip'
+        return response
         
     except Exception as e:
         logger.error(f"Error downloading documentation: {str(e)}")
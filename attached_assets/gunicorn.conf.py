@@ -0,0 +1,15 @@
+import os
+
+# Requests spend most of their time waiting on LLM APIs, so each worker process serves
+# many of them on threads instead of blocking a whole process per request
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+# gevent or eventlet (installed separately) can serve far more idle connections per
+# worker, e.g. long-polling clients; gthread needs no extra packages
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+
+# A full parse -> analyze -> document -> diagram chain can take minutes on large programs
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
@@ -21,6 +21,7 @@ class User(UserMixin, db.Model):
 
 class Project(db.Model):
     """Project model for storing COBOL documentation projects"""
+    __table_args__ = (db.UniqueConstraint('user_id', 'name', name='uq_project_user_name'),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -34,6 +35,7 @@ class Project(db.Model):
 
 class CobolFile(db.Model):
     """Model for storing COBOL file information"""
+    __table_args__ = (db.UniqueConstraint('project_id', 'program_id', name='uq_cobol_file_project_program'),)
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -53,7 +55,7 @@ class Documentation(db.Model):
     language = db.Column(db.String(10), default='en')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    cobol_file_id = db.Column(db.Integer, db.ForeignKey('cobol_file.id'), nullable=False)
+    cobol_file_id = db.Column(db.Integer, db.ForeignKey('cobol_file.id'), nullable=False, unique=True)
     
     def __repr__(self):
         return f'<Documentation for file {self.cobol_file_id}>'
@@ -65,6 +67,8 @@ class SourceCodeQueue(db.Model):
     SOURCE_CODE_QUEUE table for storing source code in a queue system
     to solve session size limitations
     """
+    # Queue pages are listed per user, newest first, keyed on the ID
+    __table_args__ = (db.Index('ix_source_code_queue_user_id_id', 'user_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.String(15), nullable=False, index=True)  # YYMMDD_HHMMSS format
     source_language = db.Column(db.String(20), nullable=False, index=True)  # COBOL, JCL, CPY, etc.
@@ -115,6 +119,8 @@ class DocGenerated(db.Model):
     DOC_GENERATED table for storing generated documentation
     linked to source code from the queue
     """
+    # Queue pages are listed per user, newest first, keyed on the ID
+    __table_args__ = (db.Index('ix_doc_generated_user_id_id', 'user_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     result_doc_id = db.Column(db.String(300), nullable=False, unique=True, index=True)
     result_doc_status = db.Column(db.String(50), nullable=False, index=True)  # Pending of Review, Approved, Rejected
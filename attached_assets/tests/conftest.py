@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The application imports its modules relative to attached_assets (e.g. "from utils import llm_cache")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
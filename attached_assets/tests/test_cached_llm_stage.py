@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from utils import llm_cache
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+app = pytest.importorskip("app")
+
+
+@pytest.fixture(autouse=True)
+def disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "get_redis", lambda: None)
+    monkeypatch.setattr(llm_cache, "CACHE_DIR", str(tmp_path))
+
+
+class Compute:
+    """Stage function that counts its calls"""
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+def test_source_hash_ignores_trailing_whitespace_and_blank_edges():
+    code = "       IDENTIFICATION DIVISION.\n       PROGRAM-ID. HELLO.\n"
+
+    assert app.source_hash(code) == app.source_hash("\n" + code.replace(".\n", ".   \r\n") + "\n\n")
+    assert app.source_hash(code) != app.source_hash(code.replace("HELLO", "WORLD"))
+
+
+def test_result_is_reused_for_same_stage_model_and_input():
+    compute = Compute({"program_id": "HELLO", "description": "Says hello"})
+
+    first = app.cached_llm_stage("extract", "groq/default", "abc", compute)
+    second = app.cached_llm_stage("extract", "groq/default", "abc", compute)
+
+    assert first == second == {"program_id": "HELLO", "description": "Says hello"}
+    assert compute.calls == 1
+
+
+@pytest.mark.parametrize("stage, model_id, input_hash", [
+    ("generate", "groq/default", "abc"),
+    ("extract", "groq/llama-3.1-8b-instant", "abc"),
+    ("extract", "groq/default", "def"),
+])
+def test_key_includes_stage_model_and_input(stage, model_id, input_hash):
+    compute = Compute({"program_id": "HELLO"})
+    app.cached_llm_stage("extract", "groq/default", "abc", compute)
+
+    app.cached_llm_stage(stage, model_id, input_hash, compute)
+
+    assert compute.calls == 2
+
+
+def test_key_includes_prompt_version(monkeypatch):
+    compute = Compute("# HELLO Documentation")
+    app.cached_llm_stage("generate", "groq/default", "abc", compute)
+
+    monkeypatch.setattr(app, "PROMPT_VERSION", app.PROMPT_VERSION + "-next")
+    app.cached_llm_stage("generate", "groq/default", "abc", compute)
+
+    assert compute.calls == 2
+
+
+@pytest.mark.parametrize("result", [
+    "# HELLO Documentation\n\n## Error: Groq API request failed\n",
+    {"error": "No API keys available"},
+    {"program_id": "HELLO", "description": app.ANALYSIS_FALLBACK_DESCRIPTION},
+    None,
+])
+def test_error_and_fallback_results_are_not_cached(result):
+    compute = Compute(result)
+
+    assert app.cached_llm_stage("extract", "groq/default", "abc", compute) == result
+    app.cached_llm_stage("extract", "groq/default", "abc", compute)
+
+    assert compute.calls == 2
+
+
+def test_custom_cacheable_check():
+    compute = Compute({"documentation": "# Doc"})
+
+    app.cached_llm_stage("agent", "settings", "abc", compute, cacheable=lambda result: False)
+    app.cached_llm_stage("agent", "settings", "abc", compute, cacheable=lambda result: False)
+
+    assert compute.calls == 2
@@ -0,0 +1,101 @@
+import json
+import os
+import types
+
+import pytest
+
+from utils import job_store
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    """Use the file fallback in a temporary directory"""
+    monkeypatch.setattr(job_store, "get_redis", lambda: None)
+    monkeypatch.setattr(job_store, "LOCAL_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def redis_server():
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redis_store(redis_server, monkeypatch):
+    """Use an in-memory Redis server"""
+    import fakeredis
+
+    client = fakeredis.FakeRedis(server=redis_server)
+    monkeypatch.setattr(job_store, "get_redis", lambda: client)
+    return client
+
+
+def test_local_update_merges_fields(local_store):
+    job_store.update_job("job-1", status="queued", progress_percentage=0)
+    job_store.update_job("job-1", progress_percentage=50)
+
+    assert job_store.get_job("job-1") == {"status": "queued", "progress_percentage": 50}
+
+
+def test_local_unknown_job_is_none(local_store):
+    assert job_store.get_job("missing") is None
+
+
+def test_local_expired_job_is_none(local_store):
+    job_store.update_job("job-1", ttl=-1, status="completed")
+
+    assert job_store.get_job("job-1") is None
+
+
+def test_local_job_ids_cannot_escape_directory(local_store):
+    job_store.update_job("../../etc/passwd", status="queued")
+
+    assert [path.parent for path in local_store.iterdir()] == [local_store]
+    assert job_store.get_job("../../etc/passwd") == {"status": "queued"}
+
+
+def test_local_update_replaces_file_atomically(local_store, monkeypatch):
+    job_store.update_job("job-1", status="queued")
+
+    def failing_dump(obj, f):
+        f.write('{"status": "broken"')
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(job_store, "json", types.SimpleNamespace(load=json.load, dump=failing_dump))
+        with pytest.raises(OSError):
+            job_store.update_job("job-1", status="processing")
+
+    # The failed write leaves neither a partial record nor its temporary file behind
+    assert job_store.get_job("job-1") == {"status": "queued"}
+    assert not [name for name in os.listdir(local_store) if name.endswith(".tmp")]
+
+
+def test_redis_update_merges_fields_and_sets_ttl(redis_store):
+    job_store.update_job("job-1", ttl=60, status="queued", progress_percentage=0)
+    job_store.update_job("job-1", ttl=60, progress_percentage=50)
+
+    assert job_store.get_job("job-1") == {"status": "queued", "progress_percentage": 50}
+    assert 0 < redis_store.ttl("job:job-1") <= 60
+
+
+def test_redis_concurrent_update_is_not_lost(redis_server, redis_store, monkeypatch):
+    import fakeredis
+
+    job_store.update_job("job-1", status="processing", progress_percentage=25)
+    other_client = fakeredis.FakeRedis(server=redis_server)
+    interleaved = []
+
+    def loads_with_concurrent_write(value):
+        # Another worker records progress after this update has read the job
+        if not interleaved:
+            interleaved.append(True)
+            other_client.set("job:job-1", json.dumps({"status": "processing", "owner": "user:1"}))
+        return json.loads(value)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(job_store, "json", types.SimpleNamespace(loads=loads_with_concurrent_write, dumps=json.dumps))
+        job_store.update_job("job-1", progress_percentage=50)
+
+    assert job_store.get_job("job-1") == {"status": "processing", "owner": "user:1", "progress_percentage": 50}
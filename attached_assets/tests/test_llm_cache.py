@@ -0,0 +1,67 @@
+import json
+import os
+import types
+
+import pytest
+
+from utils import llm_cache
+
+
+@pytest.fixture
+def disk_cache(tmp_path, monkeypatch):
+    """Use the disk fallback in a temporary directory"""
+    monkeypatch.setattr(llm_cache, "get_redis", lambda: None)
+    monkeypatch.setattr(llm_cache, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_disk_round_trip(disk_cache):
+    llm_cache.put("generate:1:groq/default:abc", "# Documentation")
+
+    assert llm_cache.get("generate:1:groq/default:abc") == "# Documentation"
+    assert llm_cache.get("generate:1:groq/default:other") is None
+
+
+def test_disk_expired_entry_is_removed(disk_cache):
+    llm_cache.put("key", "value", ttl=-1)
+
+    assert llm_cache.get("key") is None
+    assert not os.listdir(disk_cache)
+
+
+def test_disk_write_failure_keeps_previous_entry(disk_cache, monkeypatch):
+    llm_cache.put("key", "old")
+
+    def failing_dump(obj, f):
+        f.write('{"expires_at": ')
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(llm_cache, "json", types.SimpleNamespace(load=json.load, dump=failing_dump))
+        llm_cache.put("key", "new")
+
+    assert llm_cache.get("key") == "old"
+    assert not [name for name in os.listdir(disk_cache) if name.endswith(".tmp")]
+
+
+def test_disk_cache_prunes_oldest_entries(disk_cache, monkeypatch):
+    llm_cache.put("oldest", "x" * 100)
+    os.utime(llm_cache._cache_path("oldest"), (1, 1))
+    entry_size = os.path.getsize(llm_cache._cache_path("oldest"))
+    monkeypatch.setattr(llm_cache, "MAX_DISK_BYTES", entry_size + entry_size // 2)
+
+    llm_cache.put("newest", "y" * 100)
+
+    assert llm_cache.get("oldest") is None
+    assert llm_cache.get("newest") == "y" * 100
+
+
+def test_redis_round_trip_with_ttl(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(llm_cache, "get_redis", lambda: client)
+
+    llm_cache.put("key", "value", ttl=60)
+
+    assert llm_cache.get("key") == "value"
+    assert 0 < client.ttl(llm_cache.KEY_PREFIX + "key") <= 60
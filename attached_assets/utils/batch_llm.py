@@ -0,0 +1,105 @@
+import os
+import json
+import logging
+from groq import Groq
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+DEFAULT_BATCH_MODEL = "llama-3.3-70b-versatile"
+
+# Batch states after which the provider will not make further progress
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def _get_client():
+    """Create a Groq client, reading the API key at call time since it can be saved at runtime"""
+    api_key = os.environ.get("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("GROQ_API_KEY is not set; batch processing requires a Groq API key")
+    return Groq(api_key=api_key)
+
+def submit_batch(prompts, model=None, temperature=0.3, max_tokens=4000):
+    """Submit many prompts as a single provider-side batch job
+
+    Args:
+        prompts (list): Dicts with a unique "custom_id" and the "prompt" text
+        model (str, optional): Model to run every request on
+        temperature (float): Sampling temperature
+        max_tokens (int): Maximum tokens per response
+
+    Returns:
+        str: The provider's batch ID
+    """
+    model = model or DEFAULT_BATCH_MODEL
+    lines = [
+        json.dumps({
+            "custom_id": item["custom_id"],
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": model,
+                "messages": [{"role": "user", "content": item["prompt"]}],
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            }
+        })
+        for item in prompts
+    ]
+
+    client = _get_client()
+    batch_file = client.files.create(
+        file=("batch.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=BATCH_COMPLETION_WINDOW
+    )
+    logger.info("Submitted batch %s with %s requests", batch.id, len(prompts))
+    return batch.id
+
+def get_batch_status(batch_id):
+    """Get the progress of a batch job
+
+    Args:
+        batch_id (str): The provider's batch ID
+
+    Returns:
+        dict: Status, request counts, and whether the batch has finished
+    """
+    batch = _get_client().batches.retrieve(batch_id)
+    counts = batch.request_counts
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "done": batch.status in TERMINAL_STATUSES,
+        "total": counts.total if counts else 0,
+        "completed": counts.completed if counts else 0,
+        "failed": counts.failed if counts else 0,
+        "output_file_id": batch.output_file_id
+    }
+
+def collect_batch_results(output_file_id):
+    """Download the responses of a completed batch job
+
+    Args:
+        output_file_id (str): The batch's output file ID
+
+    Returns:
+        dict: Response text keyed by custom_id; failed requests are omitted
+    """
+    content = _get_client().files.content(output_file_id).text()
+
+    results = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        if entry.get("error") or response.get("status_code") != 200:
+            logger.warning("Batch request %s failed: %s", entry.get('custom_id'), entry.get('error'))
+            continue
+        results[entry["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
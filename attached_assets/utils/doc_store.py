@@ -0,0 +1,129 @@
+import io
+import os
+import time
+import logging
+import tempfile
+from utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 3600
+LOCAL_DIR = os.path.join(tempfile.gettempdir(), "cobol_docs")
+# Expired local files are removed at most this often, when documentation is saved
+SWEEP_INTERVAL_SECONDS = 300
+
+_last_sweep = 0.0
+
+def _local_path(doc_id):
+    return os.path.join(LOCAL_DIR, f"{doc_id}.md")
+
+def _sweep_expired_files():
+    """Delete local documentation files whose expiry time has passed"""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < SWEEP_INTERVAL_SECONDS:
+        return
+    _last_sweep = now
+
+    for entry in os.scandir(LOCAL_DIR):
+        try:
+            # Skip .tmp files: another worker may still be writing them
+            if entry.name.endswith(".md") and entry.stat().st_mtime < now:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+def _write_doc_blob(doc_id, data, expires_at):
+    """Write a local documentation file readable only by this user and set its expiry time"""
+    # mkstemp creates the file with mode 0600; renaming it into place means readers in
+    # other workers never see a partial file or one whose expiry time is not set yet
+    fd, tmp_path = tempfile.mkstemp(dir=LOCAL_DIR, suffix=".tmp")
+    try:
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.utime(tmp_path, (expires_at, expires_at))
+        os.replace(tmp_path, _local_path(doc_id))
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    _sweep_expired_files()
+
+def _open_local(doc_id, mode):
+    """Open a local documentation file, or return None if it is missing or has expired"""
+    try:
+        f = open(_local_path(doc_id), mode, **({} if "b" in mode else {"encoding": "utf-8"}))
+    except FileNotFoundError:
+        return None
+    if os.fstat(f.fileno()).st_mtime < time.time():
+        f.close()
+        try:
+            os.remove(_local_path(doc_id))
+        except FileNotFoundError:
+            pass
+        return None
+    return f
+
+def save_documentation(doc_id, documentation, ttl=DEFAULT_TTL_SECONDS):
+    """Store generated documentation for later download, translation, or status checks
+
+    Uses Redis when available so every worker on every host sees the same documents;
+    otherwise falls back to a file in the system temporary directory, which all
+    workers on this host share, so multi-host deployments need Redis.
+    The local file is written before this returns, so a status poll handled by another
+    worker finds it, and its modification time is set to its expiry time.
+
+    Args:
+        doc_id (str): Documentation ID kept in the user's session
+        documentation (str): Markdown documentation
+        ttl (int): Seconds before the stored documentation expires
+    """
+    client = get_redis()
+    if client is not None:
+        client.setex(f"doc:{doc_id}", ttl, documentation.encode("utf-8"))
+        return
+
+    os.makedirs(LOCAL_DIR, exist_ok=True)
+    _write_doc_blob(doc_id, documentation.encode("utf-8"), time.time() + ttl)
+
+def load_documentation(doc_id):
+    """Fetch stored documentation
+
+    Args:
+        doc_id (str): Documentation ID kept in the user's session
+
+    Returns:
+        str: The Markdown documentation, or None if it is missing or has expired
+    """
+    client = get_redis()
+    if client is not None:
+        value = client.get(f"doc:{doc_id}")
+        return value.decode("utf-8") if value is not None else None
+
+    f = _open_local(doc_id, "r")
+    if f is None:
+        return None
+    with f:
+        return f.read()
+
+def open_documentation(doc_id):
+    """Open stored documentation as a binary stream for sending to the client
+
+    The stored bytes are served as-is, without decoding and re-encoding them; a local
+    file is returned as an open file so the server can send it with sendfile.
+
+    Args:
+        doc_id (str): Documentation ID kept in the user's session
+
+    Returns:
+        file: Binary stream of the UTF-8 Markdown, or None if it is missing or has expired
+    """
+    client = get_redis()
+    if client is not None:
+        value = client.get(f"doc:{doc_id}")
+        return io.BytesIO(value) if value is not None else None
+
+    return _open_local(doc_id, "rb")
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 3600
+# Local fallback used without Redis: one file per job, shared by every worker on this host
+LOCAL_DIR = os.path.join(tempfile.gettempdir(), "cobol_jobs")
+# Expired job files are removed at most this often, when a job is updated
+SWEEP_INTERVAL_SECONDS = 300
+
+_last_sweep = 0.0
+
+def _local_path(job_id):
+    """Map a client-supplied job ID to a file name that cannot escape LOCAL_DIR"""
+    return os.path.join(LOCAL_DIR, hashlib.sha256(job_id.encode("utf-8")).hexdigest() + ".json")
+
+def _sweep_expired_files():
+    """Delete local job files whose expiry time has passed"""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < SWEEP_INTERVAL_SECONDS:
+        return
+    _last_sweep = now
+
+    for entry in os.scandir(LOCAL_DIR):
+        try:
+            # Skip .tmp files: another worker may still be writing them
+            if entry.name.endswith(".json") and entry.stat().st_mtime < now:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+def _read_local_job(job_id):
+    """Read a local job file, or return None if it is missing or has expired"""
+    try:
+        with open(_local_path(job_id), "r", encoding="utf-8") as f:
+            if os.fstat(f.fileno()).st_mtime < time.time():
+                return None
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def update_job(job_id, ttl=DEFAULT_TTL_SECONDS, **fields):
+    """Record the state of a background job, merging fields into what is already stored
+
+    Args:
+        job_id (str): Job ID returned to the client for polling
+        ttl (int): Seconds before the job record expires
+        **fields: Status fields such as status, progress_percentage, and status_message
+    """
+    client = get_redis()
+    if client is not None:
+        key = f"job:{job_id}"
+
+        def merge(pipe):
+            value = pipe.get(key)
+            job = json.loads(value) if value is not None else {}
+            job.update(fields)
+            pipe.multi()
+            pipe.set(key, json.dumps(job), ex=ttl)
+
+        # The key is WATCHed, so an update that lands between the read and the write makes
+        # the transaction retry instead of being overwritten
+        client.transaction(merge, key)
+        return
+
+    # Each job is updated only by the thread running it, so read-merge-write is safe
+    os.makedirs(LOCAL_DIR, exist_ok=True)
+    job = _read_local_job(job_id) or {}
+    job.update(fields)
+    expires_at = time.time() + ttl
+    # Write to a temporary file and rename it so pollers in other workers never see a partial
+    # record; the file's modification time is its expiry time
+    fd, tmp_path = tempfile.mkstemp(dir=LOCAL_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.utime(tmp_path, (expires_at, expires_at))
+        os.replace(tmp_path, _local_path(job_id))
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    _sweep_expired_files()
+
+def get_job(job_id):
+    """Fetch the state of a background job
+
+    Args:
+        job_id (str): Job ID returned to the client for polling
+
+    Returns:
+        dict: The stored job fields, or None if the job is unknown or has expired
+    """
+    client = get_redis()
+    if client is not None:
+        value = client.get(f"job:{job_id}")
+        return json.loads(value) if value is not None else None
+
+    return _read_local_job(job_id)
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 7 * 86400
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cobolsql", "cache")
+KEY_PREFIX = "llm_cache:"
+# Upper bound on the disk fallback; the oldest entries are removed once it is exceeded
+MAX_DISK_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+def _cache_path(key):
+    """Map a cache key to a file name that is safe on any filesystem"""
+    return os.path.join(CACHE_DIR, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+def _prune_disk_cache():
+    """Delete the least recently written entries until the disk cache fits MAX_DISK_BYTES"""
+    entries = []
+    total_bytes = 0
+    with os.scandir(CACHE_DIR) as it:
+        for entry in it:
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+    if total_bytes <= MAX_DISK_BYTES:
+        return
+    
+    entries.sort()
+    for _, size, path in entries:
+        if total_bytes <= MAX_DISK_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+def get(key):
+    """Look up a cached LLM response
+
+    Args:
+        key (str): Cache key
+
+    Returns:
+        str: The cached value, or None if it is missing, expired, or unreadable
+    """
+    try:
+        client = get_redis()
+        if client is not None:
+            value = client.get(KEY_PREFIX + key)
+            return value.decode("utf-8") if value is not None else None
+
+        path = _cache_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if entry["expires_at"] < time.time():
+            os.remove(path)
+            return None
+        return entry["value"]
+    except Exception as e:
+        logger.warning(f"Error reading LLM cache entry: {str(e)}")
+        return None
+
+def put(key, value, ttl=DEFAULT_TTL_SECONDS):
+    """Store an LLM response
+
+    Args:
+        key (str): Cache key
+        value (str): Serialized response
+        ttl (int): Seconds before the entry expires
+    """
+    try:
+        client = get_redis()
+        if client is not None:
+            client.set(KEY_PREFIX + key, value, ex=ttl)
+            return
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temporary file and rename it so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": time.time() + ttl, "value": value}, f)
+            os.replace(tmp_path, _cache_path(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        _prune_disk_cache()
+    except Exception as e:
+        logger.warning(f"Error writing LLM cache entry: {str(e)}")
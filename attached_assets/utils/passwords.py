@@ -0,0 +1,65 @@
+import logging
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+except ImportError:  # argon2-cffi is optional; fall back to Werkzeug's PBKDF2/scrypt hashes
+    PasswordHasher = None
+
+logger = logging.getLogger(__name__)
+
+ARGON2_PREFIX = "$argon2"
+
+# Argon2's C implementation releases the GIL, so concurrent logins do not serialize on hashing
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1) if PasswordHasher else None
+
+def hash_password(password):
+    """Hash a password for storage in User.password_hash
+
+    Args:
+        password (str): Plain-text password
+
+    Returns:
+        str: Argon2 hash when argon2-cffi is installed, otherwise a Werkzeug hash
+    """
+    if _password_hasher is not None:
+        return _password_hasher.hash(password)
+    return generate_password_hash(password)
+
+def verify_password(password_hash, password):
+    """Check a password against a stored Argon2 or Werkzeug hash
+
+    Args:
+        password_hash (str): Stored hash
+        password (str): Plain-text password to check
+
+    Returns:
+        bool: True if the password matches
+    """
+    if not password_hash:
+        return False
+    if password_hash.startswith(ARGON2_PREFIX):
+        if _password_hasher is None:
+            logger.error("Stored password uses Argon2 but argon2-cffi is not installed")
+            return False
+        try:
+            return _password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return check_password_hash(password_hash, password)
+
+def needs_rehash(password_hash):
+    """Check whether a verified hash should be replaced, e.g. an older Werkzeug hash
+
+    Args:
+        password_hash (str): Stored hash that has just been verified
+
+    Returns:
+        bool: True if the password should be re-hashed with hash_password()
+    """
+    if _password_hasher is None:
+        return False
+    if not password_hash.startswith(ARGON2_PREFIX):
+        return True
+    return _password_hasher.check_needs_rehash(password_hash)
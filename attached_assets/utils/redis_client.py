@@ -0,0 +1,31 @@
+import os
+import logging
+
+try:
+    import redis
+except ImportError:  # Redis is optional; callers fall back to local storage without it
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+_redis_checked = False
+
+def get_redis():
+    """Return a shared Redis client when REDIS_URL is configured and reachable, otherwise None"""
+    global _redis_client, _redis_checked
+    if _redis_checked:
+        return _redis_client
+    _redis_checked = True
+
+    redis_url = os.environ.get("REDIS_URL")
+    if redis is None or not redis_url:
+        return None
+    try:
+        client = redis.Redis.from_url(redis_url)
+        client.ping()
+        _redis_client = client
+        logger.info("Connected to Redis")
+    except Exception as e:
+        logger.warning(f"Redis unavailable, falling back to local storage: {str(e)}")
+    return _redis_client